@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# ==============================================================
+# Tomas Bruna
+# Copyright 2021, Georgia Institute of Technology, USA
+#
+# Cost model of Spaln alignments. CPU time and peak memory of a single
+# alignment are modeled separately for the -Q3 and -Q7 modes as linear
+# functions of the product and of the sum of the gene and protein lengths.
+# The model only stores sums of the least squares normal equations, so it
+# can be updated with measurements from every run and saved to a json file
+# which persists across runs. Runs may share the model file: measurements of
+# a run are added to the sums in the file under an exclusive lock when the
+# model is saved. Peak memory is measured for Spaln started by a small
+# command server (commandServer.py); it cannot be lower than the memory of
+# the server (about 10 MB).
+# ==============================================================
+
+
+import fcntl
+import json
+import os
+
+
+MODES = ["-Q3", "-Q7"]
+TARGETS = ["cpuSeconds", "peakRssKb"]
+# Minimum number of measurements before a mode is considered fitted
+MIN_MEASUREMENTS = 10
+
+
+def features(geneLength, proteinLength):
+    """Features of a pair. The lengths are scaled so that the normal
+    equations are well conditioned.
+    """
+    return [1.0, geneLength * proteinLength / 1e6,
+            (geneLength + proteinLength) / 1e3]
+
+
+def solve(matrix, vector):
+    """Solve a small linear system by Gaussian elimination with partial
+    pivoting
+
+    Returns:
+        list: Solution or None if the system is singular
+    """
+    size = len(vector)
+    rows = [list(matrix[i]) + [vector[i]] for i in range(size)]
+    for col in range(size):
+        pivot = max(range(col, size), key=lambda r: abs(rows[r][col]))
+        if abs(rows[pivot][col]) < 1e-12:
+            return None
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        for r in range(col + 1, size):
+            factor = rows[r][col] / rows[col][col]
+            for c in range(col, size + 1):
+                rows[r][c] -= factor * rows[col][c]
+
+    solution = [0.0] * size
+    for r in reversed(range(size)):
+        solution[r] = (rows[r][size] -
+                       sum(rows[r][c] * solution[c]
+                           for c in range(r + 1, size))) / rows[r][r]
+    return solution
+
+
+class CostModel:
+
+    def __init__(self, path=None):
+        """Create a cost model, load previous measurements if the model file
+        exists
+
+        Args:
+            path (filepath): Model file
+        """
+        self.path = path
+        self.modes = {mode: self.emptyMode() for mode in MODES}
+        # Measurements added since the model was loaded or saved
+        self.added = {mode: self.emptyMode() for mode in MODES}
+        self.coefficients = {}
+
+        if path and os.path.isfile(path):
+            self.modes.update(self.load())
+        self.fit()
+
+    def load(self):
+        with open(self.path) as f:
+            return json.load(f)["modes"]
+
+    def emptyMode(self):
+        size = len(features(0, 0))
+        return {"n": 0, "xtx": [[0.0] * size for i in range(size)],
+                "xty": {target: [0.0] * size for target in TARGETS},
+                "max": {target: 0 for target in TARGETS}}
+
+    def add(self, mode, geneLength, proteinLength, cpuSeconds, peakRssKb):
+        """Add a measured alignment
+
+        Args:
+            mode (string): Spaln mode, -Q3 or -Q7
+            geneLength (int): Length of the seed gene region
+            proteinLength (int): Length of the protein
+            cpuSeconds (float): CPU time of the alignment
+            peakRssKb (int): Peak memory of the alignment
+        """
+        x = features(geneLength, proteinLength)
+        for stats in [self.modes[mode], self.added[mode]]:
+            stats["n"] += 1
+            for i in range(len(x)):
+                for j in range(len(x)):
+                    stats["xtx"][i][j] += x[i] * x[j]
+            for target, value in zip(TARGETS, [cpuSeconds, peakRssKb]):
+                for i in range(len(x)):
+                    stats["xty"][target][i] += x[i] * value
+                stats["max"][target] = max(stats["max"][target], value)
+
+    def fit(self):
+        """Fit the model coefficients from the accumulated measurements"""
+        self.coefficients = {}
+        for mode, stats in self.modes.items():
+            if stats["n"] < MIN_MEASUREMENTS:
+                continue
+            # Small ridge term keeps the system solvable when the
+            # measurements do not span all features
+            xtx = [[value + (1e-9 * stats["n"] if i == j else 0)
+                    for j, value in enumerate(row)]
+                   for i, row in enumerate(stats["xtx"])]
+            coefficients = {}
+            for target in TARGETS:
+                solution = solve(xtx, stats["xty"][target])
+                if solution is None:
+                    break
+                coefficients[target] = solution
+            else:
+                self.coefficients[mode] = coefficients
+
+    def isFitted(self, mode):
+        return mode in self.coefficients
+
+    def predict(self, mode, geneLength, proteinLength):
+        """Predict the cost of an alignment
+
+        Args:
+            mode (string): Spaln mode, -Q3 or -Q7
+            geneLength (int): Length of the seed gene region
+            proteinLength (int): Length of the protein
+
+        Returns:
+            tuple: Predicted CPU seconds and peak memory in kB. None if the
+                   mode is not fitted yet.
+        """
+        if not self.isFitted(mode):
+            return None
+        x = features(geneLength, proteinLength)
+        prediction = []
+        for target in TARGETS:
+            coefficients = self.coefficients[mode][target]
+            prediction.append(max(0.0, sum(c * v for c, v in
+                                           zip(coefficients, x))))
+        return tuple(prediction)
+
+    def save(self):
+        """Add the measurements of this run to the model file. The file is
+        re-read under an exclusive lock, so measurements saved by other runs
+        in the meantime are kept. The model is refitted with all
+        measurements.
+        """
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            modes = {mode: self.emptyMode() for mode in MODES}
+            if os.path.isfile(self.path):
+                modes.update(self.load())
+            for mode, added in self.added.items():
+                merge(modes.setdefault(mode, self.emptyMode()), added)
+
+            tmp = self.path + ".tmp" + str(os.getpid())
+            with open(tmp, "w") as f:
+                json.dump({"modes": modes}, f, indent=2)
+            os.replace(tmp, self.path)
+
+        self.modes = modes
+        self.added = {mode: self.emptyMode() for mode in MODES}
+        self.fit()
+
+
+def merge(stats, added):
+    """Add sums of measurements to the sums of a mode"""
+    stats["n"] += added["n"]
+    for i, row in enumerate(added["xtx"]):
+        for j, value in enumerate(row):
+            stats["xtx"][i][j] += value
+    for target in TARGETS:
+        for i, value in enumerate(added["xty"][target]):
+            stats["xty"][target][i] += value
+        stats["max"][target] = max(stats["max"][target],
+                                   added["max"][target])
@@ -5,52 +5,109 @@
 #
 # This script selects a subset of CDS regions which upstream coordinate is
 # either a start codon in starts.gff or neighbors an intron defined in
-# starts.gff.
+# introns.gff on the same contig and strand.
 # ==============================================================
 
 
-import csv
 import argparse
-
-
-intronEnds = set()
-starts = set()
-
-
-def loadHints(hints):
-    for row in csv.reader(open(hints), delimiter='\t'):
-        if row[2].lower() == "intron":
-            if (row[6] == "+"):
-                intronEnds.add(int(row[4]))
-            elif row[6] == "-":
-                intronEnds.add(int(row[3]))
-        elif row[2].lower() == "start_codon":
-            if (row[6] == "+"):
-                starts.add(int(row[3]))
-            elif(row[6] == "-"):
-                starts.add(int(row[4]))
-
-    return intronEnds, starts
-
-
-def filterCDS(cds):
-    for row in csv.reader(open(cds), delimiter='\t'):
-        if row[2].lower() == "cds":
-            if (row[6] == "+"):
-                cdsStart = int(row[3])
-                if ((cdsStart - 1) in intronEnds) or (cdsStart in starts):
-                    print("\t".join(row))
-            elif row[6] == "-":
-                cdsStart = int(row[4])
-                if ((cdsStart + 1) in intronEnds) or (cdsStart in starts):
-                    print("\t".join(row))
+import array
+import bisect
+
+from gffRecords import GffWriter, readGff
+
+
+class UpstreamIndex:
+
+    def __init__(self):
+        """Create an empty index of intron ends and start codons. The
+        coordinates are held per contig and strand in compact sorted arrays
+        and looked up by binary search.
+        """
+        self.intronEnds = {}
+        self.starts = {}
+        self.sorted = True
+
+    def add(self, row):
+        """Add the coordinate of an intron end or of a start codon
+
+        Args:
+            row: Parsed gff row with an intron or a start codon
+        """
+        feature = row[2].lower()
+        if feature == "intron":
+            coordinates = self.intronEnds
+            position = {"+": 4, "-": 3}.get(row[6])
+        elif feature == "start_codon":
+            coordinates = self.starts
+            position = {"+": 3, "-": 4}.get(row[6])
+        else:
+            return
+        if position is None:
+            return
+
+        key = (row[0], row[6])
+        if key not in coordinates:
+            coordinates[key] = array.array("q")
+        coordinates[key].append(int(row[position]))
+        self.sorted = False
+
+    def hasUpstreamSupport(self, row):
+        """Check whether the upstream coordinate of a CDS is a start codon or
+        whether it neighbors an intron on the same contig and strand.
+
+        Args:
+            row: Parsed gff row with the CDS
+        """
+        if row[2].lower() != "cds":
+            return False
+        if row[6] == "+":
+            cdsStart = int(row[3])
+            intronEnd = cdsStart - 1
+        elif row[6] == "-":
+            cdsStart = int(row[4])
+            intronEnd = cdsStart + 1
+        else:
+            return False
+
+        if not self.sorted:
+            self.__sort()
+        key = (row[0], row[6])
+        return contains(self.intronEnds.get(key), intronEnd) or \
+            contains(self.starts.get(key), cdsStart)
+
+    def __sort(self):
+        for coordinates in [self.intronEnds, self.starts]:
+            for key, values in coordinates.items():
+                coordinates[key] = array.array("q", sorted(set(values)))
+        self.sorted = True
+
+
+def contains(values, value):
+    """Check whether a sorted array contains a value"""
+    if values is None:
+        return False
+    i = bisect.bisect_left(values, value)
+    return i < len(values) and values[i] == value
+
+
+def loadHints(hints, index):
+    for row in readGff(hints):
+        index.add(row)
+
+
+def filterCDS(cds, index):
+    with GffWriter() as output:
+        for row in readGff(cds):
+            if index.hasUpstreamSupport(row):
+                output.write(row)
 
 
 def main():
     args = parseCmd()
-    loadHints(args.starts)
-    loadHints(args.introns)
-    filterCDS(args.cds)
+    index = UpstreamIndex()
+    loadHints(args.starts, index)
+    loadHints(args.introns, index)
+    filterCDS(args.cds, index)
 
 
 def parseCmd():
@@ -58,7 +115,9 @@ def parseCmd():
     parser = argparse.ArgumentParser(description='This script selects a subset \
                                      of CDS regions which upstream coordinate \
                                      is either a start codon in starts.gff or \
-                                     neighbors an intron defined in starts.gff.')
+                                     neighbors an intron defined in \
+                                     introns.gff on the same contig and \
+                                     strand.')
 
     parser.add_argument('cds', metavar='cds.gff', type=str,
                         help='CDS segments to be filtered')
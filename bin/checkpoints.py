@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# ==============================================================
+# Tomas Bruna
+# Copyright 2021, Georgia Institute of Technology, USA
+#
+# Manifest of finished ProtHint stages. For each stage, the manifest records
+# fingerprints of its input files, its parameters and fingerprints of its
+# output files. A stage can be skipped when the run is resumed if its inputs
+# and parameters did not change and its outputs were not modified since
+# (other than by subsequent stages which updated the outputs in place).
+#
+# A fingerprint is the size and modification time of a file. Content hashes
+# are added only when they are requested (resumed runs), so that normal runs
+# do not read the large inputs and outputs once more. A file whose size
+# matches its fingerprint but modification time does not is hashed and
+# compared to the recorded hash, if there is one.
+# ==============================================================
+
+
+import hashlib
+import json
+import os
+import threading
+
+
+CHUNK_SIZE = 16 * 1024 * 1024
+
+
+def sameFile(fingerprint, other):
+    """Check whether two fingerprints describe the same file content"""
+    if fingerprint["size"] != other["size"]:
+        return False
+    if fingerprint["mtime"] == other["mtime"]:
+        return True
+    return fingerprint["sha1"] is not None and \
+        fingerprint["sha1"] == other["sha1"]
+
+
+class Manifest:
+
+    def __init__(self, path, load=True, hashContents=True):
+        """Create a manifest stored in a json file
+
+        Args:
+            path (filepath): Path to the manifest file
+            load (bool): Whether to load stages recorded by a previous run.
+                         If False, the previous manifest is discarded.
+            hashContents (bool): Whether to record content hashes in the
+                                 fingerprints of files
+        """
+        self.path = path
+        self.hashContents = hashContents
+        self.stages = {}
+        # Hashes of files indexed by path, size and modification time. Files
+        # which were not changed are therefore hashed only once.
+        self.hashCache = {}
+        # Stages executed concurrently record their results from different
+        # threads
+        self.lock = threading.Lock()
+
+        if load and os.path.isfile(path):
+            with open(path) as f:
+                self.stages = json.load(f)["stages"]
+            for stage in self.stages.values():
+                for fingerprint in list(stage["inputs"].values()) + \
+                        list(stage["outputs"].values()):
+                    if fingerprint is not None and \
+                       fingerprint["sha1"] is not None:
+                        self.__cacheHash(fingerprint)
+
+    def __cacheHash(self, fingerprint):
+        key = (fingerprint["path"], fingerprint["size"], fingerprint["mtime"])
+        self.hashCache[key] = fingerprint["sha1"]
+
+    def __hash(self, path, stat):
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        if key not in self.hashCache:
+            sha1 = hashlib.sha1()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    sha1.update(chunk)
+            self.hashCache[key] = sha1.hexdigest()
+        return self.hashCache[key]
+
+    def fingerprint(self, path):
+        """Compute the fingerprint of a file
+
+        Args:
+            path (filepath): Path to the file
+
+        Returns:
+            dict: Path, size, modification time and a content hash of the
+                  file (None if hashContents is False). None if the file
+                  does not exist.
+        """
+        path = os.path.abspath(path)
+        if not os.path.isfile(path):
+            return None
+
+        stat = os.stat(path)
+        sha1 = None
+        if self.hashContents:
+            sha1 = self.__hash(path, stat)
+
+        return {"path": path, "size": stat.st_size,
+                "mtime": stat.st_mtime_ns, "sha1": sha1}
+
+    def matches(self, path, recorded):
+        """Check whether a file matches its recorded fingerprint. The file is
+        hashed only if its size matches and its modification time does not.
+
+        Args:
+            path (filepath): Path to the file
+            recorded (dict): Recorded fingerprint or None
+
+        Returns:
+            bool: True if the file exists and matches the fingerprint
+        """
+        path = os.path.abspath(path)
+        if recorded is None or not os.path.isfile(path):
+            return False
+        stat = os.stat(path)
+        if stat.st_size != recorded["size"]:
+            return False
+        if stat.st_mtime_ns == recorded["mtime"]:
+            return True
+        if recorded["sha1"] is None:
+            return False
+        return self.__hash(path, stat) == recorded["sha1"]
+
+    def fingerprintInputs(self, inputs):
+        """Compute fingerprints of stage inputs
+
+        Args:
+            inputs (dict): Paths to input files indexed by input names
+
+        Returns:
+            dict: Fingerprints indexed by input names
+        """
+        return {name: self.fingerprint(path) for name, path in inputs.items()}
+
+    def isValid(self, name, inputs, params, outputs):
+        """Check whether results of a recorded stage are still valid
+
+        Args:
+            name (string): Name of the stage
+            inputs (dict): Paths to input files indexed by input names
+            params (dict): Parameters of the stage
+            outputs (list): Paths to output files
+
+        Returns:
+            bool: True if the stage does not need to be executed again
+        """
+        if name not in self.stages:
+            return False
+        stage = self.stages[name]
+
+        if stage["params"] != json.loads(json.dumps(params)):
+            return False
+
+        outputs = [os.path.abspath(output) for output in outputs]
+        if sorted(outputs) != sorted(stage["outputs"]):
+            return False
+
+        if sorted(inputs) != sorted(stage["inputs"]):
+            return False
+        for inputName, path in inputs.items():
+            if os.path.abspath(path) in outputs:
+                # Inputs modified in place are checked as outputs
+                continue
+            if not self.matches(path, stage["inputs"][inputName]):
+                return False
+
+        for output in outputs:
+            if not self.matches(output,
+                                self.__expectedFingerprint(name, output)):
+                return False
+
+        return True
+
+    def __expectedFingerprint(self, name, output):
+        """Get the expected fingerprint of a stage output, taking into
+        account subsequent stages which modified the output in place.
+
+        Args:
+            name (string): Name of the stage which created the output
+            output (filepath): Absolute path to the output file
+
+        Returns:
+            dict: Fingerprint of the output file
+        """
+        expected = self.stages[name]["outputs"][output]
+        if expected is None:
+            return None
+        later = False
+        for stageName, stage in self.stages.items():
+            if stageName == name:
+                later = True
+                continue
+            if not later or output not in stage["outputs"]:
+                continue
+            for fingerprint in stage["inputs"].values():
+                if fingerprint is not None and \
+                   fingerprint["path"] == output and \
+                   sameFile(fingerprint, expected) and \
+                   stage["outputs"][output] is not None:
+                    expected = stage["outputs"][output]
+                    break
+
+        return expected
+
+    def result(self, name):
+        """Return the value returned by a recorded stage"""
+        return self.stages[name]["result"]
+
+    def record(self, name, inputs, params, outputs, result=None):
+        """Record a finished stage and save the manifest
+
+        Args:
+            name (string): Name of the stage
+            inputs (dict): Input fingerprints computed before the stage was
+                           executed, indexed by input names
+            params (dict): Parameters of the stage
+            outputs (list): Paths to output files
+            result: Value returned by the stage (must be json serializable)
+        """
+        # Re-insert the stage so that the order of stages in the manifest
+        # follows the order in which they were executed
+        outputs = {os.path.abspath(output): self.fingerprint(output)
+                   for output in outputs}
+        with self.lock:
+            self.stages.pop(name, None)
+            self.stages[name] = {
+                "params": json.loads(json.dumps(params)),
+                "inputs": inputs,
+                "outputs": outputs,
+                "result": result
+            }
+            self.save()
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"stages": self.stages}, f, indent=2)
+        os.replace(tmp, self.path)
@@ -10,42 +10,98 @@
 # all loci containing the given hint. The representative alignment score of a
 # combined hint is the maximum from the scores of corresponding redundant
 # hints.
+#
+# By default, all combined hints are kept in memory. Hints can be combined
+# in parallel processes, each of which reads one part of the input file;
+# hints combined in the parts are merged in the input order, so the output is
+# the same as from a single process. In the low
+# memory mode, the input is sorted so that redundant hints are adjacent and
+# each combined hint is printed as soon as all its raw hints are read.
 # ==============================================================
 
 
 import argparse
-import csv
-import re
+import os
+import subprocess
+import sys
+from multiprocessing import Pool
+
+from gffRecords import GffWriter, parseRows, readGff, readGffRange, splitFile
+
+
+# Sort keys which place hints with the same signature next to each other
+SORT_KEYS = ["-k1,1", "-k3,5", "-k7,8"]
+INTERNED_COLUMNS = [0, 1, 2, 6, 7]
 
 
 class Hint(object):
 
-    def __init__(self, row):
+    __slots__ = ("row", "al_score", "topProt", "splice_sites", "counts")
+
+    def __init__(self, row, al_score, topProt, splice_sites, seed):
+        """Create a combined hint from its first raw hint
+
+        Args:
+            row: Parsed gff row, only the first 8 columns are used
+            al_score (float): Alignment score, None if not present
+            topProt (string): Value of the topProt feature or None
+            splice_sites (string): Value of the splice_sites feature or None
+            seed (string): ID of the seed gene
+        """
         self.row = row[0:8]
-        al_score = extractFeatureGff(row[8], "al_score")
-        if al_score:
-            self.al_score = float(al_score)
+        # Contig, source, feature type, strand and phase repeat in many hints
+        for i in INTERNED_COLUMNS:
+            self.row[i] = sys.intern(self.row[i])
+        if al_score is not None:
+            self.al_score = al_score
         else:
             self.al_score = -1
 
-        self.topProt = extractFeatureGff(row[8], "topProt")
-        self.splice_sites = extractFeatureGff(row[8], "splice_sites")
+        self.topProt = topProt
+        self.splice_sites = splice_sites
 
         self.counts = {}
-        self.updateCount(extractFeatureGff(row[8], "seed_gene_id"), row[5])
+        self.updateCount(seed, row[5])
 
-    def update(self, row):
-        al_score = extractFeatureGff(row[8], "al_score")
-        if al_score and float(al_score) > self.al_score:
-            self.al_score = float(al_score)
+    def update(self, score, al_score, topProt, splice_sites, seed):
+        """Add a redundant raw hint
+
+        Args:
+            score (string): Score column of the raw hint
+            al_score (float): Alignment score, None if not present
+            topProt (string): Value of the topProt feature or None
+            splice_sites (string): Value of the splice_sites feature or None
+            seed (string): ID of the seed gene
+        """
+        if al_score is not None and al_score > self.al_score:
+            self.al_score = al_score
 
         if self.topProt is None:
-            self.topProt = extractFeatureGff(row[8], "topProt")
+            self.topProt = topProt
 
         if self.splice_sites is None:
-            self.splice_sites = extractFeatureGff(row[8], "splice_sites")
+            self.splice_sites = splice_sites
+
+        self.updateCount(seed, score)
+
+    def merge(self, other):
+        """Add a combined hint with the same signature, which was combined
+        from raw hints following the raw hints of this hint in the input
 
-        self.updateCount(extractFeatureGff(row[8], "seed_gene_id"), row[5])
+        Args:
+            other (Hint): Combined hint
+        """
+        if other.al_score > self.al_score:
+            self.al_score = other.al_score
+
+        if self.topProt is None:
+            self.topProt = other.topProt
+
+        if self.splice_sites is None:
+            self.splice_sites = other.splice_sites
+
+        for seed, count in other.counts.items():
+            self.counts[seed] = self.counts.get(seed, 0) + count
 
     def updateCount(self, seed, score):
         if score == ".":
@@ -58,7 +114,7 @@ class Hint(object):
 
         self.counts[seed] += update
 
-    def print(self):
+    def format(self):
         self.row[5] = str(max(self.counts.values()))
         extraFeatures = "."
         if self.al_score != -1:
@@ -79,7 +135,7 @@ class Hint(object):
                                                     "topProt=" +
                                                     self.topProt)
 
-        print("\t".join(self.row) + "\t" + extraFeatures)
+        return "\t".join(self.row) + "\t" + extraFeatures
 
     def addFeatureToString(self, featureString, newFeature):
         if featureString == ".":
@@ -88,42 +144,176 @@ class Hint(object):
             return featureString + " " + newFeature + ";"
 
 
-def extractFeatureGff(text, feature):
-    regex = "(^|[ ;])" + feature + '=([^;]+);'
-    match = re.search(regex, text)
-    if match:
-        return match.groups()[1]
-    else:
-        return None
-
-
 def getSignature(row):
     return row[0] + "_" + row[2] + "_" + row[3] + "_" + row[4] + "_" + row[6] \
            + "_" + row[7]
 
 
+def hintFeatures(row):
+    """Parse the features of a raw hint which are used in combined hints
+
+    Args:
+        row: Parsed gff row
+
+    Returns:
+        tuple: Alignment score (None if not present), values of the topProt
+               and splice_sites features and the seed gene ID
+    """
+    attributes = row.attributes
+    al_score = attributes.get("al_score")
+    if al_score:
+        al_score = float(al_score)
+    else:
+        al_score = None
+
+    # The same seed IDs are repeated in many hints
+    seed = attributes.get("seed_gene_id")
+    if seed is not None:
+        seed = sys.intern(seed)
+
+    return (al_score, attributes.get("topProt"),
+            attributes.get("splice_sites"), seed)
+
+
+def addHint(hints, row):
+    signature = getSignature(row)
+    if signature not in hints:
+        hints[signature] = Hint(row, *hintFeatures(row))
+    else:
+        hints[signature].update(row[5], *hintFeatures(row))
+
+
 def combineHints(input):
     hints = {}
 
-    for row in csv.reader(open(input), delimiter='\t'):
-        signature = getSignature(row)
-        if signature not in hints:
-            hints[signature] = Hint(row)
-        else:
-            hints[signature].update(row)
+    for row in readGff(input):
+        addHint(hints, row)
+
+    return hints
+
+
+def combineRange(task):
+    """Combine hints in a byte range of the input
 
+    Args:
+        task (tuple): Input file and the start and end of the range
+
+    Returns:
+        dict: Combined hints by their signatures, in the input order
+    """
+    input, start, end = task
+    hints = {}
+    for row in readGffRange(input, start, end):
+        addHint(hints, row)
     return hints
 
 
+def mergeHints(parts):
+    """Merge hints combined in consecutive parts of the input. The result is
+    the same as if all raw hints were combined together.
+
+    Args:
+        parts: Dictionaries with combined hints of the parts, in the input
+               order
+
+    Returns:
+        dict: Combined hints by their signatures, in the input order
+    """
+    hints = {}
+    for part in parts:
+        for signature, hint in part.items():
+            if signature in hints:
+                hints[signature].merge(hint)
+            else:
+                hints[signature] = hint
+    return hints
+
+
+def combineHintsParallel(input, threads):
+    """Combine hints in parts of the input in parallel. Each part is read and
+    parsed only by one process.
+
+    Args:
+        input (filepath): Input with raw hints
+        threads (int): Number of processes and parts
+
+    Returns:
+        dict: Combined hints in the same order as from combineHints
+    """
+    tasks = [(input, start, end) for start, end in splitFile(input, threads)]
+    with Pool(processes=threads) as pool:
+        return mergeHints(pool.imap(combineRange, tasks))
+
+
 def printHints(hints):
-    for key in hints:
-        hints[key].print()
+    with GffWriter() as output:
+        for hint in hints.values():
+            output.writeLine(hint.format())
+
+
+def sortedRows(input, buffer, keys=SORT_KEYS, stable=False):
+    """Sort raw hints, by default so that hints with the same signature are
+    adjacent
+
+    Args:
+        input (filepath): Input with raw hints
+        buffer (string): Size of the main memory buffer of the sort command
+        keys (list): Sort keys
+        stable (bool): Whether to keep the input order of rows with equal
+                       keys
+
+    Yields:
+        Record: Sorted rows
+    """
+    environment = dict(os.environ, LC_ALL="C")
+    options = ["-t", "\t", "-S", buffer]
+    if stable:
+        options.append("-s")
+    sort = subprocess.Popen(["sort"] + options + keys +
+                            [input], stdout=subprocess.PIPE,
+                            env=environment, universal_newlines=True)
+    yield from parseRows(sort.stdout)
+    sort.stdout.close()
+    if sort.wait() != 0:
+        sys.exit("error: Sorting of " + input + " failed.")
+
+
+def printSortedHints(rows):
+    """Combine and print hints from rows in which hints with the same
+    signature are adjacent. Only one combined hint is kept in memory.
+
+    Args:
+        rows: Iterable with parsed rows
+    """
+    with GffWriter() as output:
+        hint = None
+        prevSignature = None
+        for row in rows:
+            signature = getSignature(row)
+            if signature == prevSignature:
+                hint.update(row[5], *hintFeatures(row))
+                continue
+
+            if hint is not None:
+                output.writeLine(hint.format())
+            hint = Hint(row, *hintFeatures(row))
+            prevSignature = signature
+
+        if hint is not None:
+            output.writeLine(hint.format())
 
 
 def main():
     args = parseCmd()
-    hints = combineHints(args.input)
-    printHints(hints)
+    if args.sorted:
+        printSortedHints(readGff(args.input))
+    elif args.lowMemory:
+        printSortedHints(sortedRows(args.input, args.sortBuffer))
+    elif args.threads > 1:
+        printHints(combineHintsParallel(args.input, args.threads))
+    else:
+        hints = combineHints(args.input)
+        printHints(hints)
 
 
 def parseCmd():
@@ -140,8 +330,32 @@ def parseCmd():
     parser.add_argument('input', metavar='spaln.gff', type=str,
                         help='Input with raw hints generated by the Spaln \
         boundary scorer')
-
-    return parser.parse_args()
+    parser.add_argument('--lowMemory', action='store_true',
+                        help='Sort the input with the external sort command \
+        and combine adjacent hints, keeping only one combined hint in memory. \
+        The output is ordered by hint signatures instead of the order of the \
+        first occurrence of each hint in the input.')
+    parser.add_argument('--sorted', action='store_true',
+                        help='The input is already sorted so that hints with \
+        the same signature are adjacent, e.g. by "LC_ALL=C sort -t$\'\\t\' \
+        -k1,1 -k3,5 -k7,8". Adjacent hints are combined in the low memory \
+        mode without sorting.')
+    parser.add_argument('--sortBuffer', type=str, default='1G',
+                        help='Size of the main memory buffer of the sort \
+        command in the --lowMemory mode. Default = 1G.')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='Number of processes which combine parts of the \
+        input in parallel. The output is identical to the output of a single \
+        process. Cannot be combined with --lowMemory and --sorted. \
+        Default = 1.')
+
+    args = parser.parse_args()
+
+    if args.threads > 1 and (args.lowMemory or args.sorted):
+        sys.exit("error: --threads cannot be combined with --lowMemory or "
+                 "--sorted.")
+
+    return args
 
 
 if __name__ == '__main__':
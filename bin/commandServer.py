@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# ==============================================================
+# Tomas Bruna
+# Copyright 2021, Georgia Institute of Technology, USA
+#
+# Small server which runs pipelines of commands for a parent process and
+# measures their CPU time and peak memory. On Linux, a child process starts
+# with the peak RSS of the process which started it. Commands started
+# directly by a parent which holds a lot of memory (e.g. all sequences loaded
+# by splicedAlignment.py) would all report at least the memory of the
+# parent. Commands started by this small server report at least the memory
+# of the server (about 10 MB) instead.
+#
+# Each request is a json line written to the stdin of the server with the
+# commands of the pipeline and flags saying which commands have their stderr
+# discarded. The commands are connected by pipes. The server replies with a
+# json line with the exit status, CPU seconds and peak RSS (kB) of each
+# command and the length of the output of the last command, followed by the
+# output itself.
+# ==============================================================
+
+
+import json
+import os
+import subprocess
+import sys
+
+
+class CommandServer:
+
+    def __init__(self, env=None):
+        """Start the server
+
+        Args:
+            env (dict): Environment of the server and of the commands
+        """
+        self.process = subprocess.Popen([sys.executable,
+                                         os.path.abspath(__file__)],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, env=env)
+
+    def run(self, commands, quiet=None):
+        """Run a pipeline of commands
+
+        Args:
+            commands (list): Commands, each given as a list of arguments
+            quiet (list): Whether to discard stderr of each command. Stderr
+                          of all commands is kept by default.
+
+        Returns:
+            tuple: Output of the last command and a list with the exit
+                   status (negative signal number if the command was
+                   killed), CPU seconds and peak RSS in kB of each command
+        """
+        if quiet is None:
+            quiet = [False] * len(commands)
+        request = json.dumps({"commands": commands, "quiet": quiet})
+        try:
+            self.process.stdin.write(request.encode() + b"\n")
+            self.process.stdin.flush()
+            reply = self.process.stdout.readline()
+        except BrokenPipeError:
+            reply = b""
+        if not reply:
+            # Raised rather than exiting, the server is run from worker
+            # threads which cannot end the program
+            raise RuntimeError("The command server exited unexpectedly")
+        reply = json.loads(reply)
+        output = self.process.stdout.read(reply["length"])
+        return output, reply["usage"]
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            # The server already exited
+            pass
+        self.process.wait()
+        self.process.stdout.close()
+
+
+def exitStatus(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def runPipeline(commands, quiet):
+    processes = []
+    stdin = None
+    for command, discard in zip(commands, quiet):
+        process = subprocess.Popen(command, stdin=stdin,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL if discard
+                                   else None)
+        if stdin is not None:
+            stdin.close()
+        stdin = process.stdout
+        processes.append(process)
+
+    output = stdin.read()
+    stdin.close()
+    usage = []
+    for process in processes:
+        pid, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = exitStatus(status)
+        usage.append([process.returncode,
+                      rusage.ru_utime + rusage.ru_stime, rusage.ru_maxrss])
+    return output, usage
+
+
+def main():
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    for line in stdin:
+        request = json.loads(line)
+        try:
+            output, usage = runPipeline(request["commands"],
+                                        request["quiet"])
+        except OSError as error:
+            sys.stderr.write("error: Command server failed to run " +
+                             str(request["commands"]) + ": " + str(error) +
+                             "\n")
+            output, usage = b"", [[127, 0, 0]] * len(request["commands"])
+        reply = json.dumps({"length": len(output), "usage": usage})
+        stdout.write(reply.encode() + b"\n")
+        stdout.write(output)
+        stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
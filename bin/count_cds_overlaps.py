@@ -5,88 +5,122 @@
 #
 # Compute and print the number of CDS segments overlapping each start. CDS
 # regions which start before a start codon starting coordinate and end after a
-# start codon ending coordinate are considered to be overlapping. Both input
-# files (start codons and CDS coordinates in gff format) need to be sorted by
-# chromosome, start and end. For example like this: sort -k1,1 -k4,4n -k5,5n
-# starts.gff > starts_sorted.gff. The file with CDS coordinates can be collapsed
-# (with combineRawHints.py script) for faster execution of this script.
+# start codon ending coordinate are considered to be overlapping. The CDS
+# regions of each chromosome are indexed by their start and end coordinates,
+# so the input files do not need to be sorted and each start is processed in
+# logarithmic time. Starts are printed in the input order. The file with CDS
+# coordinates can be collapsed (with combineRawHints.py script) to reduce
+# memory.
 # ==============================================================
 
 
-import csv
 import argparse
+import bisect
+import itertools
+
+from gffRecords import GffWriter, readGff
+
+
+class CDSIndex:
+
+    def __init__(self, regions):
+        """Index CDS regions of one chromosome. The regions are held in
+        arrays sorted by their start and by their end coordinates with
+        prefix sums of their coverage, so that the coverage of regions
+        overlapping a start is computed with binary searches.
+
+        Args:
+            regions (list): (start, end, coverage) tuples in any order
+        """
+        byStart = sorted(regions)
+        self.starts = [region[0] for region in byStart]
+        self.startCoverage = [0] + list(itertools.accumulate(
+            region[2] for region in byStart))
+
+        byEnd = sorted(regions, key=lambda region: (region[1], region[0]))
+        self.ends = [region[1] for region in byEnd]
+        self.endStarts = [region[0] for region in byEnd]
+        self.endCoverage = [0] + list(itertools.accumulate(
+            region[2] for region in byEnd))
+        self.endRegionCoverage = [region[2] for region in byEnd]
+
+    def overlap(self, start, end):
+        """Return the coverage of regions which start before the start
+        coordinate and end after the end coordinate
+
+        Args:
+            start (int): Start coordinate of the start codon
+            end (int): End coordinate of the start codon
+        """
+        # Regions starting before the start
+        coverage = self.startCoverage[bisect.bisect_left(self.starts, start)]
+        # Minus regions starting before the start which do not end after
+        # the end: all regions ending before or at the end, except for the
+        # regions located within the start codon
+        coverage -= self.endCoverage[bisect.bisect_right(self.ends, end)]
+        for i in range(bisect.bisect_left(self.ends, start),
+                       bisect.bisect_right(self.ends, end)):
+            if self.endStarts[i] >= start:
+                coverage += self.endRegionCoverage[i]
+        return coverage
 
 
-class CDS:
+def loadCDS(cdsFileName):
+    return indexCDS(readGff(cdsFileName))
 
-    def __init__(self, start, end, coverage):
-        self.start = start
-        self.end = end
-        self.coverage = coverage
 
+def indexCDS(cdses):
+    """Index CDS regions for the countOverlaps function
 
-def loadCDS(cdsFileName):
-    codingSegments = {}
-    cdsFile = open(cdsFileName)
-    cdses = csv.reader(cdsFile, delimiter='\t')
-    for row in cdses:
-        if not row[0] in codingSegments:
-            codingSegments[row[0]] = []
+    Args:
+        cdses: Iterable with parsed CDS rows in any order. If the score
+               column contains a number, it is used as the coverage.
 
+    Returns:
+        dict: CDSIndex of each chromosome
+    """
+    regions = {}
+    for row in cdses:
         coverage = 1
         if row[5] != ".":
             coverage = int(row[5])
 
-        codingSegments[row[0]].append(CDS(int(row[3]),
-                                      int(row[4]), coverage))
-    cdsFile.close()
-    return codingSegments
+        regions.setdefault(row[0], []).append((int(row[3]), int(row[4]),
+                                               coverage))
+    return {chrom: CDSIndex(chromRegions)
+            for chrom, chromRegions in regions.items()}
 
 
 def filterStarts(startsFileName, cdsFileName):
     codingSegments = loadCDS(cdsFileName)
 
-    startsFile = open(startsFileName)
-    starts = csv.reader(startsFile, delimiter='\t')
+    with GffWriter() as output:
+        for start in countOverlaps(readGff(startsFileName), codingSegments):
+            output.write(start)
 
-    prevChromosome = ""
-    CDSpointer = 0
-    CDSNum = 0
 
-    for start in starts:
-        chrom = start[0]
-        startStart = int(start[3])
-        startEnd = int(start[4])
+def countOverlaps(starts, codingSegments):
+    """Add the CDS_overlap feature to starts
 
-        if prevChromosome != chrom:
-            CDSpointer = 0
-            CDSNum = len(codingSegments[chrom])
-
-        while (CDSpointer < CDSNum and
-               codingSegments[chrom][CDSpointer].end <= startEnd):
-            # Shift CDS starting point to first CDS which can overlap
-            # with any of the subsequent starts
-            CDSpointer += 1
+    Args:
+        starts: Iterable with parsed start rows in any order
+        codingSegments: CDS regions indexed by indexCDS
 
+    Yields:
+        list: Start rows with the CDS_overlap feature, in the input order
+    """
+    for start in starts:
         startOverlaps = 0
-        i = CDSpointer
-        while i < CDSNum and codingSegments[chrom][i].start < startStart:
-            # While any CDS starts before the current start
-            if (codingSegments[chrom][i].start < startStart
-               and codingSegments[chrom][i].end > startEnd):
-                startOverlaps += codingSegments[chrom][i].coverage
-            i += 1
+        if start[0] in codingSegments:
+            startOverlaps = codingSegments[start[0]].overlap(int(start[3]),
+                                                             int(start[4]))
 
         if start[8] == ".":
             start[8] = "CDS_overlap=" + str(startOverlaps) + ";"
         else:
             start[8] += " CDS_overlap=" + str(startOverlaps) + ";"
 
-        print("\t".join(start))
-
-        prevChromosome = chrom
-
-    startsFile.close()
+        yield start
 
 
 def main():
@@ -99,16 +133,14 @@ def parseCmd():
     parser = argparse.ArgumentParser(description='Compute and print the number of CDS  \
         segments overlapping each start. CDS regions which start before a start codon \
         starting coordinate and end after a start codon ending coordinate are considered \
-        to be overlapping. Both input files (start codons and CDS coordinates in gff\
-        format) need to be sorted by chromosome, start and end. For example like this: \
-        sort -k1,1 -k4,4n -k5,5n starts.gff > starts_sorted.gff. The file with CDS \
-        coordinates can be collapsed (with combineRawHints.py script) for faster\
-        execution of this script.')
+        to be overlapping. The input files do not need to be sorted; starts are \
+        printed in the input order. The file with CDS coordinates can be \
+        collapsed (with combineRawHints.py script) to reduce memory.')
 
     parser.add_argument('starts', metavar='starts.gff', type=str,
-                        help='Sorted start codons in gff format.')
+                        help='Start codons in gff format.')
     parser.add_argument('cds', metavar='cds.gff', type=str,
-                        help='Sorted CDS regions in gff format. If the 6th score column \
+                        help='CDS regions in gff format. If the 6th score column \
                         contains a number, this number is treated as coverage of the \
                         given CDS region.')
 
@@ -8,17 +8,57 @@
 
 
 import argparse
+import array
+import bisect
 import csv
+import heapq
+import itertools
+import operator
+import pickle
+import shutil
 import tempfile
 import sys
 import os
 import subprocess
 import math
-from multiprocessing import Pool, Lock
+from multiprocessing import Pool
 import splitSeedCluster
+from gffRecords import readGff
 
-seedLock = Lock()
-pairsLock = Lock()
+# Hits are sorted in memory if the size of their DIAMOND output multiplied by
+# this factor fits into the memory limit of a worker (--sortMemory divided by
+# --threads). The factor covers the typed hits, their lines and sort keys
+# held by Python and all later stages of a worker; the measured peak of a
+# worker is about 17 times the size of its hits.
+SORT_MEMORY_FACTOR = 20
+# Hits are partitioned by contig and strand. Contiguous ranges of partitions
+# (shards) are processed by the workers; more shards than threads balance the
+# load of the workers.
+SHARDS_PER_THREAD = 4
+# Approximate memory (in bytes) of a typed hit held in a buffer. Hits are
+# flushed from buffers to binary files before the buffers exceed the memory
+# limit of a worker.
+BUFFERED_HIT_BYTES = 300
+MIN_BUFFERED_HITS = 1000
+# Query and target coordinates of hits
+COORDINATE_COLUMNS = [2, 3, 4, 5]
+
+
+def coordinatePartition(row):
+    return row[0]
+
+
+def strandPartition(row):
+    # The strand is either "+" or "-", "-" goes first (reversed sort key)
+    return row[7] != "-", row[0]
+
+
+# Sort orders of hits. Each order has the keys of the external sort command
+# and the partition of the in-memory sort. The in-memory sort orders hits by
+# their partitions, then by the start and end coordinates and finally by the
+# whole lines, which is the order of the external sort in the C locale.
+COORDINATE_ORDER = ("-k1,1 -k3,3n -k4,4n", coordinatePartition)
+STRAND_COORDINATE_ORDER = ("-k8,8r -k1,1 -k3,3n -k4,4n", strandPartition)
 
 
 def systemCall(cmd):
@@ -31,25 +71,116 @@ def getSeedString(row):
 
 
 def sortSingle(args):
-    systemCall("sort " + args[1] + " " + args[0] + " > " +
+    systemCall("LC_ALL=C sort -t $'\\t' " + args[1] + " " + args[0] + " > " +
                args[0] + ".sorted")
 
 
 def append(inputName, outputName):
     with open(outputName, "a") as outfile:
         with open(inputName) as infile:
-            outfile.write(infile.read())
+            shutil.copyfileobj(infile, outfile)
+
+
+def formatHit(row):
+    return "\t".join(map(str, row))
+
+
+def parseHit(line):
+    """Parse a line of a spilled hit into a typed hit: query and target
+    coordinates are integers, other columns (including the score, which is
+    only converted when hits are merged) are strings.
+    """
+    row = line.rstrip("\n").split("\t")
+    for i in COORDINATE_COLUMNS:
+        row[i] = int(row[i])
+    return row
+
+
+class HitFile():
+    """Hits spilled to a text file, the file can be read repeatedly"""
+
+    def __init__(self, path):
+        self.path = path
 
+    def __iter__(self):
+        with open(self.path) as f:
+            for line in f:
+                yield parseHit(line)
 
-def fastSort(inputFile, sortString, threads):
-    """ Fast, parallel sort. Other parts of this script are not parallelized
-    since they only involve a linear traversal of the input file.
+
+def fitsInMemory(size, memory):
+    """Return whether hits of a given size (in bytes of the DIAMOND output)
+    fit into a memory limit given in MB"""
+    return size * SORT_MEMORY_FACTOR <= memory * 1024 ** 2
+
+
+def bufferSize(memory):
+    """Return the number of typed hits which can be buffered within a memory
+    limit given in MB"""
+    return max(MIN_BUFFERED_HITS, int(memory * 1024 ** 2 / BUFFERED_HIT_BYTES))
+
+
+def sortHits(hits, order):
+    """Sort hits in memory, in the same order as the external sort
+
+    Args:
+        hits: Typed hits
+        order: Sort order, for example COORDINATE_ORDER
+
+    Yields:
+        list: Sorted hits. Memory of each partition is released as soon as
+              its hits are passed on.
+    """
+    groups = {}
+    for row in hits:
+        partition = order[1](row)
+        if partition not in groups:
+            groups[partition] = []
+        groups[partition].append((row[2], row[3], formatHit(row), row))
+
+    for partition in sorted(groups):
+        partitionHits = groups.pop(partition)
+        partitionHits.sort()
+        for hit in partitionHits:
+            yield hit[3]
+
+
+def spillAndSort(hits, order, threads, spillDir):
+    """Sort hits which do not fit into memory with the external sort
+
+    Args:
+        hits: Typed hits
+        order: Sort order, for example COORDINATE_ORDER
+        threads: How many threads to use in the external sort
+        spillDir: Folder for the spilled hits
+
+    Returns:
+        HitFile: Sorted hits
+    """
+    spill = tempfile.NamedTemporaryFile(mode="w", prefix="spill",
+                                        dir=spillDir, delete=False)
+    for row in hits:
+        spill.write(formatHit(row) + "\n")
+    spill.close()
+    externalSort(spill.name, order[0], threads)
+    return HitFile(spill.name)
+
+
+def externalSort(inputFile, sortString, threads):
+    """ Fast, parallel sort of files which do not fit into memory. Other
+    parts of this script are not parallelized since they only involve a
+    linear traversal of the input file.
 
     Args:
         inputFile: The file to sort
         sortString: Sorting keys
         threads: How many threads to use
     """
+    if threads == 1:
+        systemCall("LC_ALL=C sort -t $'\\t' " + sortString + " -o " +
+                   inputFile + " " + inputFile)
+        return
+
     sortFolder = tempfile.TemporaryDirectory(prefix="sort", dir=".")
 
     # Using wc -l is the fastest way
@@ -66,128 +197,213 @@ def fastSort(inputFile, sortString, threads):
                "/raw -a 5 -l " + str(linesPerFile))
 
     sortFiles = os.listdir(sortFolder.name)
-    pool = Pool(processes=threads)
-    pool.map(sortSingle, [[sortFolder.name + "/" + x,
-                           sortString] for x in sortFiles])
+    with Pool(processes=threads) as pool:
+        pool.map(sortSingle, [[sortFolder.name + "/" + x,
+                               sortString] for x in sortFiles])
 
-    systemCall("sort " + sortString + " -m " + sortFolder.name + "/*.sorted" +
-               " > " + inputFile)
+    systemCall("LC_ALL=C sort -t $'\\t' " + sortString + " -m " +
+               sortFolder.name + "/*.sorted" + " > " + inputFile)
 
 
-def preprocessInput(diamond, threads):
-    """ Reverse order of start and end coordinates for hits on the negative
-    strand and sort the output by coordinates.
+def readDiamond(diamond):
+    """ Read DIAMOND hits and reverse order of start and end coordinates for
+    hits on the negative strand.
 
     Args:
         diamond: Raw DIAMOND output
-        threads: How many threads to use in sorting
-    """
-    flippedDiamond = tempfile.NamedTemporaryFile(mode="w", prefix="flipped",
-                                                 dir=".", delete=False)
 
+    Yields:
+        list: Typed hits with the strand in the last column
+    """
     for row in csv.reader(open(diamond), delimiter='\t'):
+        # Contig and protein names repeat across hits, share their strings
+        row[0] = sys.intern(row[0])
+        row[1] = sys.intern(row[1])
+        for i in COORDINATE_COLUMNS:
+            row[i] = int(row[i])
         strand = "+"
-        if int(row[2]) > int(row[3]):
+        if row[2] > row[3]:
             row[2], row[3] = row[3], row[2]
             row[4], row[5] = row[5], row[4]
             strand = "-"
         row.append(strand)
-        flippedDiamond.write("\t".join(row) + "\n")
+        yield row
 
-    flippedDiamond.close()
-    fastSort(flippedDiamond.name, "-k1,1 -k3,3n -k4,4n", threads)
-    return flippedDiamond.name
 
+def partitionHits(diamond, folder, flushHits):
+    """Split DIAMOND hits into binary files by their contig and strand, see
+    readBinaryHits
 
-def removeMaskedHits(preprocessedDiamond, repeats, maxRepeatOverlapFraction):
-    """Remove hits overlapped by repeats
+    Args:
+        diamond: Raw DIAMOND output
+        folder: Output folder
+        flushHits (int): Number of hits buffered before they are flushed to
+                         the files
+
+    Returns:
+        list: Partitions sorted in the order in which seeds are clustered.
+              Each partition is a tuple of its key, file and number of hits.
+    """
+    files = {}
+    counts = {}
+    buffer = {}
+    counter = 0
+    for row in readDiamond(diamond):
+        partition = strandPartition(row)
+        if partition not in files:
+            files[partition] = str(len(files))
+            counts[partition] = 0
+        name = files[partition]
+        if name not in buffer:
+            buffer[name] = []
+        buffer[name].append(row)
+        counts[partition] += 1
+        counter += 1
+
+        if counter == flushHits:
+            flushBuffer(buffer, folder)
+            counter = 0
+
+    flushBuffer(buffer, folder)
+    return [(partition, folder + "/" + files[partition], counts[partition])
+            for partition in sorted(files)]
+
+
+def makeShards(partitions, shards):
+    """Group partitions into contiguous ranges with similar numbers of hits
 
     Args:
-        preprocessedDiamond (TYPE): Input hits
-        repeats (TYPE): Gff file with repeats
-        maxRepeatOverlapFraction (TYPE): Maximum allowed overlap fraction. Hits
-        overlapped by more than this fraction are filtered out.
+        partitions (list): Partitions returned by partitionHits
+        shards (int): Maximum number of shards
 
     Returns:
-        TYPE: Filtered hits
+        list: Lists of partitions
+    """
+    total = sum(partition[2] for partition in partitions)
+    result = [[]]
+    done = 0
+    for partition in partitions:
+        if result[-1] and done >= total * len(result) / shards:
+            result.append([])
+        result[-1].append(partition)
+        done += partition[2]
+    return result
+
+
+class RepeatIndex():
+    """Masked bases of each contig. Repeats are merged into disjoint intervals
+    sorted by their start; the number of masked bases preceding each interval
+    is stored as well. The number of masked bases in any region is then
+    computed with two binary searches.
     """
-    maskedDiamond = tempfile.NamedTemporaryFile(mode="w", prefix="masked",
-                                                dir=".", delete=False)
-    HS = 2  # Hit start index
-    HE = 3  # Hit end index
-    RS = 3  # Repeat start index
-    RE = 4  # Repeat end index
-
-    repeatQueue = []
-    repeatsReader = csv.reader(open(repeats), delimiter='\t')
-
-    for hit in csv.reader(open(preprocessedDiamond), delimiter='\t'):
-        hitLength = int(hit[HE]) - int(hit[HS]) + 1
-        hitOverlap = 0
-        for repeat in list(repeatQueue):
-            # Remove repeats which end before the hit from the queue.
-            if repeat[0] > hit[0]:
-                # Handle a special case where repeat is in subsequent contig
-                break
-            if repeat[0] < hit[0] or int(repeat[RE]) < int(hit[HS]):
-                repeatQueue.pop(0)
-            else:
-                break
 
-        if len(repeatQueue) == 0 or \
-           (repeatQueue[-1][0] == hit[0] and
-           int(repeatQueue[-1][RS]) <= int(hit[HE])):
-            # Add all repeats which overlap the current hit (plus one
-            # subsequent) repeat into the queue.
-            for repeat in repeatsReader:
-                if repeat[0] < hit[0] or \
-                   (repeat[0] == hit[0] and int(repeat[RE]) < int(hit[HS])):
-                    continue
-                repeatQueue.append(repeat)
-                if repeat[0] > hit[0] or int(repeat[RS]) > int(hit[HE]):
-                    break
-
-        for repeat in repeatQueue:
-            # Now go through all possibly overlapping repeats in the queue
-            # and compute # of overlapping nucleotides
-            if repeat[0] > hit[0] or int(repeat[RS]) > int(hit[HE]):
-                break
-            overlap = min(int(repeat[RE]), int(hit[HE])) - \
-                max(int(repeat[RS]), int(hit[HS])) + 1
-            if overlap <= 0:
-                sys.exit("error: unexpected repeat overlap encoutered.")
-            hitOverlap += overlap
+    def __init__(self, repeats=None):
+        """Load repeats, the file can be in any order
+
+        Args:
+            repeats: Gff file with repeats. The index is empty if None.
+        """
+        self.contigs = {}
+        if repeats is None:
+            return
+
+        intervals = {}
+        for row in readGff(repeats):
+            if row[0] not in intervals:
+                intervals[row[0]] = []
+            intervals[row[0]].append((int(row[3]), int(row[4])))
+
+        for contig, contigIntervals in intervals.items():
+            contigIntervals.sort()
+            starts = array.array("q")
+            ends = array.array("q")
+            for start, end in contigIntervals:
+                if ends and start <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], end)
+                else:
+                    starts.append(start)
+                    ends.append(end)
+
+            maskedBefore = array.array("q", [0])
+            for start, end in zip(starts, ends):
+                maskedBefore.append(maskedBefore[-1] + end - start + 1)
+            self.contigs[contig] = (starts, ends, maskedBefore)
+
+    def subset(self, contigs):
+        """Return an index restricted to the given contigs"""
+        index = RepeatIndex()
+        for contig in contigs:
+            if contig in self.contigs:
+                index.contigs[contig] = self.contigs[contig]
+        return index
+
+    def maskedBases(self, contig, start, end):
+        """Return the number of masked bases in a region
+
+        Args:
+            contig (string): Contig of the region
+            start (int): Start of the region
+            end (int): End of the region
+        """
+        if contig not in self.contigs:
+            return 0
+        intervals = self.contigs[contig]
+        return self.__maskedUpTo(intervals, end) - \
+            self.__maskedUpTo(intervals, start - 1)
+
+    def __maskedUpTo(self, intervals, coordinate):
+        """Return the number of masked bases up to (including) a coordinate"""
+        starts, ends, maskedBefore = intervals
+        i = bisect.bisect_right(starts, coordinate) - 1
+        if i < 0:
+            return 0
+        return maskedBefore[i] + min(coordinate, ends[i]) - starts[i] + 1
+
+
+def removeMaskedHits(hits, repeatIndex, maxRepeatOverlapFraction):
+    """Remove hits overlapped by repeats
 
-        overlappedFraction = hitOverlap / hitLength
-        if overlappedFraction <= maxRepeatOverlapFraction:
-            maskedDiamond.write("\t".join(hit) + "\n")
+    Args:
+        hits: Input hits, in any order
+        repeatIndex (RepeatIndex): Repeats of the contigs of the hits
+        maxRepeatOverlapFraction (float): Maximum allowed overlap fraction.
+        Hits overlapped by more than this fraction are filtered out.
 
-    return maskedDiamond.name
+    Yields:
+        list: Filtered hits
+    """
+    for hit in hits:
+        hitLength = hit[3] - hit[2] + 1
+        hitOverlap = repeatIndex.maskedBases(hit[0], hit[2], hit[3])
+        if hitOverlap / hitLength <= maxRepeatOverlapFraction:
+            yield hit
 
 
-def mergeOverlappingQueryRegions(preprocessedDiamond):
+def mergeOverlappingQueryRegions(hits):
     """Merge overlapping (in the query sequence) hits from the same target.
     Extra care is taken to correctly process the score and target protein
     alignment positions of the merged hits.
 
     Args:
-        diamond: Pre-processed DIAMOND output
+        hits: Pre-processed hits sorted by coordinates
+
+    Yields:
+        list: Merged hits
     """
-    mergedQueries = tempfile.NamedTemporaryFile(mode="w", prefix="mergedQ",
-                                                dir=".", delete=False)
     targets = {}
-    for row in csv.reader(open(preprocessedDiamond), delimiter='\t'):
+    for row in hits:
 
-        start = int(row[2])
-        end = int(row[3])
+        start = row[2]
+        end = row[3]
 
         target = getSeedString(row)
         if target not in targets:
             targets[target] = row
             continue
 
-        prevStart = int(targets[target][2])
-        prevEnd = int(targets[target][3])
+        prev = targets[target]
+        prevStart = prev[2]
+        prevEnd = prev[3]
 
         if start < prevEnd:
             if end <= prevEnd:
@@ -207,7 +423,7 @@ def mergeOverlappingQueryRegions(preprocessedDiamond):
                 prevUniquePortion = (prevLen - overlapLen) / prevLen
 
                 currScore = float(row[6])
-                prevScore = float(targets[target][6])
+                prevScore = float(prev[6])
 
                 newScore = currUniquePortion * currScore + \
                     prevUniquePortion * prevScore + \
@@ -215,63 +431,59 @@ def mergeOverlappingQueryRegions(preprocessedDiamond):
                     1 / 2 * (1 - prevUniquePortion) * prevScore
 
                 row[6] = str(round(newScore, 2))
-                row[2] = str(prevStart)
+                row[2] = prevStart
 
                 # Make sure the new protein coordinates make sense
                 if row[7] == "+":
-                    row[4] = str(min(int(targets[target][4]), int(row[4])))
-                    row[5] = str(max(int(targets[target][5]), int(row[5])))
+                    row[4] = min(prev[4], row[4])
+                    row[5] = max(prev[5], row[5])
                 else:
-                    row[4] = str(max(int(targets[target][4]), int(row[4])))
-                    row[5] = str(min(int(targets[target][5]), int(row[5])))
+                    row[4] = max(prev[4], row[4])
+                    row[5] = min(prev[5], row[5])
 
                 targets[target] = row
         else:
-            # Print the previous hit, it cannot be overlapped anymore
-            mergedQueries.write("\t".join(targets[target]) + "\n")
+            # Pass on the previous hit, it cannot be overlapped anymore
+            yield prev
             targets[target] = row
 
-    for key in targets:
-        mergedQueries.write("\t".join(targets[key]) + "\n")
-
-    mergedQueries.close()
-    return mergedQueries.name
+    yield from targets.values()
 
 
-def splitTargets(mergedQueries, args):
+def splitTargets(hits, args):
     """Split hits to duplicated genes (or conserved regions) into
     distinct seeds. The split criteria are explained in the help of
     --maxTargetHitOverlap and --maxIntron cmd arguments.
 
     Args:
-        mergedQueries: Processed DIAMOND output
+        hits: Merged hits
         args: Cmd arguments
+
+    Yields:
+        list: Hits with the seed ID in the last column
     """
-    output = tempfile.NamedTemporaryFile(mode="w", prefix="splitT",
-                                         dir=".", delete=False)
     seeds = {}
     prevRows = {}
-    for row in csv.reader(open(mergedQueries), delimiter='\t'):
+    for row in hits:
         target = getSeedString(row)
         if target not in seeds:
             seeds[target] = 1
         else:
-            if int(row[2]) - int(prevRows[target][3]) - 1 > args.maxIntron:
+            prev = prevRows[target]
+            if row[2] - prev[3] - 1 > args.maxIntron:
                 seeds[target] += 1
             else:
                 if row[7] == "+":
-                    overlap = int(prevRows[target][5]) - int(row[4]) + 1
+                    overlap = prev[5] - row[4] + 1
                 else:
-                    overlap = int(row[4]) - int(prevRows[target][5]) + 1
+                    overlap = row[4] - prev[5] + 1
                 if overlap > 0:
                     if row[7] == "+":
-                        prevLen = int(prevRows[target][5]) - \
-                                  int(prevRows[target][4]) + 1
-                        currLen = int(row[5]) - int(row[4]) + 1
+                        prevLen = prev[5] - prev[4] + 1
+                        currLen = row[5] - row[4] + 1
                     else:
-                        prevLen = int(prevRows[target][4]) - \
-                                  int(prevRows[target][5]) + 1
-                        currLen = int(row[4]) - int(row[5]) + 1
+                        prevLen = prev[4] - prev[5] + 1
+                        currLen = row[4] - row[5] + 1
 
                     if overlap / prevLen > args.maxTargetHitOverlap or \
                        overlap / currLen > args.maxTargetHitOverlap:
@@ -279,58 +491,104 @@ def splitTargets(mergedQueries, args):
 
         prevRows[target] = row
         row.append(target + "_" + str(seeds[target]))
-        output.write("\t".join(row) + "\n")
-
-    output.close()
-    return output.name
+        yield row
 
 
-def getRootCluster(clusters, i):
-    """Return the root cluster of a given cluster.
-
-    Args:
-        clusters: Cluster pointers
-        i: Index of the cluster of interest
+class ClusterSets():
+    """Disjoint sets of cluster IDs (union-find) with path compression and
+    union by rank. Each set has a label, the cluster ID which represents the
+    set in the output. When a set is joined into another set, the result
+    keeps the label of the other set.
     """
-    while clusters[i] != i:
-        i = clusters[i]
-    return i
 
-
-def clusterSeeds(processedDiamond, threads):
+    def __init__(self):
+        self.parents = array.array("q")
+        self.ranks = array.array("B")
+        self.labels = array.array("q")
+
+    def __len__(self):
+        return len(self.parents)
+
+    def add(self):
+        """Add a new cluster in its own set
+
+        Returns:
+            int: ID of the new cluster
+        """
+        clusterId = len(self.parents)
+        self.parents.append(clusterId)
+        self.ranks.append(0)
+        self.labels.append(clusterId)
+        return clusterId
+
+    def find(self, clusterId):
+        """Return the root of the set of a cluster"""
+        parents = self.parents
+        root = clusterId
+        while parents[root] != root:
+            root = parents[root]
+        while parents[clusterId] != root:
+            parents[clusterId], clusterId = root, parents[clusterId]
+        return root
+
+    def join(self, clusterId, otherId):
+        """Join the set of a cluster into the set of another cluster"""
+        root = self.find(clusterId)
+        otherRoot = self.find(otherId)
+        if root == otherRoot:
+            return
+        label = self.labels[otherRoot]
+        if self.ranks[root] > self.ranks[otherRoot]:
+            root, otherRoot = otherRoot, root
+        elif self.ranks[root] == self.ranks[otherRoot]:
+            self.ranks[otherRoot] += 1
+        self.parents[root] = otherRoot
+        self.labels[otherRoot] = label
+
+    def setLabels(self):
+        """Return the label of the set of each cluster"""
+        return [str(self.labels[self.find(clusterId)])
+                for clusterId in range(len(self.parents))]
+
+
+def clusterSeeds(hits, threads, spillDir):
     """Cluster overlapping seeds. Only CDS-level overlaps are considered.
 
     Args:
-        processedDiamond: Processed DIAMOND output
+        hits: Processed hits with seed IDs
         threads: How many threads to use in sorting
-    """
-
-    clusteredCDS = tempfile.NamedTemporaryFile(mode="w", prefix="clusteredCDS",
-                                               dir=".", delete=False)
+        spillDir: Folder for hits which do not fit into memory. Hits are
+                  sorted in memory if None.
 
-    clusteredSeeds = tempfile.NamedTemporaryFile(mode="w", prefix="clustered",
-                                                 dir=".", delete=False)
-
-    fastSort(processedDiamond, "-k8,8r -k1,1 -k3,3n -k4,4n", threads)
+    Returns:
+        int: Number of cluster IDs used, including the IDs of clusters joined
+             with other clusters
+        generator: Hits with the ID of their cluster in the last column
+    """
+    if spillDir is None:
+        hits = list(sortHits(hits, STRAND_COORDINATE_ORDER))
+    else:
+        hits = spillAndSort(hits, STRAND_COORDINATE_ORDER, threads, spillDir)
 
     clusterId = -1
     prevContig = ""
     prevStrand = ""
     currentClusterEnd = 0
-    clusters = []
+    clusters = ClusterSets()
     seed2cluster = {}
+    # Cluster of each hit before the clusters are joined
+    hitClusters = array.array("q")
 
-    for row in csv.reader(open(processedDiamond), delimiter='\t'):
+    for row in hits:
         contig = row[0]
-        start = int(row[2])
-        end = int(row[3])
+        start = row[2]
+        end = row[3]
         seed = row[8]
         strand = row[7]
 
         if prevContig != contig or start > currentClusterEnd or \
            prevStrand != strand:
-            clusterId += 1
-            clusters.append(clusterId)
+            clusterId = clusters.add()
             currentClusterEnd = end
         else:
             if end > currentClusterEnd:
@@ -339,61 +597,71 @@ def clusterSeeds(processedDiamond, threads):
         if seed not in seed2cluster:
             seed2cluster[seed] = clusterId
         elif seed2cluster[seed] != clusterId:
-            parentCluster = getRootCluster(clusters, clusterId)
-            clusters[parentCluster] = getRootCluster(clusters,
-                                                     seed2cluster[seed])
+            clusters.join(clusterId, seed2cluster[seed])
 
-        row.append(str(clusterId))
-        clusteredCDS.write("\t".join(row) + "\n")
+        hitClusters.append(clusterId)
         prevContig = contig
         prevStrand = strand
 
-    clusteredCDS.close()
+    return len(clusters), labelHits(hits, hitClusters, clusters.setLabels())
 
-    for row in csv.reader(open(clusteredCDS.name), delimiter='\t'):
-        row[9] = str(getRootCluster(clusters, int(row[9])))
-        clusteredSeeds.write("\t".join(row) + "\n")
 
-    os.remove(clusteredCDS.name)
-    clusteredSeeds.close()
-    return clusteredSeeds.name
+def labelHits(hits, hitClusters, labels):
+    for row, clusterId in zip(hits, hitClusters):
+        row.append(labels[clusterId])
+        yield row
 
 
-def diamond2gff(preprocessedDiamond, outputFile):
-    """Convert the DIAMOND output to gff and print the result to a file
+def diamond2gff(hits, outputFile):
+    """Convert hits to gff and print the result to a file
 
     Args:
-        diamond: Pre-processed DIAMOND output
+        hits: Processed hits
         outputFile: Output file
-    """
-    output = open(outputFile, "w")
-
-    for row in csv.reader(open(preprocessedDiamond), delimiter='\t'):
-        if len(row) == 8:
-            row.append(row[1])
 
-        output.write("\t".join([row[0], "DIAMOND", "CDS", row[2], row[3], "1",
-                                row[7], ".", "gene_id=" + row[8] + ";" +
-                                " transcript_id=" + row[8] + ";" +
-                                " targetFrom=" + row[4] + ";" +
-                                " targetTo=" + row[5] + ";" +
-                                " score=" + row[6]]) + "\n")
-    output.close()
+    Yields:
+        list: The unchanged hits
+    """
+    with open(outputFile, "w") as output:
+        for row in hits:
+            seed = row[8] if len(row) > 8 else row[1]
+            output.write("\t".join([row[0], "DIAMOND", "CDS", str(row[2]),
+                                    str(row[3]), "1", row[7], ".",
+                                    "gene_id=" + seed + ";" +
+                                    " transcript_id=" + seed + ";" +
+                                    " targetFrom=" + str(row[4]) + ";" +
+                                    " targetTo=" + str(row[5]) + ";" +
+                                    " score=" + row[6]]) + "\n")
+            yield row
+
+
+def flushBuffer(buffer, folder):
+    """Append buffered hits to binary files, see readBinaryHits
 
+    Args:
+        buffer (dict): Lists of hits indexed by the names of their files
+        folder: Folder with the files
+    """
+    for name in list(buffer.keys()):
+        with open(folder + "/" + name, "ab") as outfile:
+            pickle.dump(buffer[name], outfile, pickle.HIGHEST_PROTOCOL)
+        del buffer[name]
 
-def flushClusterBuffer(buffer, folder):
-    for cluster in list(buffer.keys()):
-        with open(folder + "/" + cluster, "a") as outfile:
-            for row in buffer[cluster]:
-                outfile.write("\t".join(row) + "\n")
-        del buffer[cluster]
 
+def saveClusters(clusteredHits, clusterFolder, flushHits):
+    """Save hits grouped by their clusters, see readClusters. Each flush of
+    the buffer writes a file (run) with pickled clusters sorted by their IDs.
 
-def saveClustersToFiles(clusteredDiamond, clusterFolder):
+    Args:
+        clusteredHits: Hits with cluster IDs
+        clusterFolder: Output folder
+        flushHits (int): Number of hits buffered before they are flushed to
+                         a run
+    """
     buffer = {}
-    FLUSH = 1000000
     counter = 0
-    for row in csv.reader(open(clusteredDiamond), delimiter='\t'):
+    runs = 0
+    for row in clusteredHits:
         cluster = row[9]
         if cluster not in buffer:
             buffer[cluster] = [row]
@@ -401,92 +669,191 @@ def saveClustersToFiles(clusteredDiamond, clusterFolder):
             buffer[cluster].append(row)
         counter += 1
 
-        if counter == FLUSH:
-            flushClusterBuffer(buffer, clusterFolder)
+        if counter == flushHits:
+            saveRun(buffer, clusterFolder + "/" + str(runs))
+            buffer = {}
             counter = 0
+            runs += 1
+
+    if buffer:
+        saveRun(buffer, clusterFolder + "/" + str(runs))
+
 
-    flushClusterBuffer(buffer, clusterFolder)
+def saveRun(buffer, runFile):
+    with open(runFile, "wb") as f:
+        for cluster in sorted(buffer, key=int):
+            pickle.dump((int(cluster), buffer[cluster]), f,
+                        pickle.HIGHEST_PROTOCOL)
 
 
-def processSingle(args):
-    cluster = args[0]
-    lowThreshold = args[1]
-    highThreshold = args[2]
-    topN = args[3]
-    seedRegions = args[4]
-    alignmentPairs = args[5]
-    clusterFolder = args[6]
+def readPickled(path):
+    """Read objects pickled one after another into a file"""
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                break
 
-    splitSeedCluster.split(clusterFolder + "/" + cluster,
-                           lowThreshold, highThreshold, topN,
-                           clusterFolder + "/seeds_" + cluster,
-                           clusterFolder + "/pairs_" + cluster)
 
-    with seedLock:
-        append(clusterFolder + "/seeds_" + cluster, seedRegions)
-    with pairsLock:
-        append(clusterFolder + "/pairs_" + cluster, alignmentPairs)
+def readClusters(clusterFolder):
+    """Read clusters saved by saveClusters. Parts of a cluster saved in
+    different files are merged.
 
-    os.remove(clusterFolder + "/" + cluster)
-    os.remove(clusterFolder + "/seeds_" + cluster)
-    os.remove(clusterFolder + "/pairs_" + cluster)
+    Args:
+        clusterFolder: Folder with the saved clusters
 
+    Yields:
+        tuple: ID of a cluster and an iterable with its hits, in the order in
+               which the hits were saved
+    """
+    runs = [readPickled(clusterFolder + "/" + run)
+            for run in sorted(os.listdir(clusterFolder), key=int)]
+    merged = heapq.merge(*runs, key=operator.itemgetter(0))
+    for cluster, parts in itertools.groupby(merged,
+                                            key=operator.itemgetter(0)):
+        yield cluster, itertools.chain.from_iterable(part[1]
+                                                     for part in parts)
 
-def processClusters(clusteredDiamond, topN, lowThreshold, highThreshold,
-                    seedRegions, alignmentPairs, threads):
 
-    clusterFolder = tempfile.TemporaryDirectory(prefix="clusters", dir=".")
+def readBinaryHits(hitFile):
+    """Read hits saved by flushBuffer. The file contains pickled lists of
+    typed hits, one list per flush of the buffer.
 
-    saveClustersToFiles(clusteredDiamond, clusterFolder.name)
+    Args:
+        hitFile: Binary file with hits
+
+    Returns:
+        iterator: Hits
+    """
+    return itertools.chain.from_iterable(readPickled(hitFile))
 
-    clusters = os.listdir(clusterFolder.name)
 
-    if os.path.exists(seedRegions):
-        os.remove(seedRegions)
-    if os.path.exists(alignmentPairs):
-        os.remove(alignmentPairs)
+def clusterShard(task):
+    """Process hits of a shard up to the clustering of seeds. Clustered hits
+    are saved in the "clusters" subfolder of the shard folder, the optional
+    raw and split seeds are saved in the shard folder.
 
-    pool = Pool(processes=threads)
-    pool.map(processSingle, [[x,
-                              lowThreshold,
-                              highThreshold,
-                              topN,
-                              seedRegions,
-                              alignmentPairs,
-                              clusterFolder.name
-                              ] for x in clusters])
+    Args:
+        task (tuple): Shard folder, files with hits of the shard partitions,
+                      size of the hits (in bytes of the DIAMOND output),
+                      RepeatIndex of the shard contigs or None and cmd
+                      arguments
 
+    Returns:
+        int: Number of cluster IDs used in the shard
+    """
+    folder, hitFiles, size, repeatIndex, args = task
 
-def main():
-    args = parseCmd()
-    preprocessedDiamond = preprocessInput(args.diamond, args.threads)
+    # All hits of a shard are sorted at once, with a part of the memory limit
+    spillDir = None
+    if not fitsInMemory(size, args.sortMemory / args.threads):
+        spillDir = folder
 
-    if args.repeats:
-        maskedDiamond = removeMaskedHits(preprocessedDiamond, args.repeats,
-                                         args.maxRepeatOverlapFraction)
-        os.remove(preprocessedDiamond)
+    hits = itertools.chain.from_iterable(map(readBinaryHits, hitFiles))
+    if spillDir is None:
+        hits = sortHits(hits, COORDINATE_ORDER)
     else:
-        maskedDiamond = preprocessedDiamond
+        hits = spillAndSort(hits, COORDINATE_ORDER, 1, spillDir)
 
-    mergedQueries = mergeOverlappingQueryRegions(maskedDiamond)
-    os.remove(maskedDiamond)
+    if repeatIndex is not None:
+        hits = removeMaskedHits(hits, repeatIndex,
+                                args.maxRepeatOverlapFraction)
 
+    hits = mergeOverlappingQueryRegions(hits)
     if args.rawSeeds:
-        diamond2gff(mergedQueries, args.rawSeeds)
+        hits = diamond2gff(hits, folder + "/raw.gff")
 
-    processedDiamond = splitTargets(mergedQueries, args)
-    os.remove(mergedQueries)
+    hits = splitTargets(hits, args)
     if args.splitSeeds:
-        diamond2gff(processedDiamond, args.splitSeeds)
+        hits = diamond2gff(hits, folder + "/split.gff")
+
+    clusterCount, hits = clusterSeeds(hits, 1, spillDir)
+    os.mkdir(folder + "/clusters")
+    saveClusters(hits, folder + "/clusters",
+                 bufferSize(args.sortMemory / args.threads))
+    return clusterCount
 
-    clusteredDiamond = clusterSeeds(processedDiamond, args.threads)
-    os.remove(processedDiamond)
 
-    processClusters(clusteredDiamond, args.maxProteinsPerSeed,
-                    args.lowThreshold, args.highThreshold,
-                    args.seedRegions, args.alignmentPairs, args.threads)
+def setClusterId(hits, clusterId):
+    for row in hits:
+        row[9] = clusterId
+        yield row
 
-    os.remove(clusteredDiamond)
+
+def splitShard(task):
+    """Split clusters saved by clusterShard into seed regions and select
+    their alignment pairs. The results are saved in the shard folder.
+
+    Args:
+        task (tuple): Shard folder, the first cluster ID of the shard and cmd
+                      arguments
+    """
+    folder, firstClusterId, args = task
+    with open(folder + "/seeds.gtf", "w") as seedRegions, \
+            open(folder + "/pairs.txt", "w") as alignmentPairs:
+        for cluster, hits in readClusters(folder + "/clusters"):
+            hits = setClusterId(hits, str(firstClusterId + cluster))
+            splitSeedCluster.split(hits, args.lowThreshold,
+                                   args.highThreshold,
+                                   args.maxProteinsPerSeed, seedRegions,
+                                   alignmentPairs)
+
+
+def main():
+    args = parseCmd()
+
+    # Merging, splitting and clustering of seeds never cross a contig or
+    # strand boundary. Hits are thus partitioned by contig and strand and
+    # contiguous ranges of the partitions are processed in parallel. The
+    # stages are chained as generators of typed hits within each worker.
+    workFolder = tempfile.TemporaryDirectory(prefix="seeds", dir=".")
+    os.mkdir(workFolder.name + "/partitions")
+    # Hits are partitioned before the workers start, with the memory limit
+    # of one worker
+    partitions = partitionHits(args.diamond, workFolder.name + "/partitions",
+                               bufferSize(args.sortMemory / args.threads))
+    shards = makeShards(partitions, args.threads * SHARDS_PER_THREAD)
+
+    repeatIndex = None
+    if args.repeats:
+        repeatIndex = RepeatIndex(args.repeats)
+
+    hitCount = sum(partition[2] for partition in partitions)
+    bytesPerHit = os.path.getsize(args.diamond) / max(hitCount, 1)
+    tasks = []
+    for i, shard in enumerate(shards):
+        folder = workFolder.name + "/shard" + str(i)
+        os.mkdir(folder)
+        shardRepeats = None
+        if repeatIndex is not None:
+            shardRepeats = repeatIndex.subset({partition[0][1]
+                                               for partition in shard})
+        tasks.append((folder, [partition[1] for partition in shard],
+                      bytesPerHit * sum(partition[2] for partition in shard),
+                      shardRepeats, args))
+
+    with Pool(processes=args.threads) as pool:
+        clusterCounts = pool.map(clusterShard, tasks)
+        # Cluster IDs are numbered across the shards in their order, which
+        # is the order of a sequential run
+        firstClusterIds = itertools.accumulate([0] + clusterCounts[:-1])
+        pool.map(splitShard, [(task[0], firstClusterId, args) for
+                              task, firstClusterId in
+                              zip(tasks, firstClusterIds)])
+
+    for name, output in [("seeds.gtf", args.seedRegions),
+                         ("pairs.txt", args.alignmentPairs),
+                         ("raw.gff", args.rawSeeds),
+                         ("split.gff", args.splitSeeds)]:
+        if not output:
+            continue
+        open(output, "w").close()
+        for task in tasks:
+            if os.path.isfile(task[0] + "/" + name):
+                append(task[0] + "/" + name, output)
+
+    workFolder.cleanup()
 
 
 def parseCmd():
@@ -544,13 +911,20 @@ def parseCmd():
     parser.add_argument('--threads', type=int, default=1,
                         help='Number of threads to use.')
 
+    parser.add_argument('--sortMemory', type=int, default=2048,
+                        help='Memory limit (in MB) for sorting the hits in \
+        memory, shared by all threads. Hits which do not fit are sorted with \
+        the external sort command. Default = 2048.')
+
     parser.add_argument('--rawSeeds', type=str,
                         help='Output raw, unclustered, seeds here. This is \
-        an optional output; mainly useful for debugging.')
+        an optional output; mainly useful for debugging. Seeds are grouped \
+        by the ranges of contigs and strands processed in parallel.')
 
     parser.add_argument('--splitSeeds', type=str,
                         help='Output split, unclustered, seeds here. This is \
-        an optional output; mainly useful for debugging.')
+        an optional output; mainly useful for debugging. Seeds are grouped \
+        by the ranges of contigs and strands processed in parallel.')
 
     parser.add_argument('--lowThreshold', type=float, default=0.1)
     parser.add_argument('--highThreshold', type=float, default=0.2)
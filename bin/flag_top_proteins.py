@@ -3,7 +3,9 @@
 # Tomas Bruna
 # Copyright 2019, Georgia Institute of Technology, USA
 #
-# Flag hints which were mapped from the best DIAMOND protein hit
+# Flag hints which were mapped from the best DIAMOND protein hit. Local
+# alignments are flagged by splicedAlignment.py as they are written, this
+# script flags the output of alignments on PBS.
 # ==============================================================
 
 
@@ -12,44 +14,91 @@ import csv
 import re
 import sys
 
+from gffRecords import GffWriter, readGff
 
-def extractFeatureGff(text, feature):
-    regex = feature + '=([^;]+);'
-    return re.search(regex, text).groups()[0]
+
+# Characters in sequence IDs which are not preserved in the Spaln output:
+# Spaln only keeps the last "|" separated field of an ID and the others
+# terminate the attribute value in the 9th column
+UNSUPPORTED_ID_CHARACTERS = re.compile(r'[|;"]')
+INPUT_FORMAT_HELP = ('This issue can be caused by the presence of special '
+                     'characters in the fasta headers of input files. Please '
+                     'remove any special characters and re-run ProtHint. '
+                     'See https://github.com/gatech-genemark/ProtHint#input '
+                     'for more details about the input format.')
+
+
+def loadPairs(diamondPairs):
+    """Load seed gene-protein pairs from DIAMOND output
+
+    Args:
+        diamondPairs (filepath): File with DIAMOND pairs
+
+    Returns:
+        list: Seed gene and protein ID tuples in the file order
+    """
+    return [(row[0], row[1]) for row in
+            csv.reader(open(diamondPairs), delimiter='\t')]
+
+
+def topPairs(pairs):
+    """Select pairs with the best protein hit of each seed gene
+
+    Args:
+        pairs (list): Seed gene and protein ID tuples, sorted by seed genes
+                      and by the protein score (from best to worst)
+
+    Returns:
+        set: Seed gene and protein ID tuples of the top pairs
+    """
+    top = set()
+    prevGene = None
+    for pair in pairs:
+        if pair[0] != prevGene:
+            top.add(pair)
+        prevGene = pair[0]
+    return top
+
+
+def checkPairIds(pairs):
+    """Exit with an error if IDs of any pair would not be preserved in the
+    Spaln output, which would make the pair impossible to match with its
+    hints. The check is meant to run before the alignment.
+
+    Args:
+        pairs (list): Seed gene and protein ID tuples
+    """
+    for seedGene, protein in pairs:
+        if UNSUPPORTED_ID_CHARACTERS.search(seedGene) or \
+           UNSUPPORTED_ID_CHARACTERS.search(protein):
+            sys.exit('error: Gene-protein pair "' + seedGene + "-" +
+                     protein + '" contains characters which are not '
+                     'preserved in the Spaln output. ' + INPUT_FORMAT_HELP)
 
 
 def loadTopPairs(diamondPairs):
-    topPairs = set()
-    allPairs = set()
-    prevGene = ""
-    for row in csv.reader(open(diamondPairs), delimiter='\t'):
-        gene = row[0]
-        allPairs.add(row[0] + "_" + row[1])
-        if gene != prevGene:
-            topPairs.add(row[0] + "_" + row[1])
-        prevGene = gene
-    return topPairs, allPairs
+    pairs = loadPairs(diamondPairs)
+    return topPairs(pairs), set(pairs)
 
 
 def flagHints(hints, topPairs, allPairs):
-    for row in csv.reader(open(hints), delimiter='\t'):
-        hintProt = extractFeatureGff(row[8], "prot")
-        seedGene = extractFeatureGff(row[8], "seed_gene_id")
-        key = seedGene + "_" + hintProt
+    output = GffWriter()
+    for row in readGff(hints):
+        hintProt = row.attribute("prot")
+        seedGene = row.attribute("seed_gene_id")
+        key = (seedGene, hintProt)
 
         if key not in allPairs:
-            sys.exit('error: Gene-protein pair "' + seedGene + "-" +
-                     hintProt + '" present in the Spaln output was not found '
-                     'in the file with DIAMOND gene-protein pairs. This issue '
-                     'can be caused by the presence of special characters in '
-                     'the fasta headers of input files. Please remove any '
-                     'special characters and re-run ProtHint. '
-                     'See https://github.com/gatech-genemark/ProtHint#input '
-                     'for more details about the input format.')
+            output.close()
+            sys.exit('error: Gene-protein pair "' + str(seedGene) + "-" +
+                     str(hintProt) + '" present in the Spaln output was not '
+                     'found in the file with DIAMOND gene-protein pairs. ' +
+                     INPUT_FORMAT_HELP)
 
         if key in topPairs:
             row[8] += " topProt=TRUE;"
-        print("\t".join(row))
+        output.write(row)
+    output.close()
 
 
 def main():
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# ==============================================================
+# Tomas Bruna
+# Copyright 2021, Georgia Institute of Technology, USA
+#
+# Reading and writing of GFF/GTF rows shared by the post-processing scripts.
+# A row is a list of its columns. The attribute column (9th column) is parsed
+# into a dictionary only when an attribute is requested for the first time;
+# the dictionary is reused by all subsequent requests until the column is
+# modified. Both GFF ("key=value;") and GTF ('key "value";') attributes are
+# supported. Rows are written through a large buffer. A file can be split
+# into byte ranges aligned to lines, which are read by parallel processes.
+# ==============================================================
+
+
+import os
+import re
+import sys
+
+
+BUFFER_SIZE = 16 * 1024 * 1024
+# GFF (key=value) or GTF (key "value") attribute
+ATTRIBUTE = re.compile(r'([^\s;="]+)(?:=|\s+"?)([^;"]*)')
+
+
+def parseAttributes(text):
+    """Parse the attribute column of a GFF or GTF row
+
+    Args:
+        text (string): The attribute column
+
+    Returns:
+        dict: Attribute values indexed by attribute names. If an attribute is
+              present multiple times, its first value is used.
+    """
+    # Reversed, so that the first value of a repeated attribute is kept
+    return dict(ATTRIBUTE.findall(text)[::-1])
+
+
+class Record(list):
+    """Row of a GFF/GTF file"""
+
+    __slots__ = ("_text", "_attributes")
+
+    @property
+    def attributes(self):
+        """Parsed attribute column, see parseAttributes"""
+        text = self[8]
+        try:
+            if self._text is text:
+                return self._attributes
+        except AttributeError:
+            pass
+        self._attributes = parseAttributes(text)
+        self._text = text
+        return self._attributes
+
+    def attribute(self, key):
+        """Return the value of an attribute or None if it is not present"""
+        return self.attributes.get(key)
+
+    def copy(self):
+        """Copy the row, including the already parsed attributes"""
+        record = Record(self)
+        try:
+            record._text = self._text
+            record._attributes = self._attributes
+        except AttributeError:
+            pass
+        return record
+
+
+def readGff(path):
+    """Read rows of a GFF/GTF file. Empty lines and comments are skipped.
+
+    Args:
+        path (filepath): Input file
+
+    Yields:
+        Record: Parsed rows
+    """
+    with open(path, buffering=BUFFER_SIZE) as f:
+        yield from parseRows(f)
+
+
+def splitFile(path, parts):
+    """Split a file into byte ranges which start at the beginnings of lines
+
+    Args:
+        path (filepath): Input file
+        parts (int): Number of ranges
+
+    Returns:
+        list: Start and end offsets of non-empty ranges, in the file order
+    """
+    size = os.path.getsize(path)
+    offsets = [0]
+    with open(path, "rb") as f:
+        for part in range(1, parts):
+            offset = size * part // parts
+            if offset <= offsets[-1]:
+                continue
+            # Move to the beginning of the next line, unless the offset is
+            # already at the beginning of a line
+            f.seek(offset - 1)
+            f.readline()
+            offsets.append(f.tell())
+    offsets.append(size)
+    return [(start, end) for start, end in zip(offsets, offsets[1:])
+            if start < end]
+
+
+def readGffRange(path, start, end):
+    """Read rows of a GFF/GTF file which start in a byte range
+
+    Args:
+        path (filepath): Input file
+        start (int): Offset of the beginning of a line
+        end (int): End of the range
+
+    Yields:
+        Record: Parsed rows
+    """
+    def lines(f):
+        position = start
+        for line in f:
+            if position >= end:
+                break
+            position += len(line)
+            yield line.decode()
+
+    with open(path, "rb", buffering=BUFFER_SIZE) as f:
+        f.seek(start)
+        yield from parseRows(lines(f))
+
+
+def parseRows(lines):
+    """Parse GFF/GTF rows, e.g. from the output of an external command. Empty
+    lines and comments are skipped.
+
+    Args:
+        lines: Iterable with lines of a GFF/GTF file
+
+    Yields:
+        Record: Parsed rows
+    """
+    for line in lines:
+        if line[0] == "#" or line == "\n":
+            continue
+        yield Record(line.rstrip("\r\n").split("\t"))
+
+
+class GffWriter:
+
+    def __init__(self, path=None, mode="w"):
+        """Open a buffered output for GFF/GTF rows
+
+        Args:
+            path (filepath): Output file. Rows are written to stdout if None.
+            mode (string): "w" to overwrite the file or "a" to append to it
+        """
+        if path is None:
+            sys.stdout.flush()
+            self.file = open(sys.stdout.fileno(), "w",
+                             buffering=BUFFER_SIZE, closefd=False)
+        else:
+            self.file = open(path, mode, buffering=BUFFER_SIZE)
+
+    def write(self, row):
+        """Write a row given as a list of columns"""
+        self.file.write("\t".join(row) + "\n")
+
+    def writeLine(self, line):
+        """Write an already formatted row"""
+        self.file.write(line + "\n")
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# ==============================================================
+# Tomas Bruna
+# Copyright 2021, Georgia Institute of Technology, USA
+#
+# Columnar store of raw hints from spaln.gff. Each column used by the
+# post-processing is held in a typed array: coordinates, alignment scores and
+# flags as numbers, and text columns (contig, source, feature, score, strand,
+# phase, splice sites, seed gene and protein) as indices into a dictionary of
+# their distinct values. The score column is kept as text, so that scores
+# which are not integers are passed through unchanged. The store is cached in a binary file next to the GFF file
+# and loaded from the cache as long as the GFF file is not modified. Parts of
+# the GFF file can be parsed in parallel processes; the columns are the same
+# as from a single process.
+# ==============================================================
+
+
+import array
+import itertools
+import json
+import math
+import os
+import sys
+from multiprocessing import Pool
+
+from gffRecords import readGff, readGffRange, splitFile
+
+
+CACHE_SUFFIX = ".columns"
+CACHE_VERSION = 2
+
+# Columns with their array type codes. Text columns are dictionary encoded.
+TEXT_COLUMNS = ["contig", "source", "feature", "score", "strand", "phase",
+                "spliceSites", "seed", "protein"]
+NUMERIC_COLUMNS = [("start", "q"), ("end", "q"), ("alScore", "d"),
+                   ("topProt", "b")]
+# Index type of dictionary encoded columns
+CODE = "I"
+CHUNK_ROWS = 100000
+
+
+class HintStore:
+
+    def __init__(self, gff, cache=True, threads=1):
+        """Load raw hints into columns
+
+        Args:
+            gff (filepath): Raw hints scored by spaln-boundary-scorer
+            cache (bool): Whether to load the columns from the cache file
+                          next to the GFF file and to create the cache if it
+                          does not exist or is outdated
+            threads (int): Number of processes which parse parts of the GFF
+                           file if it is not loaded from the cache
+        """
+        self.gff = gff
+        self.cacheFile = gff + CACHE_SUFFIX
+        self.columns = {}
+        self.dictionaries = {}
+
+        if cache and self.__loadCache():
+            return
+
+        if threads > 1:
+            self.__parseParallel(threads)
+        else:
+            self.columns, self.dictionaries = parseColumns(readGff(gff))
+        if cache:
+            self.__saveCache()
+
+    @classmethod
+    def fromRows(cls, rows):
+        """Create a store from parsed raw hints, without a cache file
+
+        Args:
+            rows: Iterable with parsed raw hints
+        """
+        store = cls.__new__(cls)
+        store.gff = None
+        store.cacheFile = None
+        store.columns, store.dictionaries = parseColumns(rows)
+        return store
+
+    def __len__(self):
+        return len(self.columns["start"])
+
+    def decoded(self, name):
+        """Return a list with decoded values of a text column"""
+        dictionary = self.dictionaries[name]
+        return [dictionary[code] for code in self.columns[name]]
+
+    def alScores(self):
+        """Return a list of alignment scores with None for missing scores"""
+        return [None if math.isnan(value) else value
+                for value in self.columns["alScore"]]
+
+    def scores(self):
+        """Return a list of score columns, "." for missing scores"""
+        return self.decoded("score")
+
+    def __parseParallel(self, threads):
+        """Parse parts of the GFF file in parallel and concatenate their
+        columns. Text values are re-encoded with codes assigned in the order
+        of the first occurrence in the file, as in a single process.
+        """
+        tasks = [(self.gff, start, end)
+                 for start, end in splitFile(self.gff, threads)]
+        with Pool(processes=threads) as pool:
+            parts = pool.map(parseRange, tasks)
+
+        self.columns, self.dictionaries = parseColumns([])
+        codes = {name: {} for name in TEXT_COLUMNS}
+        for columns, dictionaries in parts:
+            for name in TEXT_COLUMNS:
+                dictionary = codes[name]
+                for value in dictionaries[name]:
+                    if value not in dictionary:
+                        dictionary[value] = len(dictionary)
+                translation = [dictionary[value]
+                               for value in dictionaries[name]]
+                self.columns[name].extend(map(translation.__getitem__,
+                                              columns[name]))
+            for name, typeCode in NUMERIC_COLUMNS:
+                self.columns[name].extend(columns[name])
+        self.dictionaries = {name: list(codes[name]) for name in TEXT_COLUMNS}
+
+    def __sourceStat(self):
+        stat = os.stat(self.gff)
+        return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+    def __loadCache(self):
+        """Load the columns from the cache file
+
+        Returns:
+            bool: True if the cache exists and matches the GFF file
+        """
+        if not os.path.isfile(self.cacheFile):
+            return False
+
+        with open(self.cacheFile, "rb") as f:
+            header = json.loads(f.readline())
+            if header["version"] != CACHE_VERSION or \
+               header["byteorder"] != sys.byteorder or \
+               header["source"] != self.__sourceStat():
+                return False
+
+            for name, typeCode, length in header["columns"]:
+                column = array.array(typeCode)
+                column.frombytes(f.read(length * column.itemsize))
+                self.columns[name] = column
+        self.dictionaries = header["dictionaries"]
+        return True
+
+    def __saveCache(self):
+        header = {
+            "version": CACHE_VERSION,
+            "byteorder": sys.byteorder,
+            "source": self.__sourceStat(),
+            "dictionaries": self.dictionaries,
+            "columns": [[name, column.typecode, len(column)]
+                        for name, column in self.columns.items()]
+        }
+        tmp = self.cacheFile + ".tmp" + str(os.getpid())
+        try:
+            with open(tmp, "wb") as f:
+                f.write(json.dumps(header).encode() + b"\n")
+                for column in self.columns.values():
+                    column.tofile(f)
+            os.replace(tmp, self.cacheFile)
+        except OSError:
+            # The cache is optional, e.g. the directory may be read-only
+            if os.path.isfile(tmp):
+                os.remove(tmp)
+
+
+def parseColumns(rows):
+    """Convert raw hints to columns
+
+    Args:
+        rows: Iterable with parsed raw hints
+
+    Returns:
+        tuple: Columns by their names and the dictionaries of text columns
+    """
+    columns = {}
+    codes = {name: {} for name in TEXT_COLUMNS}
+    for name in TEXT_COLUMNS:
+        columns[name] = array.array(CODE)
+    for name, typeCode in NUMERIC_COLUMNS:
+        columns[name] = array.array(typeCode)
+
+    def encode(name, values):
+        dictionary = codes[name]
+        for value in dict.fromkeys(values):
+            if value not in dictionary:
+                dictionary[value] = len(dictionary)
+        columns[name].extend(map(dictionary.__getitem__, values))
+
+    # Rows are converted to columns in chunks, which keeps the memory
+    # bounded and lets the conversions run column by column
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, CHUNK_ROWS))
+        if not chunk:
+            break
+        gffColumns = list(zip(*chunk))
+        attributes = [row.attributes for row in chunk]
+
+        encode("contig", gffColumns[0])
+        encode("source", gffColumns[1])
+        encode("feature", gffColumns[2])
+        encode("score", gffColumns[5])
+        encode("strand", gffColumns[6])
+        encode("phase", gffColumns[7])
+        for name, key in [("spliceSites", "splice_sites"),
+                          ("seed", "seed_gene_id"), ("protein", "prot")]:
+            encode(name, [row.get(key) for row in attributes])
+
+        columns["start"].extend(map(int, gffColumns[3]))
+        columns["end"].extend(map(int, gffColumns[4]))
+        columns["alScore"].extend([
+            float(value) if value else math.nan for value in
+            [row.get("al_score") for row in attributes]])
+        columns["topProt"].extend([row.get("topProt") == "TRUE"
+                                   for row in attributes])
+
+    return columns, {name: list(codes[name]) for name in TEXT_COLUMNS}
+
+
+def parseRange(task):
+    """Convert raw hints in a byte range of a GFF file to columns
+
+    Args:
+        task (tuple): GFF file and the start and end of the range
+
+    Returns:
+        tuple: Columns and dictionaries as returned by parseColumns
+    """
+    gff, start, end = task
+    return parseColumns(readGffRange(gff, start, end))
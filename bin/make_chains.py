@@ -8,43 +8,66 @@
 
 
 import argparse
-import csv
-import re
 import sys
 
-
-def extractFeatureGff(text, feature):
-    regex = feature + '=([^;]+);'
-    return re.search(regex, text).groups()[0]
+from gffRecords import GffWriter, readGff
 
 
 def printChains(gffFile, cutoff):
-    for row in csv.reader(open(gffFile), delimiter='\t'):
-        protein = extractFeatureGff(row[8], "prot")
-        gene = extractFeatureGff(row[8], "seed_gene_id")
-        row[1] = "ProtHint"
-        row[8] = "grp=" + protein + "_" + gene + ";src=C;pri=4;"
-
-        if row[2] == "CDS":
-            row[2] = "CDSpart"
-            exonLength = int(row[4]) - int(row[3]) + 1
-            if exonLength < 2 * cutoff + 3:
-                row[3] = str(int(row[3]) + (int(exonLength / 6)) * 3)
-                row[4] = str(int(row[3]) + 2)
-            else:
-                row[3] = str(int(row[3]) + cutoff)
-                row[4] = str(int(row[4]) - cutoff)
-
-        if row[2] == "Intron":
-            row[2] = "intron"
-
-        if row[2] == "start_codon":
-            row[2] = "start"
-
-        if row[2] == "stop_codon":
-            row[2] = "stop"
-
-        print("\t".join(row))
+    with GffWriter() as output:
+        for row in readGff(gffFile):
+            output.write(chainRow(row, cutoff))
+
+
+def chainRow(row, cutoff):
+    """Convert a hint to a chained hint for augustus
+
+    Args:
+        row: Parsed gff row, modified in place
+        cutoff (int): Cut exon on each side by this much
+
+    Returns:
+        list: The converted row
+    """
+    return chainColumns(row, row.attribute("prot"),
+                        row.attribute("seed_gene_id"), cutoff)
+
+
+def chainColumns(row, protein, gene, cutoff):
+    """Convert a hint to a chained hint for augustus
+
+    Args:
+        row: List with at least 8 columns of the hint, modified in place
+        protein (string): ID of the protein aligned to the hint
+        gene (string): ID of the seed gene of the hint
+        cutoff (int): Cut exon on each side by this much
+
+    Returns:
+        list: The converted row
+    """
+    row[1] = "ProtHint"
+    row[8:] = ["grp=" + protein + "_" + gene + ";src=C;pri=4;"]
+
+    if row[2] == "CDS":
+        row[2] = "CDSpart"
+        exonLength = int(row[4]) - int(row[3]) + 1
+        if exonLength < 2 * cutoff + 3:
+            row[3] = str(int(row[3]) + (int(exonLength / 6)) * 3)
+            row[4] = str(int(row[3]) + 2)
+        else:
+            row[3] = str(int(row[3]) + cutoff)
+            row[4] = str(int(row[4]) - cutoff)
+
+    if row[2] == "Intron":
+        row[2] = "intron"
+
+    if row[2] == "start_codon":
+        row[2] = "start"
+
+    if row[2] == "stop_codon":
+        row[2] = "stop"
+
+    return row
 
 
 def main():
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# ==============================================================
+# Tomas Bruna
+# Copyright 2021, Georgia Institute of Technology, USA
+#
+# Streaming normalization of the input protein database. OrthoDB protein
+# sequences sometimes end with a dot, which is not compatible with DIAMOND,
+# and pipe ("|") characters in fasta headers break the matching of Spaln
+# results to DIAMOND pairs. Each line is therefore normalized by removing its
+# first dot and by replacing pipes with underscores. The normalized database
+# is never written to disk: it is streamed to its consumer (e.g. DIAMOND
+# makedb) while an offset index of the original file is created. The index
+# is used to fetch normalized sequences by their IDs.
+# ==============================================================
+
+
+import argparse
+import hashlib
+import os
+import re
+import sys
+
+
+CHUNK_SIZE = 16 * 1024 * 1024
+HEADER = re.compile(rb"^>[^\n]*", re.M)
+
+
+def normalizeChunk(chunk):
+    """Normalize lines in a chunk of a fasta file
+
+    Args:
+        chunk (bytes): Complete lines from a fasta file
+
+    Returns:
+        bytes: Lines with first dots removed and pipes replaced by
+               underscores
+    """
+    if b"." in chunk:
+        chunk = b"\n".join([line.replace(b".", b"", 1)
+                            for line in chunk.split(b"\n")])
+    return chunk.replace(b"|", b"_")
+
+
+def readChunks(fasta):
+    """Read a file in large chunks which end at line boundaries
+
+    Args:
+        fasta (filepath): Input file
+
+    Yields:
+        tuple: Offset of the chunk in the file and the chunk
+    """
+    with open(fasta, "rb") as f:
+        offset = 0
+        rest = b""
+        while True:
+            block = f.read(CHUNK_SIZE)
+            if not block:
+                break
+            block = rest + block
+            end = block.rfind(b"\n") + 1
+            if end == 0:
+                rest = block
+                continue
+            yield offset, block[:end]
+            offset += end
+            rest = block[end:]
+        if rest:
+            yield offset, rest
+
+
+def scan(fasta):
+    """Check whether a protein file needs to be normalized
+
+    Args:
+        fasta (filepath): Protein file
+
+    Returns:
+        tuple: True if the file is already normalized and the SHA-1 hash of
+               the normalized file content
+    """
+    clean = True
+    sha1 = hashlib.sha1()
+    for offset, chunk in readChunks(fasta):
+        if b"." in chunk or b"|" in chunk:
+            clean = False
+            chunk = normalizeChunk(chunk)
+        sha1.update(chunk)
+    return clean, sha1.hexdigest()
+
+
+def normalize(fasta, output=None, index=None):
+    """Stream normalized proteins to an output and index the original file
+
+    Args:
+        fasta (filepath): Protein file
+        output: Binary file object for the normalized proteins, e.g. stdin
+                of DIAMOND makedb. Nothing is written if None.
+        index (filepath): Output file for the offset index. The index is not
+                          created if None.
+    """
+    indexFile = None
+    if index:
+        indexFile = open(index + ".tmp", "w")
+
+    protein = None
+    proteinStart = 0
+    end = 0
+    for offset, chunk in readChunks(fasta):
+        if output:
+            output.write(normalizeChunk(chunk))
+
+        end = offset + len(chunk)
+        if not indexFile:
+            continue
+
+        for header in HEADER.finditer(chunk):
+            headerStart = offset + header.start()
+            if protein is not None:
+                indexFile.write(protein + "\t" + str(proteinStart) + "\t" +
+                                str(headerStart - proteinStart) + "\n")
+            protein = proteinId(header.group())
+            proteinStart = headerStart
+
+    if indexFile:
+        if protein is not None:
+            indexFile.write(protein + "\t" + str(proteinStart) + "\t" +
+                            str(end - proteinStart) + "\n")
+        indexFile.close()
+        os.replace(index + ".tmp", index)
+
+
+def proteinId(header):
+    """Get the normalized ID of a protein from its original fasta header"""
+    fields = normalizeChunk(header)[1:].split()
+    if len(fields) == 0:
+        return ""
+    return fields[0].decode()
+
+
+def fetch(fasta, index, ids, output):
+    """Write normalized sequences of selected proteins
+
+    Args:
+        fasta (filepath): Protein file
+        index (filepath): Offset index created by the normalize function
+        ids (set): Normalized IDs of proteins to fetch
+        output (filepath): Output fasta file
+    """
+    records = []
+    with open(index) as indexFile:
+        for line in indexFile:
+            protein, start, length = line.rstrip("\n").split("\t")
+            if protein in ids:
+                records.append((int(start), int(length)))
+
+    # Read the records in the order in which they are stored
+    records.sort()
+    with open(fasta, "rb") as f, open(output, "wb") as out:
+        for start, length in records:
+            f.seek(start)
+            out.write(normalizeChunk(f.read(length)))
+
+
+def main():
+    args = parseCmd()
+    normalize(args.input, sys.stdout.buffer, args.index)
+
+
+def parseCmd():
+
+    parser = argparse.ArgumentParser(description='Normalize a protein \
+        database: remove the first dot from each line and replace pipes \
+        with underscores. The normalized database is printed to stdout.')
+
+    parser.add_argument('input', metavar='proteins.fasta', type=str,
+                        help='Protein database in FASTA format.')
+    parser.add_argument('--index', type=str,
+                        help='Output file for the offset index of proteins \
+                        in the input file.')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
@@ -3,22 +3,58 @@
 # Tomas Bruna
 # Copyright 2019, Georgia Institute of Technology, USA
 #
-# Select high confidence features from ProtHint output file.
+# Select high confidence features from ProtHint output file. Several named
+# threshold profiles can be evaluated in a single pass over the input, each
+# profile writes the selected features to its own output file. The sweep mode
+# counts the introns, starts and stops which pass each point of a grid of
+# thresholds, also in a single pass.
 # ==============================================================
 
 
 import argparse
-import csv
-import re
-
-
-def extractFeature(text, feature):
-    regex = feature + '=([^;]+)'
-    search = re.search(regex, text)
-    if search:
-        return search.groups()[0]
-    else:
-        return None
+import bisect
+import itertools
+import sys
+
+from gffRecords import GffWriter, readGff
+
+
+# Thresholds of each feature type which can be swept, with the hint value
+# they apply to and the comparison which the value must satisfy
+FEATURE_THRESHOLDS = {
+    "intron": [("intronCoverage", "coverage", ">="),
+               ("intronAlignment", "al_score", ">=")],
+    "start_codon": [("startCoverage", "coverage", ">="),
+                    ("startAlignment", "al_score", ">="),
+                    ("startOverlap", "CDS_overlap", "<=")],
+    "stop_codon": [("stopCoverage", "coverage", ">="),
+                   ("stopAlignment", "al_score", ">=")]
+}
+SWEEP_FEATURES = [("introns", "intron"), ("starts", "start_codon"),
+                  ("stops", "stop_codon")]
+
+
+def hintValues(row):
+    """Parse values used by the filter from a row
+
+    Args:
+        row: Parsed gff row
+
+    Returns:
+        tuple: Arguments of the Filter.decideValues function
+    """
+    attributes = row.attributes
+    al_score = attributes.get("al_score")
+    if al_score:
+        al_score = float(al_score)
+    CDS_overlap = attributes.get("CDS_overlap")
+    if CDS_overlap is not None:
+        CDS_overlap = int(CDS_overlap)
+
+    return (row[2], int(row[5]), al_score,
+            attributes.get("topProt") == "TRUE",
+            attributes.get("fullProteinAligned") == "TRUE",
+            attributes.get("splice_sites"), CDS_overlap)
 
 
 class Filter:
@@ -27,43 +63,60 @@ class Filter:
         self.args = args
 
     def decide(self, row):
-        self.al_score = extractFeature(row[8], "al_score")
-        if self.al_score:
-            self.al_score = float(self.al_score)
-        self.fullProtein = extractFeature(row[8], "fullProteinAligned")
-        self.topProtein = extractFeature(row[8], "topProt")
-        self.row = row
-        self.coverage = int(row[5])
+        return self.decideValues(*hintValues(row))
+
+    def decideValues(self, feature, coverage, al_score, topProtein,
+                     fullProtein, spliceSites=None, CDS_overlap=None):
+        """Decide whether a hint passes the filter, given the values parsed
+        from its row
+
+        Args:
+            feature (string): Feature type (3rd column)
+            coverage (int): Coverage of the hint (6th column)
+            al_score (float): Alignment score, None if not present
+            topProtein (bool): Whether the hint is flagged by topProt=TRUE
+            fullProtein (bool): Whether the hint is flagged by
+                                fullProteinAligned=TRUE
+            spliceSites (string): Splice sites of an intron
+            CDS_overlap (int): CDS overlap of a start
+
+        Returns:
+            bool: True if the hint passes the filter
+        """
+        self.feature = feature.lower()
+        self.coverage = coverage
+        self.al_score = al_score
+        self.topProtein = topProtein
+        self.fullProtein = fullProtein
+        self.spliceSites = spliceSites
+        self.CDS_overlap = CDS_overlap
 
         self.__determineCoverageThreshod()
 
-        if (row[2].lower() == "intron"):
+        if (self.feature == "intron"):
             return self.__intron()
-        elif (row[2].lower() == "stop_codon"):
+        elif (self.feature == "stop_codon"):
             return self.__stop()
-        elif (row[2].lower() == "start_codon"):
+        elif (self.feature == "start_codon"):
             return self.__start()
         else:
             return True
 
     def __determineCoverageThreshod(self):
-        if (self.row[2].lower() == "intron"):
+        if (self.feature == "intron"):
             self.coverageThreshold = self.args.intronCoverage
-        elif (self.row[2].lower() == "stop_codon"):
+        elif (self.feature == "stop_codon"):
             self.coverageThreshold = self.args.stopCoverage
-        elif (self.row[2].lower() == "start_codon"):
+        elif (self.feature == "start_codon"):
             self.coverageThreshold = self.args.startCoverage
 
-        if ((self.args.addTopProteins and self.topProtein == "TRUE") or
-           (self.args.addFullAligned and self.fullProtein == "TRUE")):
+        if ((self.args.addTopProteins and self.topProtein) or
+           (self.args.addFullAligned and self.fullProtein)):
             self.coverageThreshold = 1
 
     def __intron(self):
-        if not self.args.addAllSpliceSites:
-            spliceSites = extractFeature(self.row[8], "splice_sites")
-            if spliceSites is not None and spliceSites.lower() != "gt_ag":
-                if not self.args.addGCAG or spliceSites.lower() != "gc_ag":
-                    return False
+        if not spliceSitesPass(self.args, self.spliceSites):
+            return False
 
         if (self.coverage >= self.coverageThreshold and
            self.al_score >= self.args.intronAlignment):
@@ -73,7 +126,7 @@ class Filter:
 
     def __stop(self):
         coverageThreshold = self.args.stopCoverage
-        if self.args.addTopProteins and self.topProtein == "TRUE":
+        if self.args.addTopProteins and self.topProtein:
             coverageThreshold = 1
 
         if (self.al_score is None):
@@ -87,14 +140,12 @@ class Filter:
 
     def __start(self):
         coverageThreshold = self.args.startCoverage
-        if self.args.addTopProteins and self.topProtein == "TRUE":
+        if self.args.addTopProteins and self.topProtein:
             coverageThreshold = 1
 
-        CDS_overlap = extractFeature(self.row[8], "CDS_overlap")
+        CDS_overlap = self.CDS_overlap
         if (CDS_overlap is None):
             CDS_overlap = 0
-        else:
-            CDS_overlap = int(CDS_overlap)
 
         if (self.al_score is None):
             self.al_score = 1
@@ -107,24 +158,310 @@ class Filter:
         return False
 
 
+def spliceSitesPass(args, spliceSites):
+    """Check whether splice sites of an intron are allowed
+
+    Args:
+        args: Arguments accepted by the Filter class
+        spliceSites (string): Splice sites of the intron, None if unknown
+    """
+    if args.addAllSpliceSites or spliceSites is None:
+        return True
+    if spliceSites.lower() == "gt_ag":
+        return True
+    return args.addGCAG and spliceSites.lower() == "gc_ag"
+
+
+class Sweep:
+
+    def __init__(self, args, grid):
+        """Count hints which pass each point of a grid of thresholds
+
+        Args:
+            args: Arguments accepted by the Filter class. Thresholds which are
+                  not swept are taken from here.
+            grid (dict): Swept threshold values indexed by threshold names
+        """
+        self.args = args
+        self.grid = grid
+        # Sorted values of every threshold, a single value if not swept
+        self.values = {}
+        for thresholds in FEATURE_THRESHOLDS.values():
+            for name, value, comparison in thresholds:
+                self.values[name] = sorted(grid.get(name,
+                                                    [getattr(args, name)]))
+        # For each feature, number of hints in each cell of the grid. A cell
+        # is given by the position of the hint values among the sorted
+        # threshold values.
+        self.histograms = {feature: {} for feature in FEATURE_THRESHOLDS}
+
+    def add(self, feature, coverage, al_score, topProtein, fullProtein,
+            spliceSites=None, CDS_overlap=None):
+        """Add a hint, the arguments are the same as in Filter.decideValues
+        """
+        feature = feature.lower()
+        if feature not in FEATURE_THRESHOLDS:
+            return
+
+        override = self.args.addTopProteins and topProtein
+        if feature == "intron":
+            # Introns without an alignment score never pass the filter
+            if al_score is None or \
+               not spliceSitesPass(self.args, spliceSites):
+                return
+            override = override or (self.args.addFullAligned and
+                                    fullProtein)
+        elif al_score is None:
+            al_score = 1
+
+        hint = {"coverage": coverage, "al_score": al_score,
+                "CDS_overlap": CDS_overlap or 0}
+        cell = []
+        for name, value, comparison in FEATURE_THRESHOLDS[feature]:
+            values = self.values[name]
+            value = hint[value]
+            if name.endswith("Coverage") and override:
+                # The coverage threshold of top proteins is always 1
+                cell.append(len(values) if coverage >= 1 else 0)
+            elif comparison == ">=":
+                cell.append(bisect.bisect_right(values, value))
+            else:
+                cell.append(bisect.bisect_left(values, value))
+
+        cell = tuple(cell)
+        histogram = self.histograms[feature]
+        histogram[cell] = histogram.get(cell, 0) + 1
+
+    def __cumulate(self, feature):
+        """Sum the histogram of a feature so that each cell contains the
+        number of hints which pass the thresholds given by the cell
+
+        Returns:
+            tuple: Flat list with the sums and strides of its dimensions
+        """
+        thresholds = FEATURE_THRESHOLDS[feature]
+        shape = [len(self.values[name]) + 1
+                 for name, value, comparison in thresholds]
+        strides = [1] * len(shape)
+        for i in reversed(range(len(shape) - 1)):
+            strides[i] = strides[i + 1] * shape[i + 1]
+
+        sums = [0] * (strides[0] * shape[0])
+        for cell, count in self.histograms[feature].items():
+            sums[sum(i * stride for i, stride in zip(cell, strides))] = count
+
+        # A hint passes the j-th value of a ">=" threshold if its cell index
+        # is larger than j (suffix sums) and the j-th value of a "<="
+        # threshold if its cell index is at most j (prefix sums)
+        for axis, (name, value, comparison) in enumerate(thresholds):
+            stride = strides[axis]
+            size = shape[axis]
+            if comparison == ">=":
+                for i in reversed(range(len(sums))):
+                    if (i // stride) % size < size - 1:
+                        sums[i] += sums[i + stride]
+            else:
+                for i in range(len(sums)):
+                    if (i // stride) % size > 0:
+                        sums[i] += sums[i - stride]
+
+        return sums, strides
+
+    def table(self):
+        """Count hints passing each grid point
+
+        Returns:
+            list: Rows with the swept threshold values followed by the numbers
+                  of introns, starts and stops. The first row is a header.
+        """
+        cumulated = {feature: self.__cumulate(feature)
+                     for feature in FEATURE_THRESHOLDS}
+        names = list(self.grid)
+        rows = [names + [label for label, feature in SWEEP_FEATURES]]
+        for point in itertools.product(*[sorted(self.grid[name])
+                                         for name in names]):
+            thresholds = dict(zip(names, point))
+            row = [str(value) for value in point]
+            for label, feature in SWEEP_FEATURES:
+                sums, strides = cumulated[feature]
+                index = 0
+                for (name, value, comparison), stride in \
+                        zip(FEATURE_THRESHOLDS[feature], strides):
+                    values = self.values[name]
+                    j = values.index(thresholds.get(name, values[0]))
+                    if comparison == ">=":
+                        j += 1
+                    index += j * stride
+                row.append(str(sums[index]))
+            rows.append(row)
+        return rows
+
+
+class ProfileFilter:
+
+    def __init__(self, profiles):
+        """Filter with several named threshold profiles
+
+        Args:
+            profiles (dict): Thresholds accepted by the Filter class (see
+                             filterArgs) indexed by profile names
+        """
+        self.filters = [(name, Filter(args))
+                        for name, args in profiles.items()]
+
+    def decide(self, row):
+        """Evaluate all profiles on a row, the row is parsed only once
+
+        Args:
+            row: Parsed gff row
+
+        Returns:
+            list: Names of profiles which the row passes
+        """
+        return self.decideValues(hintValues(row))
+
+    def decideValues(self, values):
+        """Evaluate all profiles on values parsed by hintValues
+
+        Returns:
+            list: Names of profiles which the values pass
+        """
+        return [name for name, filter in self.filters
+                if filter.decideValues(*values)]
+
+
+def normalizeRow(row):
+    """Set the source and the default coverage of a raw hint
+
+    Args:
+        row: Parsed gff row, modified in place
+    """
+    row[1] = "ProtHint"
+
+    if row[5] == ".":
+        row[5] = "1"
+
+
 def printHighConfidence(args):
     filter = Filter(args)
-    for row in csv.reader(open(args.input), delimiter='\t'):
-        row[1] = "ProtHint"
+    with GffWriter() as output:
+        for row in readGff(args.input):
+            normalizeRow(row)
+
+            if filter.decide(row):
+                output.write(row)
 
-        if row[5] == ".":
-            row[5] = "1"
 
-        if filter.decide(row):
-            print("\t".join(row))
+def printProfiles(input, profiles, sweep=None):
+    """Select high confidence features with several threshold profiles in a
+    single pass
+
+    Args:
+        input (filepath): Input gff file
+        profiles (dict): Threshold options (see filterArgs) indexed by paths
+                         to output files of the profiles
+        sweep (Sweep): Threshold sweep to which all hints are added in the
+                       same pass
+    """
+    filter = ProfileFilter({output: filterArgs(options)
+                            for output, options in profiles.items()})
+    outputs = {output: GffWriter(output) for output in profiles}
+    for row in readGff(input):
+        normalizeRow(row)
+        values = hintValues(row)
+
+        if sweep:
+            sweep.add(*values)
+        for output in filter.decideValues(values):
+            outputs[output].write(row)
+
+    for output in outputs.values():
+        output.close()
 
 
 def main():
     args = parseCmd()
-    printHighConfidence(args)
+    if args.sweep:
+        sweep = Sweep(args, sweepGrid(args.sweep))
+        printProfiles(args.input, profiles(args.profile or []), sweep)
+        with GffWriter() as output:
+            for row in sweep.table():
+                output.write(row)
+    elif args.profile:
+        printProfiles(args.input, profiles(args.profile))
+    else:
+        printHighConfidence(args)
+
+
+def sweepGrid(arguments):
+    """Parse --sweep arguments
+
+    Args:
+        arguments (list): Arguments in the THRESHOLD=VALUE,VALUE,... format
+
+    Returns:
+        dict: Lists of threshold values indexed by threshold names
+    """
+    types = {}
+    for thresholds in FEATURE_THRESHOLDS.values():
+        for name, value, comparison in thresholds:
+            types[name] = float if name.endswith("Alignment") else int
+
+    grid = {}
+    for argument in arguments:
+        name, sep, values = argument.partition("=")
+        if name not in types or not values:
+            sys.exit('error: Invalid sweep "' + argument + '", the expected '
+                     'format is THRESHOLD=VALUE,VALUE,... with one of these '
+                     'thresholds: ' + ", ".join(types) + ".")
+        try:
+            grid[name] = sorted(set(types[name](value)
+                                    for value in values.split(",")))
+        except ValueError:
+            sys.exit('error: Invalid value in sweep "' + argument + '".')
+    return grid
+
+
+def profiles(arguments):
+    """Parse --profile arguments
+
+    Args:
+        arguments (list): Arguments in the OUTPUT=OPTIONS format
+
+    Returns:
+        dict: Threshold options indexed by output files
+    """
+    parsed = {}
+    for argument in arguments:
+        if "=" not in argument:
+            sys.exit('error: Invalid profile "' + argument + '", the '
+                     'expected format is OUTPUT=OPTIONS.')
+        output, options = argument.split("=", 1)
+        if output in parsed:
+            sys.exit('error: Output file "' + output + '" is used by '
+                     'multiple profiles.')
+        parsed[output] = options
+    return parsed
+
+
+def filterArgs(options=""):
+    """Create filter thresholds from a string with command line options.
+    Thresholds which are not specified in the string keep their defaults.
+
+    Args:
+        options (string): Threshold options, e.g. "--intronCoverage 0"
+
+    Returns:
+        Namespace: Arguments accepted by the Filter class
+    """
+    return getParser().parse_args(["-"] + options.split())
 
 
 def parseCmd():
+    return getParser().parse_args()
+
+
+def getParser():
 
     parser = argparse.ArgumentParser(description='Select and print high confidence features\
                                      from ProtHint output file.')
@@ -167,8 +504,31 @@ def parseCmd():
     parser.add_argument('--addTopProteins', action='store_true',
                         help='Add hints corresponding to the top protein, no matter \
                         the coverage. Other scoring thresholds still apply.')
-
-    return parser.parse_args()
+    parser.add_argument('--profile', type=str, action='append',
+                        metavar='OUTPUT=OPTIONS',
+                        help='Threshold profile in the OUTPUT=OPTIONS format, \
+                        e.g. "introns.gff=--intronCoverage 0 \
+                        --addAllSpliceSites". Features which satisfy the \
+                        thresholds in OPTIONS are printed to the OUTPUT file; \
+                        thresholds which are not specified in OPTIONS keep \
+                        their default values. The option can be repeated to \
+                        evaluate several profiles in a single pass over the \
+                        input. If used, nothing is printed to stdout and \
+                        thresholds given outside of profiles are ignored.')
+    parser.add_argument('--sweep', type=str, action='append',
+                        metavar='THRESHOLD=VALUES',
+                        help='Threshold sweep, e.g. \
+                        "intronCoverage=1,2,4". Instead of printing the \
+                        features, print the numbers of introns, starts and \
+                        stops which pass each combination of the swept \
+                        threshold values. The option can be repeated to sweep \
+                        several thresholds; other thresholds are set by the \
+                        remaining options. All grid points are evaluated in a \
+                        single pass over the input. Can be combined with \
+                        --profile to print the features selected by chosen \
+                        thresholds in the same pass.')
+
+    return parser
 
 
 if __name__ == '__main__':
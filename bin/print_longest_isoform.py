@@ -7,28 +7,18 @@
 # ==============================================================
 
 
-import csv
 import sys
-import re
 import argparse
 
-
-def extractFeature(text, feature):
-    regex = feature + ' "([^"]+)"'
-    result = re.search(regex, text)
-    if result:
-        return result.groups()[0]
-    else:
-        return None
+from gffRecords import GffWriter, readGff
 
 
 def computeLengths(input):
     transcriptLengths = dict()
-    for row in csv.reader(open(input), delimiter='\t'):
-        if len(row) == 0 or row[0].startswith('#'): continue
+    for row in readGff(input):
         if (row[2] == 'CDS'):
-            gene = extractFeature(row[8], 'gene_id')
-            transcript = extractFeature(row[8], 'transcript_id')
+            gene = row.attribute('gene_id')
+            transcript = row.attribute('transcript_id')
             if not gene or not transcript:
                 continue
             if gene not in transcriptLengths:
@@ -54,14 +44,14 @@ def getLongestTranscript(transcriptLengths):
 
 
 def printLongest(input, longestTranscripts):
-    for row in csv.reader(open(input), delimiter='\t'):
-        if len(row) == 0 or row[0].startswith('#'): continue
-        gene = extractFeature(row[8], 'gene_id')
-        transcript = extractFeature(row[8], 'transcript_id')
-        if not gene or not transcript:
-            continue
-        if (longestTranscripts[gene] == transcript):
-            print('\t'.join(row))
+    with GffWriter() as output:
+        for row in readGff(input):
+            gene = row.attribute('gene_id')
+            transcript = row.attribute('transcript_id')
+            if not gene or not transcript:
+                continue
+            if (longestTranscripts[gene] == transcript):
+                output.write(row)
 
 
 def main():
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+# ==============================================================
+# Tomas Bruna
+# Copyright 2021, Georgia Institute of Technology, USA
+#
+# Process raw hints scored by spaln-boundary-scorer in a single pass. The
+# spaln.gff file is read once and each row is routed by its feature type to
+# the intron, stop, start, CDS and top-protein chain branches. The results
+# (prothint.gff, evidence.gff and top_chains.gff) are identical to the outputs
+# of the original chain of scripts: print_high_confidence.py,
+# combineRawHints.py, cds_with_upstream_support.py, count_cds_overlaps.py and
+# make_chains.py. The hints in prothint.gff are ordered as if sorted by
+# "LC_ALL=C sort -k1,1 -k4,4n -k5,5n". The raw hints are read from the
+# columnar store created by hintStore.py, which is cached next to spaln.gff,
+# so repeated processing of the same file does not parse the GFF text again.
+# With several threads, parts of the raw hints are parsed and routed in
+# parallel processes and the hints combined in the parts are merged. In the
+# low memory mode, the raw hints are sorted by contigs and the hints of each
+# contig are processed separately.
+# ==============================================================
+
+
+import argparse
+import itertools
+import sys
+from multiprocessing import Pool
+
+from gffRecords import GffWriter, Record, parseRows
+from hintStore import CHUNK_ROWS, HintStore
+from print_high_confidence import Filter, filterArgs
+from combineRawHints import Hint, sortedRows
+from cds_with_upstream_support import UpstreamIndex
+from count_cds_overlaps import countOverlaps, indexCDS
+from make_chains import chainColumns
+
+
+INTRON_FILTER = "--intronCoverage 0 --intronAlignment 0.1 --addAllSpliceSites"
+STOP_FILTER = "--stopCoverage 0 --stopAlignment 0.01"
+START_FILTER = "--startCoverage 0 --startAlignment 0.01"
+CHAIN_FILTER = "--startCoverage 0 --startAlignment 0.01 --stopCoverage 0 " \
+               "--stopAlignment 0.01 --intronCoverage 0 " \
+               "--intronAlignment 0.1 --addAllSpliceSites"
+EXON_CUTOFF = 15
+
+
+def sortKey(line):
+    row = line.split("\t", 5)
+    return row[0], int(row[3]), int(row[4]), line
+
+
+class Router:
+
+    def __init__(self):
+        """Create empty branches. The filters of the branches are created
+        only once and reused for all routed hints.
+        """
+        self.introns = {}
+        self.stops = {}
+        self.starts = {}
+        self.cds = {}
+        self.topHints = 0
+
+        # Combined hints and the filter of each branch. CDS are not filtered.
+        self.branches = {
+            "CDS": (self.cds, None),
+            "Intron": (self.introns, Filter(filterArgs(INTRON_FILTER))),
+            "stop_codon": (self.stops, Filter(filterArgs(STOP_FILTER))),
+            "start_codon": (self.starts, Filter(filterArgs(START_FILTER)))
+        }
+        self.chainFilter = Filter(filterArgs(CHAIN_FILTER))
+
+    def route(self, store, first, last, writeChain=None, combine=True):
+        """Route raw hints to the individual branches. Filtered hints are
+        combined in the branches, top protein chains are passed to a
+        function.
+
+        Args:
+            store (HintStore): Raw hints
+            first (int): Index of the first routed hint in the store
+            last (int): Index after the last routed hint
+            writeChain (function): Function called with each row of the top
+                                   protein chains. Chains are not created
+                                   if None.
+            combine (bool): Whether to combine hints in the branches
+        """
+        text = store.dictionaries
+        contig, source, feature, strand, phase, spliceSites, seed, \
+            protein = [store.columns[name] for name in
+                       ["contig", "source", "feature", "strand", "phase",
+                        "spliceSites", "seed", "protein"]]
+        start = store.columns["start"]
+        end = store.columns["end"]
+        topProt = store.columns["topProt"]
+        scores = store.scores()
+        alScores = store.alScores()
+        branches = self.branches
+        chainFilter = self.chainFilter
+
+        for i in range(first, last):
+            featureType = text["feature"][feature[i]]
+            score = scores[i]
+            coverage = score
+            if score == ".":
+                coverage = "1"
+            al_score = alScores[i]
+            sites = text["spliceSites"][spliceSites[i]]
+
+            if topProt[i]:
+                self.topHints += 1
+                if writeChain is not None and \
+                   chainFilter.decideValues(featureType, int(coverage),
+                                            al_score, True, False, sites):
+                    row = [text["contig"][contig[i]], "ProtHint",
+                           featureType, str(start[i]), str(end[i]),
+                           coverage, text["strand"][strand[i]],
+                           text["phase"][phase[i]]]
+                    writeChain(chainColumns(row,
+                                            text["protein"][protein[i]],
+                                            text["seed"][seed[i]],
+                                            EXON_CUTOFF))
+
+            if not combine or featureType not in branches:
+                continue
+            hints, branchFilter = branches[featureType]
+            rowSource = text["source"][source[i]]
+            if branchFilter is not None:
+                if not branchFilter.decideValues(featureType, int(coverage),
+                                                 al_score, bool(topProt[i]),
+                                                 False, sites):
+                    continue
+                # Filtered hints are normalized like by normalizeRow
+                rowSource = "ProtHint"
+                score = coverage
+
+            topValue = "TRUE" if topProt[i] else None
+            signature = (contig[i], feature[i], start[i], end[i], strand[i],
+                         phase[i])
+            if signature in hints:
+                hints[signature].update(score, al_score, topValue, sites,
+                                        text["seed"][seed[i]])
+                continue
+
+            row = [text["contig"][contig[i]], rowSource, featureType,
+                   str(start[i]), str(end[i]), score,
+                   text["strand"][strand[i]], text["phase"][phase[i]]]
+            hints[signature] = Hint(row, al_score, topValue, sites,
+                                    text["seed"][seed[i]])
+
+    def clear(self):
+        """Remove all combined hints"""
+        for hints, branchFilter in self.branches.values():
+            hints.clear()
+
+    def merge(self, other):
+        """Add hints routed by another router from raw hints which follow
+        the raw hints routed by this router
+
+        Args:
+            other (Router): Router of the following raw hints
+        """
+        self.topHints += other.topHints
+        for featureType, (hints, branchFilter) in self.branches.items():
+            for signature, hint in other.branches[featureType][0].items():
+                if signature in hints:
+                    hints[signature].merge(hint)
+                else:
+                    hints[signature] = hint
+
+
+# Raw hints routed by the worker processes
+workerStore = None
+
+
+def setWorkerStore(store):
+    global workerStore
+    workerStore = store
+
+
+def routeRange(task):
+    """Route a range of raw hints of the store in a worker process
+
+    Args:
+        task (tuple): Index of the first hint and the index after the last
+                      hint
+
+    Returns:
+        tuple: Router with the combined hints and the rows of top protein
+               chains, in the input order
+    """
+    first, last = task
+    router = Router()
+    chains = []
+    router.route(workerStore, first, last, chains.append)
+    return router, chains
+
+
+def routeRows(spalnGff, chainsOut, cache=True, threads=1):
+    """Read raw hints and route them to the individual branches. Filtered and
+    combined introns, stops, starts and CDS are returned, top protein chains
+    are directly written to the output file.
+
+    Args:
+        spalnGff (filepath): Raw hints scored by spaln-boundary-scorer
+        chainsOut (filepath): Output file for top protein chains
+        cache (bool): Whether to use the cached columnar store of the hints
+        threads (int): Number of processes which parse and route parts of
+                       the raw hints. Results of the parts are merged in the
+                       input order, the outputs are the same as from a single
+                       process.
+
+    Returns:
+        Router: Router with the combined hints
+    """
+    store = HintStore(spalnGff, cache, threads)
+    router = Router()
+    chains = GffWriter(chainsOut)
+
+    if threads > 1 and len(store) > 0:
+        step = -(-len(store) // threads)
+        tasks = [(first, min(first + step, len(store)))
+                 for first in range(0, len(store), step)]
+        with Pool(processes=threads, initializer=setWorkerStore,
+                  initargs=(store,)) as pool:
+            for partRouter, partChains in pool.imap(routeRange, tasks):
+                router.merge(partRouter)
+                for row in partChains:
+                    chains.write(row)
+    else:
+        router.route(store, 0, len(store), chains.write)
+
+    chains.close()
+    return router
+
+
+def routeContigs(spalnGff, chainsOut, sortBuffer):
+    """Route raw hints of each contig separately. The raw hints are sorted by
+    contigs with the external sort command and only the raw and combined
+    hints of one contig are kept in memory. Top protein chains are written
+    in the input order, in a separate pass which parses only the raw hints
+    flagged as top protein hints.
+
+    Args:
+        spalnGff (filepath): Raw hints scored by spaln-boundary-scorer
+        chainsOut (filepath): Output file for top protein chains
+        sortBuffer (string): Size of the main memory buffer of the sort
+                             command
+
+    Yields:
+        Router: The same router with the combined hints of each contig, in
+                the order of contigs in the final output. The hints of the
+                previous contig are removed before the next contig is routed.
+    """
+    chainRouter = Router()
+    with open(spalnGff) as f, GffWriter(chainsOut) as chains:
+        rows = parseRows(line for line in f if "topProt=TRUE" in line)
+        while True:
+            store = HintStore.fromRows(itertools.islice(rows, CHUNK_ROWS))
+            if len(store) == 0:
+                break
+            chainRouter.route(store, 0, len(store), chains.write,
+                              combine=False)
+
+    router = Router()
+    # The stable sort keeps the input order of hints within each contig
+    for contig, rows in itertools.groupby(
+            sortedRows(spalnGff, sortBuffer, ["-k1,1"], stable=True),
+            key=lambda row: row[0]):
+        store = HintStore.fromRows(rows)
+        router.route(store, 0, len(store))
+        yield router
+        router.clear()
+
+
+def startsWithOverlaps(introns, starts, cds):
+    """Count CDS overlaps of combined starts. Only CDS regions which have an
+    upstream support (by start codon or intron) in hints are counted.
+
+    Args:
+        introns (dict): Combined introns
+        starts (dict): Combined starts
+        cds (dict): Combined CDS
+
+    Returns:
+        list: Starts with the CDS_overlap feature
+    """
+    upstream = UpstreamIndex()
+    for hint in introns.values():
+        upstream.add(hint.row)
+    for hint in starts.values():
+        upstream.add(hint.row)
+
+    supportedCDS = [hint.format().split("\t") for hint in cds.values()
+                    if upstream.hasUpstreamSupport(hint.row)]
+    codingSegments = indexCDS(supportedCDS)
+
+    return ["\t".join(start) for start in countOverlaps(
+            [hint.format().split("\t") for hint in starts.values()],
+            codingSegments)]
+
+
+def formatHints(router):
+    """Format the combined hints of the final output
+
+    Args:
+        router (Router): Router with the combined hints
+
+    Returns:
+        list: Lines with combined introns, stops and starts, sorted like by
+              "LC_ALL=C sort -k1,1 -k4,4n -k5,5n"
+    """
+    hints = [hint.format() for hint in router.introns.values()]
+    hints += [hint.format() for hint in router.stops.values()]
+    hints += startsWithOverlaps(router.introns, router.starts, router.cds)
+    hints.sort(key=sortKey)
+    return hints
+
+
+def process(spalnGff, prothintOut, evidenceOut, chainsOut, nonCanonical,
+            cache=True, threads=1, lowMemory=False, sortBuffer="1G"):
+    """Create the final ProtHint outputs from raw scored hints
+
+    Args:
+        spalnGff (filepath): Raw hints scored by spaln-boundary-scorer
+        prothintOut (filepath): Output file for all combined hints
+        evidenceOut (filepath): Output file for high-confidence hints
+        chainsOut (filepath): Output file for top protein chains
+        nonCanonical (bool): Whether to add non-canonical introns to the
+                             high-confidence set
+        cache (bool): Whether to use the cached columnar store of the hints
+        threads (int): Number of processes which parse and route parts of
+                       the raw hints
+        lowMemory (bool): Whether to process the raw hints of each contig
+                          separately, see routeContigs. The outputs are the
+                          same.
+        sortBuffer (string): Size of the main memory buffer of the sort
+                             command in the low memory mode
+    """
+    if lowMemory:
+        routers = routeContigs(spalnGff, chainsOut, sortBuffer)
+    else:
+        routers = [routeRows(spalnGff, chainsOut, cache, threads)]
+
+    options = ""
+    if nonCanonical:
+        options = "--addAllSpliceSites"
+    evidenceFilter = Filter(filterArgs(options))
+
+    topHints = 0
+    with GffWriter(prothintOut) as prothint, \
+            GffWriter(evidenceOut) as evidence:
+        for router in routers:
+            for line in formatHints(router):
+                prothint.writeLine(line)
+                if evidenceFilter.decide(Record(line.split("\t"))):
+                    evidence.writeLine(line)
+            topHints = router.topHints
+
+    if topHints == 0:
+        sys.exit('error: The "topProt=TRUE" flag is missing in the '
+                 'Spaln/spaln.gff output file. This issue can be caused by '
+                 'the presence of special characters in the fasta headers of '
+                 'input files. Please remove any special characters and '
+                 're-run ProtHint. See https://github.com/gatech-genemark/ProtHint#input '
+                 'for more details about the input format.')
+
+
+def main():
+    args = parseCmd()
+    process(args.input, args.prothint, args.evidence, args.chains,
+            args.addAllSpliceSites, not args.noCache, args.threads,
+            args.lowMemory, args.sortBuffer)
+
+
+def parseCmd():
+
+    parser = argparse.ArgumentParser(description='Process raw hints scored \
+        by spaln-boundary-scorer in a single pass. Create the file with all \
+        combined hints, the file with high-confidence hints and the file \
+        with top protein chains.')
+
+    parser.add_argument('input', metavar='spaln.gff', type=str,
+                        help='Raw hints scored by spaln-boundary-scorer, \
+                        with top protein hints flagged by \
+                        flag_top_proteins.py.')
+
+    parser.add_argument('--prothint', type=str, default='prothint.gff',
+                        help='Output file for all combined hints. Default = \
+                        prothint.gff')
+    parser.add_argument('--evidence', type=str, default='evidence.gff',
+                        help='Output file for high-confidence hints. \
+                        Default = evidence.gff')
+    parser.add_argument('--chains', type=str, default='top_chains.gff',
+                        help='Output file for top protein chains. Default = \
+                        top_chains.gff')
+    parser.add_argument('--addAllSpliceSites', action='store_true',
+                        help='Add introns with any splice sites to the \
+                        high-confidence set. By default, only introns with \
+                        canonical GT_AG splice sites are added.')
+    parser.add_argument('--noCache', action='store_true',
+                        help='Do not load the hints from the columnar cache \
+                        file (spaln.gff.columns) and do not create it.')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='Number of processes which parse and route \
+                        parts of the raw hints in parallel. The outputs are \
+                        identical to the outputs of a single process. \
+                        Default = 1.')
+    parser.add_argument('--lowMemory', action='store_true',
+                        help='Sort the raw hints by contigs with the external \
+                        sort command and process the hints of each contig \
+                        separately. Only the hints of one contig are kept in \
+                        memory. The columnar cache is not used and \
+                        --threads is ignored in this mode. The outputs are \
+                        identical.')
+    parser.add_argument('--sortBuffer', type=str, default='1G',
+                        help='Size of the main memory buffer of the sort \
+                        command in the --lowMemory mode. Default = 1G.')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
@@ -13,7 +13,16 @@ import sys
 import subprocess
 import time
 import shutil
-import tempfile
+import csv
+import queue
+import threading
+import processSpalnGff
+import prothint2augustus
+import flag_top_proteins
+import hintStore
+import checkpoints
+import normalizeProteins
+import resourceUsage
 
 
 VERSION = '2.6.0'
@@ -22,6 +31,19 @@ binDir = ''
 genome = ''
 proteins = ''
 threads = ''
+proteinsClean = True
+proteinsHash = ''
+resume = False
+manifest = None
+report = None
+costModel = ''
+maxPairMemory = 0
+
+MANIFEST = 'checkpoints.json'
+REPORT = 'timing.json'
+PAIR_PROTEINS = 'pair_proteins.faa'
+FINAL_OUTPUTS = ['prothint.gff', 'evidence.gff', 'top_chains.gff',
+                 'prothint_augustus.gff']
 
 ProtHintRef = 'https://doi.org/10.1093/nargab/lqaa026'
 DIAMONDRef = 'https://doi.org/10.1038/nmeth.3176'
@@ -33,49 +55,80 @@ def main():
 
     setEnvironment(args)
 
-    processInputProteins(args)
-
     if args.geneSeeds and args.prevGeneSeeds:
+        processInputProteins(args)
         nextIteration(args)
     else:
         standardRun(args)
 
 
 def standardRun(args):
-    """Execute a standard ProtHint run
+    """Execute a standard ProtHint run. Stages which do not depend on each
+    other (GeneMark-ES and the preparation of the DIAMOND database) are
+    executed concurrently.
 
     Args:
         args: Command line arguments
     """
+    scheduler = Scheduler(int(threads))
+    scheduler.add("processInputProteins", processInputProteins, [args])
+
+    # Building the DIAMOND database is mostly sequential, the remaining
+    # threads are used by GeneMark-ES
+    esThreads = threads
+    dbThreads = threads
+    buildDb = not args.diamondPairs and not args.diamondDb
+    if not args.geneSeeds and buildDb and int(threads) > 1:
+        esThreads = str(int(threads) - 1)
+        dbThreads = "1"
+
     seedGenes = args.geneSeeds
+    seedDependencies = []
     if not seedGenes:
-        seedGenes = runGeneMarkES(args.pbs, args.fungus)
+        seedGenes = workDir + "/GeneMark_ES/genemark.gtf"
+        scheduler.add("runGeneMarkES", runStage,
+                      ["runGeneMarkES", {"genome": genome},
+                       {"fungus": args.fungus}, [seedGenes], runGeneMarkES,
+                       args.pbs, args.fungus, esThreads],
+                      threads=int(esThreads))
+        seedDependencies = ["runGeneMarkES"]
     else:
         sys.stderr.write("[" + time.ctime() + "] Skipping GeneMark-ES, using "
                          "the supplied gene seeds file instead\n")
 
-    translateSeeds(seedGenes)
+    scheduler.add("translateSeeds", runStage,
+                  ["translateSeeds", {"seedGenes": seedGenes,
+                                      "genome": genome}, {},
+                   [workDir + "/seed_proteins.faa",
+                    workDir + "/gene_stat.yaml"], translateSeeds, seedGenes],
+                  after=seedDependencies)
 
     diamondPairs = args.diamondPairs
     if not diamondPairs:
-        diamondPairs = runDiamond(args.maxProteinsPerSeed, args.evalue)
+        scheduler.add("prepareDiamondDb", diamondDatabase, [args, dbThreads],
+                      after=["processInputProteins"], threads=int(dbThreads))
     else:
         sys.stderr.write("[" + time.ctime() + "] Skipping DIAMOND, using "
                          "the supplied DIAMOND output file instead\n")
 
-    prepareSeedSequences(diamondPairs)
+    scheduler.run()
 
-    runSpaln(diamondPairs, args.pbs, args.minExonScore,
-             args.nonCanonicalSpliceSites, args.longGene, args.longProtein)
+    if not diamondPairs:
+        diamondPairs = searchAndAlign(args,
+                                      scheduler.results["prepareDiamondDb"])
+    else:
+        alignPairs(diamondPairs, args)
 
     checkOutputs(diamondPairs, seedGenes)
-    flagTopProteins(diamondPairs)
-    processSpalnOutput(args.nonCanonicalSpliceSites)
+    runStage("processSpalnOutput", {"spaln": workDir + "/Spaln/spaln.gff"},
+             {"nonCanonical": args.nonCanonicalSpliceSites},
+             [workDir + "/" + output for output in FINAL_OUTPUTS],
+             processSpalnOutput, args.nonCanonicalSpliceSites, int(threads),
+             args.lowMemory)
 
     if args.cleanup:
         cleanup()
 
-    os.remove(proteins)
     sys.stderr.write("[" + time.ctime() + "] ProtHint finished.\n")
 
 
@@ -90,38 +143,254 @@ def nextIteration(args):
         args: Command line arguments
     """
     sys.stderr.write("ProtHint is running in the iterative mode.\n")
-    prepareDataForNextIteration(args.geneSeeds, args.prevGeneSeeds,
-                                args.prevSpalnGff)
+    runStage("prepareDataForNextIteration",
+             {"geneSeeds": args.geneSeeds,
+              "prevGeneSeeds": args.prevGeneSeeds,
+              "prevSpalnGff": args.prevSpalnGff}, {},
+             [workDir + "/uniqueSeeds.gtf", workDir + "/prevHints.gff"],
+             prepareDataForNextIteration, args.geneSeeds, args.prevGeneSeeds,
+             args.prevSpalnGff)
 
     diamondPairs = ""
-    if os.path.getsize("uniqueSeeds.gtf") != 0:
-        translateSeeds("uniqueSeeds.gtf")
-        diamondPairs = runDiamond(args.maxProteinsPerSeed, args.evalue)
-        prepareSeedSequences(diamondPairs)
-        runSpaln(diamondPairs, args.pbs, args.minExonScore,
-                 args.nonCanonicalSpliceSites, args.longGene, args.longProtein)
-        flagTopProteins(diamondPairs)
-        # Append subset of hints from the previous iteration to the current result
-        os.chdir(workDir)
-        with open("Spaln/spaln.gff", "a") as new:
-            with open("prevHints.gff", "r") as prev:
-                for line in prev:
-                    new.write(line)
+    if os.path.getsize(workDir + "/uniqueSeeds.gtf") != 0:
+        uniqueSeeds = workDir + "/uniqueSeeds.gtf"
+        runStage("translateSeeds", {"seedGenes": uniqueSeeds,
+                                    "genome": genome}, {},
+                 [workDir + "/seed_proteins.faa",
+                  workDir + "/gene_stat.yaml"],
+                 translateSeeds, uniqueSeeds)
+        diamondPairs = searchAndAlign(args, diamondDatabase(args, threads))
+        runStage("appendPreviousHints",
+                 {"spaln": workDir + "/Spaln/spaln.gff",
+                  "prevHints": workDir + "/prevHints.gff"}, {},
+                 [workDir + "/Spaln/spaln.gff"], appendPreviousHints)
     else:
         sys.stderr.write("Warning: No unique gene seeds were detected in the " +
                          args.geneSeeds + " input file. ProtHint will only " \
                          "update seed gene IDs of hints to match the IDs in " \
                          "the new seed gene file.\n")
-        if not os.path.isdir("Spaln"):
-            os.mkdir("Spaln")
-        shutil.move("prevHints.gff", "Spaln/spaln.gff")
+        runStage("usePreviousHints",
+                 {"prevHints": workDir + "/prevHints.gff"}, {},
+                 [workDir + "/Spaln/spaln.gff"], usePreviousHints)
 
-    processSpalnOutput(args.nonCanonicalSpliceSites)
+    runStage("processSpalnOutput", {"spaln": workDir + "/Spaln/spaln.gff"},
+             {"nonCanonical": args.nonCanonicalSpliceSites},
+             [workDir + "/" + output for output in FINAL_OUTPUTS],
+             processSpalnOutput, args.nonCanonicalSpliceSites, int(threads),
+             args.lowMemory)
 
-    os.remove(proteins)
     sys.stderr.write("[" + time.ctime() + "] ProtHint finished.\n")
 
 
+def searchAndAlign(args, diamondDb):
+    """Search for homologous proteins with DIAMOND and align the seed
+    gene-protein pairs with Spaln. If the search is split into several
+    chunks (--diamondChunks), pairs from each chunk are aligned while
+    DIAMOND searches the next chunk.
+
+    Args:
+        args: Command line arguments
+        diamondDb (filepath): DIAMOND database of input proteins
+
+    Returns:
+        string: Path to DIAMOND output
+    """
+    if args.diamondChunks <= 1:
+        diamondPairs = diamondSearch(args, diamondDb)
+        alignPairs(diamondPairs, args)
+        return diamondPairs
+
+    inputs = {"seedProteins": workDir + "/seed_proteins.faa",
+              "diamondDb": diamondDb, "genome": genome,
+              "geneStat": workDir + "/gene_stat.yaml", "proteins": proteins}
+    outputs = [workDir + "/diamond/diamond.out", workDir + "/nuc.fasta",
+               workDir + "/Spaln/spaln.gff"]
+    if not proteinsClean:
+        outputs.append(workDir + "/" + PAIR_PROTEINS)
+    addCostModel(inputs, outputs)
+    return runStage("streamAlignments", inputs,
+                    {"maxProteins": args.maxProteinsPerSeed,
+                     "evalue": args.evalue, "chunks": args.diamondChunks,
+                     "minExonScore": args.minExonScore,
+                     "nonCanonical": args.nonCanonicalSpliceSites,
+                     "longGene": args.longGene,
+                     "longProtein": args.longProtein,
+                     "maxPairMemory": maxPairMemory},
+                    outputs, streamAlignments, args, diamondDb)
+
+
+def alignPairs(diamondPairs, args):
+    """Prepare sequences of seed gene-protein pairs and align them with Spaln
+
+    Args:
+        diamondPairs (filepath): Path to file with seed gene-protein pairs
+        args: Command line arguments
+    """
+    outputs = [workDir + "/nuc.fasta"]
+    if not proteinsClean:
+        outputs.append(workDir + "/" + PAIR_PROTEINS)
+    pairProteins = runStage("prepareSeedSequences",
+                            {"diamondPairs": diamondPairs, "genome": genome,
+                             "geneStat": workDir + "/gene_stat.yaml",
+                             "proteins": proteins}, {},
+                            outputs, prepareSeedSequences, diamondPairs)
+
+    if args.dryRun:
+        estimateAlignments(diamondPairs, pairProteins, args)
+        sys.exit(0)
+
+    inputs = {"diamondPairs": diamondPairs, "nuc": workDir + "/nuc.fasta",
+              "proteins": pairProteins}
+    outputs = [workDir + "/Spaln/spaln.gff"]
+    addCostModel(inputs, outputs)
+    runStage("runSpaln", inputs,
+             {"minExonScore": args.minExonScore,
+              "nonCanonical": args.nonCanonicalSpliceSites,
+              "longGene": args.longGene, "longProtein": args.longProtein,
+              "maxPairMemory": maxPairMemory},
+             outputs, runSpaln, diamondPairs, args.pbs,
+             args.minExonScore, args.nonCanonicalSpliceSites, args.longGene,
+             args.longProtein, pairProteins)
+
+
+def addCostModel(inputs, outputs):
+    """Add the alignment cost model to the checkpoint inputs and outputs of
+    a stage which aligns pairs with Spaln. With --maxPairMemory, the model
+    chooses the Spaln modes of the pairs, so the alignments depend on it.
+    The model is also updated by the alignments, therefore it is checked
+    like an output modified in place.
+
+    Args:
+        inputs (dict): Stage inputs, updated in place
+        outputs (list): Stage outputs, updated in place
+    """
+    if maxPairMemory:
+        inputs["costModel"] = costModel
+        outputs.append(costModel)
+
+
+def estimateAlignments(diamondPairs, pairProteins, args):
+    """Print the expected CPU time and peak memory of Spaln alignments,
+    predicted by the alignment cost model
+
+    Args:
+        diamondPairs (filepath): Path to file with seed gene-protein pairs
+        pairProteins (filepath): Protein sequences of the pairs
+        args: Command line arguments
+    """
+    sys.stderr.write("[" + time.ctime() + "] Estimating the cost of " +
+                     "alignments (--dryRun), no alignments are made\n")
+    maxPairMemoryFlag = ""
+    if maxPairMemory:
+        maxPairMemoryFlag = " --maxPairMemory " + str(maxPairMemory)
+    callScript("splicedAlignment.py", "--dryRun --cores " + threads +
+               " --nuc " + workDir + "/nuc.fasta --list " + diamondPairs +
+               " --prot " + pairProteins + " --costModel " + costModel +
+               " --longGene " + str(args.longGene) + " --longProtein " +
+               str(args.longProtein) + maxPairMemoryFlag)
+    sys.stderr.write("[" + time.ctime() + "] Dry run finished. Re-run " +
+                     "ProtHint without --dryRun (and with --resume to " +
+                     "reuse the finished stages) to align the pairs.\n")
+
+
+def diamondDatabase(args, dbThreads):
+    """Get the DIAMOND database of input proteins. Unless a prebuilt
+    database is supplied, the database is built or loaded from the cache.
+
+    Args:
+        args: Command line arguments
+        dbThreads (string): Number of threads used to build the database
+
+    Returns:
+        string: Path to the database
+    """
+    if args.diamondDb:
+        sys.stderr.write("[" + time.ctime() + "] Using the supplied DIAMOND " +
+                         "database " + args.diamondDb + "\n")
+        return args.diamondDb
+
+    if args.diamondCache:
+        diamondDb = args.diamondCache + "/" + diamondCacheKey() + ".dmnd"
+    else:
+        diamondDb = workDir + "/diamond/diamond_db.dmnd"
+    return runStage("prepareDiamondDb", {"proteins": proteins},
+                    {"diamondCache": args.diamondCache}, [diamondDb],
+                    prepareDiamondDb, args.diamondCache, dbThreads)
+
+
+def diamondSearch(args, diamondDb):
+    """Run the DIAMOND search stage
+
+    Args:
+        args: Command line arguments
+        diamondDb (filepath): DIAMOND database of input proteins
+
+    Returns:
+        string: Path to DIAMOND output
+    """
+    return runStage("runDiamond",
+                    {"seedProteins": workDir + "/seed_proteins.faa",
+                     "diamondDb": diamondDb},
+                    {"maxProteins": args.maxProteinsPerSeed,
+                     "evalue": args.evalue},
+                    [workDir + "/diamond/diamond.out"], runDiamond,
+                    args.maxProteinsPerSeed, args.evalue, diamondDb)
+
+
+def appendPreviousHints():
+    """Append subset of hints from the previous iteration to the current
+    result
+    """
+    os.chdir(workDir)
+    with open("Spaln/spaln.gff", "a") as new:
+        with open("prevHints.gff", "r") as prev:
+            for line in prev:
+                new.write(line)
+
+
+def usePreviousHints():
+    """Use hints from the previous iteration as the result of this iteration.
+    The hints are copied, so that the output of the data preparation for the
+    next iteration remains valid for resumed runs.
+    """
+    spalnDir = workDir + "/Spaln"
+    if not os.path.isdir(spalnDir):
+        os.mkdir(spalnDir)
+    shutil.copyfile(workDir + "/prevHints.gff", spalnDir + "/spaln.gff")
+
+
+def runStage(name, inputs, params, outputs, stage, *args):
+    """Run a pipeline stage and record it in the checkpoint manifest. Time
+    and memory used by the stage are recorded in the resource report. If
+    ProtHint is resumed (--resume), the stage is skipped when its inputs,
+    parameters and outputs recorded in the manifest are still valid.
+
+    Args:
+        name (string): Name of the stage
+        inputs (dict): Paths to input files indexed by input names
+        params (dict): Parameters which affect the results of the stage
+        outputs (list): Paths to output files
+        stage (function): Function which executes the stage
+        *args: Arguments passed to the stage function
+
+    Returns:
+        Value returned by the stage function
+    """
+    report.startStage(name)
+    if resume and manifest.isValid(name, inputs, params, outputs):
+        sys.stderr.write("[" + time.ctime() + "] Skipping " + name + ", " +
+                         "results recorded in " + MANIFEST + " are still " +
+                         "valid\n")
+        report.endStage(skipped=True)
+        return manifest.result(name)
+
+    inputFingerprints = manifest.fingerprintInputs(inputs)
+    result = stage(*args)
+    manifest.record(name, inputFingerprints, params, outputs, result)
+    report.endStage()
+    return result
+
+
 def prepareDataForNextIteration(geneSeeds, prevGeneSeeds, prevSpalnGff):
     """Select gene seeds which are unique in this iteration and hints from
     previous iteration of ProtHint which correspond to seeds which are
@@ -153,11 +422,14 @@ def prepareDataForNextIteration(geneSeeds, prevGeneSeeds, prevSpalnGff):
     os.remove("longest_seed_isoforms.gtf")
 
 
-def runGeneMarkES(pbs, fungus):
-    """Run GeneMark-ES
+def runGeneMarkES(pbs, fungus, cores):
+    """Run GeneMark-ES. The working directory of ProtHint is not changed,
+    so that other stages can run at the same time.
 
     Args:
         pbs (boolean): Whether to run on pbs
+        fungus (boolean): Whether to run GeneMark-ES in the fungal mode
+        cores (string): Number of cores used by GeneMark-ES
 
     Returns:
         string: Path to genemark gff output
@@ -166,7 +438,6 @@ def runGeneMarkES(pbs, fungus):
     ESDir = workDir + "/GeneMark_ES"
     if not os.path.isdir(ESDir):
         os.mkdir(ESDir)
-    os.chdir(ESDir)
 
     pbsFlag = ""
     if pbs:
@@ -176,12 +447,12 @@ def runGeneMarkES(pbs, fungus):
     if fungus:
         fungusFlag = " --fungus"
 
-    callDependency("gmes_petap.pl", "--verbose --cores " + threads + pbsFlag +
+    callDependency("gmes_petap.pl", "--verbose --cores " + cores + pbsFlag +
                    " --ES --seq " + genome + " --soft auto" + fungusFlag,
-                   "GeneMarkES")
+                   "GeneMarkES", cwd=ESDir)
 
     sys.stderr.write("[" + time.ctime() + "] GeneMark-ES finished.\n")
-    return os.path.abspath("genemark.gtf")
+    return ESDir + "/genemark.gtf"
 
 
 def translateSeeds(seedGenes):
@@ -192,29 +463,29 @@ def translateSeeds(seedGenes):
     """
     sys.stderr.write("[" + time.ctime() + "] Translating gene seeds to " +
                      "proteins\n")
-    os.chdir(workDir)
+    isoforms = workDir + "/longest_seed_isoforms.gtf"
+    isoformsCds = workDir + "/longest_seed_isoforms_cds.gtf"
 
-    callScript("print_longest_isoform.py", seedGenes +
-               " > longest_seed_isoforms.gtf")
+    callScript("print_longest_isoform.py", seedGenes + " > " + isoforms)
 
-    systemCall("grep \tCDS\t longest_seed_isoforms.gtf > " +
-               "longest_seed_isoforms_cds.gtf")
-    os.remove("longest_seed_isoforms.gtf")
+    systemCall("grep \tCDS\t " + isoforms + " > " + isoformsCds)
+    os.remove(isoforms)
 
-    callScript("proteins_from_gtf.pl", "--stat gene_stat.yaml --seq " +
-               genome + " --annot longest_seed_isoforms_cds.gtf --out " +
-               "seed_proteins.faa --format GTF")
-    os.remove("longest_seed_isoforms_cds.gtf")
+    callScript("proteins_from_gtf.pl", "--stat " + workDir +
+               "/gene_stat.yaml --seq " + genome + " --annot " + isoformsCds +
+               " --out " + workDir + "/seed_proteins.faa --format GTF")
+    os.remove(isoformsCds)
 
     sys.stderr.write("[" + time.ctime() + "] Translation of seeds finished\n")
 
 
-def runDiamond(maxProteins, evalue):
+def runDiamond(maxProteins, evalue, diamondDb):
     """Run DIAMOND protein search
 
     Args:
         maxProteins (int): Maximum number of protein hits per seed gene.
         evalue (float): Maximum e-value of DIAMOND hits
+        diamondDb (filepath): DIAMOND database of input proteins
 
     Returns:
         string: Path to DIAMOND output
@@ -224,40 +495,203 @@ def runDiamond(maxProteins, evalue):
     diamondDir = workDir + "/diamond"
     if not os.path.isdir(diamondDir):
         os.mkdir(diamondDir)
-    os.chdir(diamondDir)
 
-    # Make DIAMOND db
-    callDependency("diamond", "makedb --in " + proteins + " -d diamond_db " +
-                   "--threads " + threads)
-
-    # Actual DIAMOND run
-    callDependency("diamond", "blastp --query ../seed_proteins.faa --db " +
-                   "diamond_db --outfmt 6 qseqid sseqid --out diamond.out " +
-                   "--max-target-seqs " + str(maxProteins) + " --max-hsps 1 " +
-                   "--threads " + threads + " --evalue " + str(evalue))
+    diamondBlastp(workDir + "/seed_proteins.faa", diamondDir + "/diamond.out",
+                  diamondDb, maxProteins, evalue, threads)
 
     sys.stderr.write("[" + time.ctime() + "] DIAMOND finished\n")
-    return os.path.abspath("diamond.out")
+    return diamondDir + "/diamond.out"
+
+
+def diamondBlastp(query, output, diamondDb, maxProteins, evalue,
+                  diamondThreads):
+    """Search seed proteins against the DIAMOND database of input proteins
+
+    Args:
+        query (filepath): Seed proteins
+        output (filepath): Output file with seed gene-protein pairs
+        diamondDb (filepath): DIAMOND database of input proteins
+        maxProteins (int): Maximum number of protein hits per seed gene.
+        evalue (float): Maximum e-value of DIAMOND hits
+        diamondThreads (string): Number of threads used by DIAMOND
+    """
+    callDependency("diamond", "blastp --query " + query + " --db " +
+                   diamondDb + " --outfmt 6 qseqid sseqid --out " + output +
+                   " --max-target-seqs " + str(maxProteins) + " --max-hsps 1" +
+                   " --threads " + diamondThreads + " --evalue " + str(evalue))
+
+
+def prepareDiamondDb(diamondCache, dbThreads):
+    """Build a DIAMOND database of input proteins or load it from the cache.
+    The working directory of ProtHint is not changed, so that other stages
+    can run at the same time.
+
+    Args:
+        diamondCache (dirpath): Folder with cached DIAMOND databases. If
+                                empty, the database is built in the
+                                diamond folder.
+        dbThreads (string): Number of threads used to build the database
+
+    Returns:
+        string: Path to the database
+    """
+    sys.stderr.write("[" + time.ctime() + "] Preparing DIAMOND database\n")
+
+    if diamondCache:
+        return cachedDiamondDb(diamondCache, dbThreads)
+
+    diamondDir = workDir + "/diamond"
+    if not os.path.isdir(diamondDir):
+        os.mkdir(diamondDir)
+    makeDiamondDb(diamondDir + "/diamond_db", dbThreads)
+    return diamondDir + "/diamond_db.dmnd"
+
+
+def diamondCacheKey():
+    """Get the key of the DIAMOND database of input proteins in the cache.
+    The cache is keyed by a hash of the pre-processed input proteins and by
+    the DIAMOND version.
+
+    Returns:
+        string: The key
+    """
+    return proteinsHash + "_" + diamondVersion()
+
+
+def cachedDiamondDb(diamondCache, dbThreads):
+    """Get a DIAMOND database of input proteins from the cache. If the
+    database is not in the cache yet, it is built and saved to the cache.
+
+    Args:
+        diamondCache (dirpath): Folder with cached DIAMOND databases
+        dbThreads (string): Number of threads used to build the database
+
+    Returns:
+        string: Path to the cached database
+    """
+    key = diamondCacheKey()
+    diamondDb = diamondCache + "/" + key + ".dmnd"
+
+    if os.path.isfile(diamondDb):
+        sys.stderr.write("[" + time.ctime() + "] Using a cached DIAMOND " +
+                         "database " + diamondDb + "\n")
+        return diamondDb
+
+    # Build the database under a temporary name first so that concurrent
+    # runs never see an incomplete database
+    tmpDb = diamondCache + "/" + key + ".tmp" + str(os.getpid())
+    makeDiamondDb(tmpDb, dbThreads)
+    os.replace(tmpDb + ".dmnd", diamondDb)
+    sys.stderr.write("[" + time.ctime() + "] DIAMOND database saved to " +
+                     "the cache: " + diamondDb + "\n")
+    return diamondDb
+
+
+def makeDiamondDb(diamondDb, dbThreads):
+    """Make a DIAMOND database of input proteins. Input proteins which need
+    to be normalized are streamed to DIAMOND and the offset index of the
+    proteins is created at the same time.
+
+    Args:
+        diamondDb (string): Path to the database, without the .dmnd suffix
+        dbThreads (string): Number of threads used by DIAMOND
+    """
+    if proteinsClean:
+        callDependency("diamond", "makedb --in " + proteins + " -d " +
+                       diamondDb + " --threads " + dbThreads)
+        return
+
+    cmd = findDependency("diamond") + " makedb -d " + diamondDb + \
+        " --threads " + dbThreads
+    sys.stderr.flush()
+    start = time.time()
+    process = subprocess.Popen(["bash", "-c", cmd], stdin=subprocess.PIPE)
+    try:
+        normalizeProteins.normalize(proteins, process.stdin,
+                                    workDir + "/proteins_" + proteinsHash +
+                                    ".idx")
+        process.stdin.close()
+    except BrokenPipeError:
+        pass
+    waitForCommand(process, cmd, start)
+
+
+def diamondVersion():
+    """Get the version of DIAMOND used by ProtHint
+
+    Returns:
+        string: DIAMOND version
+    """
+    cmd = findDependency("diamond") + " version"
+    try:
+        output = subprocess.check_output(["bash", "-c", cmd]).decode()
+    except subprocess.CalledProcessError:
+        sys.exit('[' + time.ctime() + '] error: ProtHint exited due to an ' +
+                 'error in command: ' + cmd)
+    return output.split()[-1]
 
 
 def prepareSeedSequences(diamondPairs):
-    """Prepare nucleotide sequences for seed genes
+    """Prepare nucleotide sequences for seed genes. If the input proteins
+    need to be normalized, also prepare normalized sequences of proteins
+    in the pairs.
 
     Args:
         diamondPairs (filepath): Path to file with seed gene-protein pairs
+
+    Returns:
+        string: Path to protein sequences for the alignment of pairs
     """
     sys.stderr.write("[" + time.ctime() + "] Preparing pairs for alignments\n")
-    os.chdir(workDir)
 
-    callScript("nucseq_for_selected_genes.pl", "--seq " + genome + " --out " +
-               "nuc.fasta --gene gene_stat.yaml --list " + diamondPairs)
+    pairProteins = preparePairSequences(diamondPairs, workDir + "/nuc.fasta",
+                                        workDir + "/" + PAIR_PROTEINS)
 
     sys.stderr.write("[" + time.ctime() + "] Preparation of pairs finished\n")
+    return pairProteins
+
+
+def preparePairSequences(diamondPairs, nucOut, pairProteinsOut):
+    """Prepare nucleotide sequences of seed genes and, if the input proteins
+    need to be normalized, normalized sequences of proteins in the pairs
+
+    Args:
+        diamondPairs (filepath): Path to file with seed gene-protein pairs
+        nucOut (filepath): Output file for nucleotide sequences
+        pairProteinsOut (filepath): Output file for protein sequences
+
+    Returns:
+        string: Path to protein sequences for the alignment of pairs
+    """
+    callScript("nucseq_for_selected_genes.pl", "--seq " + genome + " --out " +
+               nucOut + " --gene " + workDir + "/gene_stat.yaml --list " +
+               diamondPairs)
+
+    if proteinsClean:
+        return proteins
+
+    fetchPairProteins(diamondPairs, pairProteinsOut)
+    return pairProteinsOut
+
+
+def fetchPairProteins(diamondPairs, output):
+    """Save normalized sequences of proteins in seed gene-protein pairs
+
+    Args:
+        diamondPairs (filepath): Path to file with seed gene-protein pairs
+        output (filepath): Output fasta file
+    """
+    ids = set()
+    for row in csv.reader(open(diamondPairs), delimiter='\t'):
+        ids.add(row[1])
+    normalizeProteins.fetch(proteins, proteinIndex(), ids, output)
 
 
 def runSpaln(diamondPairs, pbs, minExonScore, nonCanonical,
-             longGene, longProtein):
-    """Run Spaln spliced alignment and score the outputs with spaln-boundary-scorer
+             longGene, longProtein, pairProteins=''):
+    """Run Spaln spliced alignment and score the outputs with spaln-boundary-scorer.
+    Hints from the best DIAMOND hit of each seed gene are flagged with
+    topProt=TRUE. IDs of the pairs are checked before the alignment.
 
     Args:
         diamondPairs (filePath): Path to file with seed gene-protein pairs
@@ -270,30 +704,209 @@ def runSpaln(diamondPairs, pbs, minExonScore, nonCanonical,
                         Spaln alignment
         longProtein (int): Threshold for what is considered a long protein in
                            Spaln alignment
+        pairProteins (filepath): Protein sequences of the pairs. Input
+                                 proteins are used if empty.
     """
+    if not pairProteins:
+        pairProteins = proteins
+
     spalnDir = workDir + "/Spaln"
     if not os.path.isdir(spalnDir):
         os.mkdir(spalnDir)
     os.chdir(spalnDir)
 
-    nonCanonicalFlag = ""
-    if nonCanonical:
-        nonCanonicalFlag = " --nonCanonical "
-
     if not pbs:
-        callScript("run_spliced_alignment.pl", "--cores " + threads +
-                   " --nuc ../nuc.fasta --list " + diamondPairs + " --prot " +
-                   proteins + " --v --aligner spaln --min_exon_score " +
-                   str(minExonScore) + nonCanonicalFlag +
-                   " --longGene " + str(longGene) +
-                   " --longProtein " + str(longProtein))
+        runSplicedAlignment(diamondPairs, workDir + "/nuc.fasta",
+                            pairProteins, spalnDir, threads, minExonScore,
+                            nonCanonical, longGene, longProtein)
     else:
+        # Local alignments check the pairs in splicedAlignment.py
+        flag_top_proteins.checkPairIds(
+            flag_top_proteins.loadPairs(diamondPairs))
+        nonCanonicalFlag = ""
+        if nonCanonical:
+            nonCanonicalFlag = " --nonCanonical "
         callScript("run_spliced_alignment_pbs.pl", "--N 120 --K " + threads +
                    " --seq ../nuc.fasta --list " + diamondPairs + " --db " +
-                   proteins + " --v --aligner spaln --min_exon_score " +
+                   pairProteins + " --v --aligner spaln --min_exon_score " +
                    str(minExonScore) + nonCanonicalFlag +
                    " --longGene " + str(longGene) +
                    " --longProtein " + str(longProtein))
+        flagTopProteins(diamondPairs)
+
+
+def runSplicedAlignment(diamondPairs, nuc, pairProteins, spalnDir, cores,
+                        minExonScore, nonCanonical, longGene, longProtein):
+    """Align seed gene-protein pairs with Spaln on the local machine. The
+    scored alignments are saved to spaln.gff in the Spaln folder, hints from
+    the best DIAMOND hit of each seed gene are flagged with topProt=TRUE.
+
+    Args:
+        diamondPairs (filePath): Path to file with seed gene-protein pairs
+                                 to align
+        nuc (filepath): Nucleotide sequences of seed genes
+        pairProteins (filepath): Protein sequences of the pairs
+        spalnDir (dirpath): Folder for the spaln.gff output
+        cores (string): Number of parallel alignments
+        minExonScore (float): Discard all hints inside/neighboring exons with
+                              score lower than minExonScore
+        nonCanonical (bool): Whether to predict non-canonical introns
+        longGene (int): Threshold for what is considered a long gene in
+                        Spaln alignment
+        longProtein (int): Threshold for what is considered a long protein in
+                           Spaln alignment
+    """
+    nonCanonicalFlag = ""
+    if nonCanonical:
+        nonCanonicalFlag = " --nonCanonical"
+
+    costFlags = ""
+    if costModel:
+        costFlags = " --costModel " + costModel
+    if maxPairMemory:
+        costFlags += " --maxPairMemory " + str(maxPairMemory)
+
+    callScript("splicedAlignment.py", "--cores " + cores + " --nuc " + nuc +
+               " --list " + diamondPairs + " --prot " + pairProteins +
+               " --out " + spalnDir + "/spaln.gff --verbose --minExonScore " +
+               str(minExonScore) + nonCanonicalFlag +
+               " --longGene " + str(longGene) +
+               " --longProtein " + str(longProtein) + " --topProteins" +
+               costFlags)
+
+
+def streamAlignments(args, diamondDb):
+    """Search seed proteins against input proteins in chunks and align the
+    pairs from each chunk as soon as DIAMOND finishes the chunk. The chunk
+    searches run one after another, and so do the chunk alignments, but the
+    alignment of a chunk overlaps with the search of the next chunk. The
+    outputs are the same as in the sequential run: diamond.out, nuc.fasta
+    and Spaln/spaln.gff.
+
+    Args:
+        args: Command line arguments
+        diamondDb (filepath): DIAMOND database of input proteins
+
+    Returns:
+        string: Path to DIAMOND output
+    """
+    sys.stderr.write("[" + time.ctime() + "] Running DIAMOND and Spaln in " +
+                     str(args.diamondChunks) + " pipelined chunks\n")
+
+    diamondDir = workDir + "/diamond"
+    spalnDir = workDir + "/Spaln"
+    for folder in [diamondDir, spalnDir]:
+        if not os.path.isdir(folder):
+            os.mkdir(folder)
+
+    chunks = splitFasta(workDir + "/seed_proteins.faa", args.diamondChunks,
+                        diamondDir + "/seeds_")
+
+    # DIAMOND is mostly waiting for the alignments of previous chunks,
+    # alignments get the larger share of threads
+    diamondThreads = str(max(1, int(threads) // 4))
+    alignThreads = str(max(1, int(threads) - int(diamondThreads)))
+
+    scheduler = Scheduler(int(threads))
+    for i, chunk in enumerate(chunks):
+        scheduler.add("diamond" + str(i), diamondBlastp,
+                      [chunk, chunk + ".out", diamondDb,
+                       args.maxProteinsPerSeed, args.evalue, diamondThreads],
+                      after=["diamond" + str(i - 1)] if i > 0 else [],
+                      threads=int(diamondThreads))
+        scheduler.add("align" + str(i), alignChunk,
+                      [chunk + ".out", spalnDir + "/chunk_" + str(i), args,
+                       alignThreads],
+                      after=["diamond" + str(i)] +
+                            (["align" + str(i - 1)] if i > 0 else []),
+                      threads=int(alignThreads))
+    scheduler.run()
+
+    mergeChunks([chunk + ".out" for chunk in chunks],
+                diamondDir + "/diamond.out")
+    chunkDirs = [spalnDir + "/chunk_" + str(i) for i in range(len(chunks))]
+    mergeChunks([chunkDir + "/nuc.fasta" for chunkDir in chunkDirs],
+                workDir + "/nuc.fasta")
+    mergeChunks([chunkDir + "/spaln.gff" for chunkDir in chunkDirs],
+                spalnDir + "/spaln.gff")
+    if not proteinsClean:
+        # Proteins can be paired with seeds from several chunks
+        fetchPairProteins(diamondDir + "/diamond.out",
+                          workDir + "/" + PAIR_PROTEINS)
+
+    for chunk in chunks:
+        os.remove(chunk)
+        os.remove(chunk + ".out")
+    for chunkDir in chunkDirs:
+        shutil.rmtree(chunkDir)
+
+    sys.stderr.write("[" + time.ctime() + "] DIAMOND and Spaln finished\n")
+    return diamondDir + "/diamond.out"
+
+
+def alignChunk(diamondPairs, chunkDir, args, alignThreads):
+    """Prepare sequences of pairs found in a single chunk of seeds and align
+    them with Spaln
+
+    Args:
+        diamondPairs (filepath): Seed gene-protein pairs of the chunk
+        chunkDir (dirpath): Folder for the chunk alignments
+        args: Command line arguments
+        alignThreads (string): Number of alignment threads
+    """
+    if not os.path.isdir(chunkDir):
+        os.mkdir(chunkDir)
+    if os.path.getsize(diamondPairs) == 0:
+        return
+
+    pairProteins = preparePairSequences(diamondPairs, chunkDir + "/nuc.fasta",
+                                        chunkDir + "/" + PAIR_PROTEINS)
+    runSplicedAlignment(diamondPairs, chunkDir + "/nuc.fasta", pairProteins,
+                        chunkDir, alignThreads, args.minExonScore,
+                        args.nonCanonicalSpliceSites, args.longGene,
+                        args.longProtein)
+
+
+def splitFasta(fasta, chunks, prefix):
+    """Split a fasta file into chunks with similar numbers of records
+
+    Args:
+        fasta (filepath): Input fasta file
+        chunks (int): Number of chunks
+        prefix (string): Prefix of the output files
+
+    Returns:
+        list: Paths to the chunks. Fewer chunks are created if the file does
+              not have enough records.
+    """
+    with open(fasta) as f:
+        records = f.read().split("\n>")
+    records = [record.lstrip(">").rstrip("\n") for record in records
+               if record.strip()]
+
+    size = -(-len(records) // chunks)
+    paths = []
+    for start in range(0, len(records), size):
+        path = prefix + str(len(paths)) + ".faa"
+        with open(path, "w") as out:
+            for record in records[start:start + size]:
+                out.write(">" + record + "\n")
+        paths.append(path)
+    return paths
+
+
+def mergeChunks(chunks, output):
+    """Concatenate chunk outputs which exist into a single file
+
+    Args:
+        chunks (list): Paths to the chunk outputs, in the merge order
+        output (filepath): Output file
+    """
+    with open(output, "wb") as out:
+        for chunk in chunks:
+            if os.path.isfile(chunk):
+                with open(chunk, "rb") as f:
+                    shutil.copyfileobj(f, out)
 
 
 def checkOutputs(diamondPairs, seedGenes):
@@ -336,125 +949,31 @@ def flagTopProteins(diamondPairs):
     shutil.move("tmp", "Spaln/spaln.gff")
 
 
-def processSpalnOutput(nonCanonical):
+def processSpalnOutput(nonCanonical, processThreads=1, lowMemory=False):
     """Prepare the final output from Spaln result scored by spaln-boundary-scorer
        Convert the output to GeneMark and Augustus compatible formats
 
     Args:
         nonCanonical (bool): Whether to add non-canonical introns to the
                              high-confidence set
+        processThreads (int): Number of processes which parse and route
+                              parts of the raw hints
+        lowMemory (bool): Whether to process the raw hints of each contig
+                          separately
     """
     sys.stderr.write("[" + time.ctime() + "] Processing the output\n")
     os.chdir(workDir)
 
-    processSpalnIntrons()
-    processSpalnStops()
-    processSpalnStarts()
-    systemCall("sort -k1,1 -k4,4n -k5,5n -o prothint.gff prothint.gff")
-
-    printTopChains()
-
-    # High confidence
-    nonCanonicalFlag = ""
-    if nonCanonical:
-        nonCanonicalFlag = " --addAllSpliceSites "
-
-    callScript("print_high_confidence.py", "prothint.gff " + nonCanonicalFlag +
-               " > evidence.gff")
+    processSpalnGff.process("Spaln/spaln.gff", "prothint.gff", "evidence.gff",
+                            "top_chains.gff", nonCanonical,
+                            threads=processThreads, lowMemory=lowMemory)
 
     # Augustus compatible format
-    callScript("prothint2augustus.py", "prothint.gff evidence.gff "
-               "top_chains.gff prothint_augustus.gff")
+    prothint2augustus.convert("prothint.gff", "evidence.gff",
+                              "top_chains.gff", "prothint_augustus.gff")
     sys.stderr.write("[" + time.ctime() + "] Output processed\n")
 
 
-def processSpalnIntrons():
-    systemCall("grep Intron Spaln/spaln.gff > introns.gff || [[ $? == 1 ]]")
-
-    # Filter out introns with alignment score < 0.1
-    callScript("print_high_confidence.py", "introns.gff --intronCoverage 0 " +
-               "--intronAlignment 0.1 --addAllSpliceSites > introns_01.gff")
-    os.remove("introns.gff")
-
-    callScript("combineRawHints.py", "introns_01.gff > prothint.gff")
-    os.remove("introns_01.gff")
-
-
-def processSpalnStops():
-    systemCall("grep stop_codon Spaln/spaln.gff > stops.gff || [[ $? == 1 ]]")
-
-    # Filter out stops with alignment score < 0.01
-    callScript("print_high_confidence.py", "stops.gff --stopCoverage 0 " +
-               "--stopAlignment 0.01 > stops_01.gff")
-    os.remove("stops.gff")
-
-    callScript("combineRawHints.py", "stops_01.gff > stops_01_combined.gff")
-    systemCall("cat stops_01_combined.gff >> prothint.gff")
-
-    os.remove("stops_01.gff")
-    os.remove("stops_01_combined.gff")
-
-
-def processSpalnStarts():
-    systemCall("grep start_codon Spaln/spaln.gff > starts.gff || [[ $? == 1 ]]")
-
-    # Filter out starts with alignment score < 0.01
-    callScript("print_high_confidence.py", "starts.gff --startCoverage 0 " +
-               "--startAlignment 0.01 > starts_01.gff")
-    os.remove("starts.gff")
-
-    callScript("combineRawHints.py", "starts_01.gff > starts_01_combined.gff")
-    os.remove("starts_01.gff")
-
-    # The rest of this function counts CDS overlap of starts
-
-    systemCall("sort -k1,1 -k4,4n -k5,5n starts_01_combined.gff > " +
-               "starts_01_combined_sorted.gff")
-    os.remove("starts_01_combined.gff")
-
-    systemCall("grep CDS Spaln/spaln.gff > cds.gff || [[ $? == 1 ]]")
-    callScript("combineRawHints.py", "cds.gff > cds_combined.gff")
-    os.remove("cds.gff")
-
-    # Only count CDS regions which have an upstream support
-    # (by start codon or intron) in hints
-    callScript("cds_with_upstream_support.py", "cds_combined.gff " +
-               "starts_01_combined_sorted.gff prothint.gff > tmp")
-    shutil.move("tmp", "cds_combined.gff")
-
-    systemCall("sort -k1,1 -k4,4n -k5,5n cds_combined.gff > " +
-               "cds_combined_sorted.gff")
-    os.remove("cds_combined.gff")
-
-    callScript("count_cds_overlaps.py", "starts_01_combined_sorted.gff " +
-               "cds_combined_sorted.gff >> prothint.gff")
-
-    os.remove("starts_01_combined_sorted.gff")
-    os.remove("cds_combined_sorted.gff")
-
-
-def printTopChains():
-    systemCall("grep topProt=TRUE Spaln/spaln.gff > topProteins.gff " +
-               "|| [[ $? == 1 ]]")
-
-    if os.stat("topProteins.gff").st_size == 0:
-        sys.exit('error: The "topProt=TRUE" flag is missing in the '
-                 'Spaln/spaln.gff output file. This issue can be caused by '
-                 'the presence of special characters in the fasta headers of '
-                 'input files. Please remove any special characters and '
-                 're-run ProtHint. See https://github.com/gatech-genemark/ProtHint#input '
-                 'for more details about the input format.')
-
-    callScript("print_high_confidence.py", "topProteins.gff --startCoverage 0 " +
-               "--startAlignment 0.01 --stopCoverage 0 --stopAlignment 0.01 " +
-               "--intronCoverage 0 --intronAlignment 0.1 --addAllSpliceSites" +
-               " > topProteinsFiltered.gff")
-    os.remove("topProteins.gff")
-
-    callScript("make_chains.py", "topProteinsFiltered.gff > top_chains.gff")
-    os.remove("topProteinsFiltered.gff")
-
-
 def cleanup():
     """Delete temporary files and intermediate results
     """
@@ -478,6 +997,21 @@ def cleanup():
     except OSError:
         pass
 
+    try:
+        os.remove("Spaln/spaln.gff" + hintStore.CACHE_SUFFIX)
+    except OSError:
+        pass
+
+    try:
+        os.remove(PAIR_PROTEINS)
+    except OSError:
+        pass
+
+    try:
+        os.remove("proteins_" + proteinsHash + ".idx")
+    except OSError:
+        pass
+
     if os.path.exists("GeneMark_ES"):
         shutil.rmtree("GeneMark_ES/data", ignore_errors=True)
         shutil.rmtree("GeneMark_ES/info", ignore_errors=True)
@@ -487,18 +1021,50 @@ def cleanup():
 
 
 def processInputProteins(args):
-    """Remove dots from the input file with proteins.
+    """Check whether the input file with proteins needs to be normalized.
        OrhoDB protein sequences sometimes end with a dot. This format is not
-       compatible with DIAMOND.
-       Clean fasta headers by removing pipe ("|") characters.
+       compatible with DIAMOND. Fasta headers are cleaned by removing pipe
+       ("|") characters. Clean inputs are used as they are, other inputs are
+       normalized on the fly when DIAMOND database and alignment pairs are
+       prepared.
+    """
+    global proteins, proteinsClean, proteinsHash
+    proteins = args.proteins
+    proteinsClean, proteinsHash = runStage("processInputProteins",
+                                           {"proteins": proteins}, {}, [],
+                                           scanProteins, proteins)
+
+
+def scanProteins(proteinFile):
+    """Scan the input proteins
+
+    Args:
+        proteinFile (filepath): Input proteins
+
+    Returns:
+        list: Whether the proteins are clean and a hash of the normalized
+              proteins
     """
-    global proteins
     sys.stderr.write("[" + time.ctime() + "] Pre-processing protein input\n")
-    os.chdir(workDir)
-    protFile = tempfile.NamedTemporaryFile(delete=False, dir='.', prefix="prot")
-    systemCall('sed \"s/\.//\" ' + args.proteins + ' | sed \"s/|/_/g\" > ' +
-               protFile.name)
-    proteins = checkFileAndMakeAbsolute(protFile.name)
+    clean, sha1 = normalizeProteins.scan(proteinFile)
+    if not clean:
+        sys.stderr.write("[" + time.ctime() + "] Input proteins contain " +
+                         "dots or pipes, they will be normalized on the " +
+                         "fly\n")
+    return [clean, sha1]
+
+
+def proteinIndex():
+    """Get the offset index of the input proteins. The index is created if
+    it does not exist yet.
+
+    Returns:
+        string: Path to the index
+    """
+    index = workDir + "/proteins_" + proteinsHash + ".idx"
+    if not os.path.isfile(index):
+        normalizeProteins.normalize(proteins, None, index)
+    return index
 
 
 def setEnvironment(args):
@@ -514,7 +1080,8 @@ def setEnvironment(args):
     sys.stderr.write("  - ProtHint: " + ProtHintRef + "\n")
     sys.stderr.write("  - DIAMOND:  " + DIAMONDRef + "\n")
     sys.stderr.write("  - Spaln:    " + SpalnRef + "\n\n")
-    global workDir, binDir, genome, threads
+    global workDir, binDir, genome, threads, resume, manifest, report, \
+        costModel, maxPairMemory
     workDir = os.path.abspath(args.workdir)
     binDir = os.path.abspath(os.path.dirname(__file__))
 
@@ -556,9 +1123,53 @@ def setEnvironment(args):
                      "to seed genes in the DIAMOND pairs file must be specified.")
         args.diamondPairs = checkFileAndMakeAbsolute(args.diamondPairs)
 
+    if args.diamondDb:
+        if args.diamondPairs:
+            sys.exit("error: --diamondDb cannot be used together with\n"
+                     "--diamondPairs. DIAMOND search is skipped when\n"
+                     "--diamondPairs are supplied.")
+        args.diamondDb = checkFileAndMakeAbsolute(args.diamondDb)
+
+    if args.diamondChunks > 1:
+        if args.diamondPairs:
+            sys.exit("error: --diamondChunks cannot be used together with\n"
+                     "--diamondPairs. DIAMOND search is skipped when\n"
+                     "--diamondPairs are supplied.")
+        if args.pbs:
+            sys.exit("error: --diamondChunks cannot be used together with\n"
+                     "--pbs.")
+
+    if args.costModel:
+        costModel = os.path.abspath(args.costModel)
+    maxPairMemory = args.maxPairMemory
+
+    if args.dryRun:
+        if not args.costModel or not os.path.isfile(costModel):
+            sys.exit("error: --dryRun requires an existing cost model\n"
+                     "(--costModel) with measurements from previous runs.")
+        if args.diamondChunks > 1 or args.pbs:
+            sys.exit("error: --dryRun cannot be used together with\n"
+                     "--diamondChunks or --pbs.")
+
+    if args.maxPairMemory and not args.costModel:
+        sys.exit("error: --maxPairMemory requires a cost model\n"
+                 "(--costModel).")
+
+    if args.diamondCache:
+        args.diamondCache = os.path.abspath(args.diamondCache)
+        if not os.path.isdir(args.diamondCache):
+            os.makedirs(args.diamondCache)
+
     if not os.path.isdir(workDir):
         os.mkdir(workDir)
 
+    resume = args.resume
+    # Contents of files are hashed only in resumed runs, other runs record
+    # sizes and modification times
+    manifest = checkpoints.Manifest(workDir + "/" + MANIFEST, resume,
+                                    hashContents=resume)
+    report = resourceUsage.ResourceReport(workDir + "/" + REPORT, VERSION)
+
     # Log info about cmd
     callDir = "Called from: " + os.path.abspath(".") + "\n"
     cmd = "Cmd: " + " ".join(sys.argv) + "\n\n"
@@ -588,29 +1199,55 @@ def checkFileAndMakeAbsolute(file):
     return os.path.abspath(file)
 
 
-def systemCall(cmd):
+def systemCall(cmd, cwd=None):
     """Make a system call
 
     Args:
         cmd (string): Command to call
+        cwd (dirpath): Directory in which the command is executed. If None,
+                       the current directory is used.
     """
     sys.stderr.flush()
-    if subprocess.call(["bash", "-c", cmd]) != 0:
+    start = time.time()
+    process = subprocess.Popen(["bash", "-c", cmd], cwd=cwd)
+    waitForCommand(process, cmd, start)
+
+
+def waitForCommand(process, cmd, start):
+    """Wait for a command to finish and record its resource usage. Exit if
+    the command fails.
+
+    Args:
+        process (Popen): Process executing the command
+        cmd (string): The command
+        start (float): Time when the command was started
+    """
+    pid, status, usage = os.wait4(process.pid, 0)
+    process.returncode = 1
+    if os.WIFEXITED(status):
+        process.returncode = os.WEXITSTATUS(status)
+
+    if report:
+        report.recordCall(cmd, time.time() - start, usage)
+
+    if process.returncode != 0:
         sys.exit('[' + time.ctime() + '] error: ProtHint exited due to an ' +
                  'error in command: ' + cmd)
 
 
-def callScript(name, args):
+def callScript(name, args, cwd=None):
     """Call a script located in the ProtHint bin folder
 
     Args:
         name (string): Name of the script
         args (string): Command line arguments to use in the call
+        cwd (dirpath): Directory in which the script is executed. If None,
+                       the current directory is used.
     """
-    systemCall(binDir + '/' + name + ' ' + args)
+    systemCall(binDir + '/' + name + ' ' + args, cwd)
 
 
-def callDependency(name, args, location=''):
+def callDependency(name, args, location='', cwd=None):
     """Call a dependency. ProtHint first looks for the dependency in the
     dependencies folder. If not found there, it tries to find it in the path.
 
@@ -619,23 +1256,125 @@ def callDependency(name, args, location=''):
         args (string): Command line arguments to use in the call
         location (string): Location of the dependency within the dependencies
                            folder
+        cwd (dirpath): Directory in which the dependency is executed. If
+                       None, the current directory is used.
+    """
+    systemCall(findDependency(name, location) + ' ' + args, cwd)
+
+
+def findDependency(name, location=''):
+    """Find a dependency. ProtHint first looks for the dependency in the
+    dependencies folder. If not found there, it tries to find it in the path.
+
+    Args:
+        name (string): Name of the dependency
+        location (string): Location of the dependency within the dependencies
+                           folder
+
+    Returns:
+        string: Path to the dependency
     """
     if location != '':
         location = location + '/'
 
     if os.path.isfile(binDir + '/../dependencies/' + location + name):
-        systemCall(binDir + '/../dependencies/' + location + name + ' ' + args)
+        return binDir + '/../dependencies/' + location + name
     else:
         sys.stderr.write('[' + time.ctime() + '] warning: Could not find ' +
                          name + ' in dependencies/' + location + ' folder.' +
                          ' Attempting to use ' + name + ' in the PATH.\n')
         if shutil.which(name) is not None:
-            systemCall(name + ' ' + args)
+            return name
         else:
             sys.exit('[' + time.ctime() + '] error: Could not find ' + name +
                      ' in the PATH')
 
 
+class Scheduler:
+    """Run pipeline tasks concurrently. A task is started once all tasks it
+    depends on are finished and there are enough free threads in the
+    --threads budget. Tasks are started in the order in which they were
+    added. Tasks must not depend on the current working directory of
+    ProtHint while they run alongside other tasks.
+    """
+
+    def __init__(self, threads):
+        """Create a scheduler
+
+        Args:
+            threads (int): Number of threads available to the tasks
+        """
+        self.threads = threads
+        self.tasks = []
+        self.results = {}
+
+    def add(self, name, function, args=[], after=[], threads=1):
+        """Add a task
+
+        Args:
+            name (string): Name of the task
+            function (function): Function executing the task
+            args (list): Arguments passed to the function
+            after (list): Names of tasks which must finish first
+            threads (int): Number of threads used by the task
+        """
+        self.tasks.append({"name": name, "function": function, "args": args,
+                           "after": after,
+                           "threads": min(threads, self.threads)})
+
+    def run(self):
+        """Run all tasks. Results of the tasks are stored in the results
+        dictionary indexed by task names. If a task fails, no other tasks
+        are started, the running tasks are allowed to finish and the error
+        of the failed task is raised.
+        """
+        finished = queue.Queue()
+        # Commands executed by the tasks belong to the stage which runs the
+        # scheduler, unless the tasks are stages themselves
+        stage = report.currentStage() if report else None
+        pending = list(self.tasks)
+        running = {}
+        freeThreads = self.threads
+        error = None
+
+        while pending or running:
+            for task in list(pending):
+                if error is None and task["threads"] <= freeThreads and \
+                   all(name in self.results for name in task["after"]):
+                    pending.remove(task)
+                    running[task["name"]] = task
+                    freeThreads -= task["threads"]
+                    threading.Thread(target=self.__execute,
+                                     args=(task, finished, stage),
+                                     daemon=True).start()
+
+            if not running:
+                if error is None:
+                    sys.exit("error: Unable to schedule ProtHint stages: " +
+                             ", ".join(task["name"] for task in pending))
+                break
+
+            name, result, taskError = finished.get()
+            freeThreads += running.pop(name)["threads"]
+            if taskError is not None:
+                if error is None:
+                    error = taskError
+            else:
+                self.results[name] = result
+
+        if error is not None:
+            raise error
+
+    def __execute(self, task, finished, stage):
+        if report:
+            report.joinStage(stage)
+        try:
+            result = task["function"](*task["args"])
+            finished.put((task["name"], result, None))
+        except BaseException as error:
+            finished.put((task["name"], None, error))
+
+
 def parseCmd():
     """Parse command line arguments
 
@@ -675,6 +1414,40 @@ def parseCmd():
         skipped. The seed genes in this file must correspond to seed genes\
         passed by "--geneSeeds" option. All pairs in the file are used -- \
         option"--maxProteinsPerSeed" is ignored.')
+    parser.add_argument('--diamondDb', type=str, default='',
+                        help='Prebuilt DIAMOND database of the input\
+        proteins, for example diamond/diamond_db.dmnd from a previous\
+        ProtHint run with the same protein file. If this file is provided,\
+        the database is not built.')
+    parser.add_argument('--diamondCache', type=str, default='',
+                        help='Folder for cached DIAMOND databases. The\
+        cached databases are keyed by a hash of the pre-processed input\
+        proteins and reused in all runs with the same protein set. If not\
+        specified, the database is built in every run.')
+    parser.add_argument('--diamondChunks', type=int, default=1,
+                        help='Split seed proteins into this many chunks and\
+        search them with DIAMOND one after another. Pairs found in each chunk\
+        are aligned with Spaln while DIAMOND searches the next chunk, which\
+        hides most of the DIAMOND runtime behind the alignments. Hits of\
+        proteins with tied scores at the --maxProteinsPerSeed cutoff may\
+        differ from a single search. Default = 1 (no chunking).')
+    parser.add_argument('--costModel', type=str, default='',
+                        help='File with a model of Spaln alignment costs.\
+        CPU time and peak memory of every alignment are measured and added to\
+        the model, so the model improves with every run which uses the same\
+        file. A fitted model is used to order the alignments by their\
+        predicted CPU time.')
+    parser.add_argument('--maxPairMemory', type=int, default=0,
+                        help='Maximum memory of a single Spaln alignment in\
+        MB. If set and the cost model is fitted, the faster -Q3 Spaln mode is\
+        used unless the model predicts that the alignment would exceed this\
+        limit, in which case the memory efficient -Q7 mode is used. The\
+        --longGene and --longProtein thresholds are not used in this case.')
+    parser.add_argument('--dryRun', action='store_true',
+                        help='Run ProtHint until the seed gene-protein pairs\
+        are prepared, then print the expected CPU time and peak memory of\
+        their alignment, predicted by the cost model (--costModel), and\
+        exit.')
     parser.add_argument('--maxProteinsPerSeed', type=int, default=25,
                         help='Maximum number of protein hits per seed gene.\
         Increasing this number leads to increased runtime and may improve the\
@@ -694,6 +1467,16 @@ def parseCmd():
         Cleanup is turned off by default as it is useful to keep these files\
         for troubleshooting and the intermediate results might be useful on\
         their own.')
+    parser.add_argument('--resume', default=False, action='store_true',
+                        help='Resume a previous run in the same --workdir.\
+        Stages recorded in the ' + MANIFEST + ' file of the --workdir are skipped\
+        if their inputs, parameters and outputs did not change. Without\
+        this option, all stages are executed and the manifest is reset.')
+    parser.add_argument('--lowMemory', default=False, action='store_true',
+                        help='Process the raw Spaln hints of each contig\
+        separately after sorting them with the external sort command. Only\
+        the hints of one contig are kept in memory during the final\
+        processing. The outputs are identical.')
     parser.add_argument('--pbs', default=False, action='store_true',
                         help='Run GeneMark-ES and Spaln on pbs.')
     parser.add_argument('--threads', type=int, default=-1,
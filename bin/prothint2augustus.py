@@ -4,39 +4,90 @@
 # Copyright 2020, Georgia Institute of Technology, USA
 #
 # Convert ProtHint output to BRAKER/AUGUSTUS compatible format
+#
+# Hints from prothint.gff are classified by a logistic regression model of
+# their multiplicity, normalized by the median multiplicity, and alignment
+# score (originally implemented by Katharina J. Hoff in log_reg_prothints.pl).
+# High-confidence hints and top chains are appended to the classified hints.
 # ==============================================================
 
 
 import argparse
-import csv
-import prothint
-from prothint import callDependency, systemCall
-import os
+import statistics
 
-def main():
-    args = parseCmd()
-    prothint.binDir = os.path.abspath(os.path.dirname(__file__))
+from gffRecords import GffWriter, readGff
+
+
+# Logistic regression model of hint classes
+INTERCEPT = -4.00529
+MULT_COEFFICIENT = 4.73909
+AL_SCORE_COEFFICIENT = 9.09026
+CLASS_THRESHOLD = 0.85
+FEATURE_NAMES = [("Intron", "intron"), ("start_codon", "start"),
+                 ("stop_codon", "stop")]
+
+
+def classifyHints(rows):
+    """Classify hints from prothint.gff for AUGUSTUS
+
+    Args:
+        rows (list): Parsed rows of prothint.gff
+
+    Yields:
+        list: Classified hints with the class label in the score column
+    """
+    if not rows:
+        return
+    medianMult = statistics.median(float(row[5]) for row in rows)
 
-    callDependency("log_reg_prothints.pl", "--prothint " + args.prothint +
-                   " --out " + args.output + " > /dev/null")
+    for row in rows:
+        al_score = row.attribute("al_score")
+        if al_score is None:
+            al_score = ""
+        y = INTERCEPT + MULT_COEFFICIENT * (float(row[5]) / medianMult) + \
+            AL_SCORE_COEFFICIENT * (float(al_score) if al_score else 0)
+        classLabel = "2" if y >= CLASS_THRESHOLD else "0"
 
-    output = open(args.output, "a")
+        feature = row[2]
+        for name, augustusName in FEATURE_NAMES:
+            feature = feature.replace(name, augustusName, 1)
 
-    for row in csv.reader(open(args.evidence), delimiter='\t'):
-        if (row[2].lower() == "intron"):
-            row[2] = "intron"
-        elif (row[2].lower() == "start_codon"):
-            row[2] = "start"
-        elif (row[2].lower() == "stop_codon"):
-            row[2] = "stop"
-        row[8] = "src=M;mult=" + row[5] + ";pri=4"
-        output.write("\t".join(row) + "\n")
+        yield row[0:2] + [feature] + row[3:5] + [classLabel] + row[6:8] + \
+            ["src=P;mult=" + row[5] + ";pri=4;al_score=" + al_score + ";"]
 
-    with open(args.chains, 'r') as f:
-        for line in f:
-            output.write(line)
 
-    output.close()
+def convert(prothint, evidence, chains, output):
+    """Write hints for AUGUSTUS
+
+    Args:
+        prothint (filepath): ProtHint output file
+        evidence (filepath): ProtHint evidence file
+        chains (filepath): ProtHint protein chains file
+        output (filepath): Output file
+    """
+    with GffWriter(output) as out:
+        for row in classifyHints(list(readGff(prothint))):
+            out.write(row)
+
+        for row in readGff(evidence):
+            if (row[2].lower() == "intron"):
+                row[2] = "intron"
+            elif (row[2].lower() == "start_codon"):
+                row[2] = "start"
+            elif (row[2].lower() == "stop_codon"):
+                row[2] = "stop"
+            row[8] = "src=M;mult=" + row[5] + ";pri=4"
+            out.write(row)
+
+        with open(chains, 'r') as f:
+            for line in f:
+                out.writeLine(line.rstrip("\n"))
+
+
+def main():
+    args = parseCmd()
+    convert(args.prothint, args.evidence, args.chains, args.output)
+
 
 def parseCmd():
     parser = argparse.ArgumentParser(description='Convert ProtHint outputs to \
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# ==============================================================
+# Tomas Bruna
+# Copyright 2021, Georgia Institute of Technology, USA
+#
+# Report of time and memory used by ProtHint stages and by the external
+# commands executed in them. For each command, wall time, CPU time and peak
+# RSS of the child process (including its descendants) are recorded. For each
+# stage, the report also includes the CPU time spent in the ProtHint thread
+# which executed the stage. Stages may run concurrently in separate threads.
+# CPU time of worker processes started by ProtHint itself (multiprocessing
+# in processSpalnOutput with --threads) is not included, it cannot be
+# attributed to a stage while other stages run concurrently.
+# Peak RSS of a stage is the maximum over its commands, the peak RSS of the
+# ProtHint process is reported separately (it is the maximum since the start
+# of the run).
+#
+# Peak RSS of commands is a lower-bounded approximation. On Linux, a child
+# process starts with the peak RSS of ProtHint at the time it was started
+# (the memory is counted when the child is forked), so even small commands
+# report at least the memory of ProtHint. Each command therefore also
+# records the peak RSS of ProtHint when the command finished; a command
+# whose peak RSS does not exceed this value may have used less memory.
+# ==============================================================
+
+
+import json
+import os
+import resource
+import threading
+import time
+
+
+NOTES = ("peakRssKb of a command is lower-bounded by the peak RSS of "
+         "ProtHint when the command was started (Linux children inherit it). "
+         "A command whose peakRssKb does not exceed its prothintPeakRssKb "
+         "may have used less memory. cpuSeconds of a stage excludes worker "
+         "processes which ProtHint starts itself, such as the --threads "
+         "workers of processSpalnOutput.")
+
+
+class ResourceReport:
+
+    def __init__(self, path, version):
+        """Create a report saved to a json file
+
+        Args:
+            path (filepath): Output json file
+            version (string): ProtHint version
+        """
+        self.path = path
+        self.version = version
+        self.stages = []
+        # Commands executed outside of any stage
+        self.calls = []
+        # Stage executed by the current thread
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def startStage(self, name):
+        """Start recording a stage
+
+        Args:
+            name (string): Name of the stage
+        """
+        self.local.stage = {
+            "stage": name,
+            "start": time.ctime(),
+            "calls": [],
+            "_wall": time.time(),
+            "_thread": resource.getrusage(resource.RUSAGE_THREAD)
+        }
+
+    def endStage(self, skipped=False):
+        """Finish the current stage and save the report
+
+        Args:
+            skipped (bool): Whether the stage was skipped
+        """
+        stage = self.local.stage
+        self.local.stage = None
+
+        threadUsage = resource.getrusage(resource.RUSAGE_THREAD)
+        selfUsage = resource.getrusage(resource.RUSAGE_SELF)
+
+        childCpu = sum([call["cpuSeconds"] for call in stage["calls"]])
+        peakRss = max([call["peakRssKb"] for call in stage["calls"]] + [0])
+        with self.lock:
+            self.stages.append({
+                "stage": stage["stage"],
+                "start": stage["start"],
+                "skipped": skipped,
+                "wallSeconds": round(time.time() - stage["_wall"], 3),
+                "cpuSeconds": round(cpuTime(threadUsage) -
+                                    cpuTime(stage["_thread"]) + childCpu,
+                                    3),
+                "childCpuSeconds": round(childCpu, 3),
+                "peakRssKb": peakRss,
+                "selfPeakRssKb": selfUsage.ru_maxrss,
+                "calls": stage["calls"]
+            })
+            self.save()
+
+    def currentStage(self):
+        """Return the stage executed by the current thread"""
+        return getattr(self.local, "stage", None)
+
+    def joinStage(self, stage):
+        """Record commands executed by the current thread in a stage which
+        was started by another thread
+
+        Args:
+            stage: Stage returned by currentStage in the other thread
+        """
+        self.local.stage = stage
+
+    def recordCall(self, cmd, wallTime, usage):
+        """Record a finished command
+
+        Args:
+            cmd (string): The executed command
+            wallTime (float): Wall time of the command in seconds
+            usage: Resource usage of the child process returned by os.wait4
+        """
+        call = {
+            "cmd": cmd,
+            "wallSeconds": round(wallTime, 3),
+            "cpuSeconds": round(cpuTime(usage), 3),
+            "peakRssKb": usage.ru_maxrss,
+            "prothintPeakRssKb":
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        }
+        stage = self.currentStage()
+        if stage:
+            stage["calls"].append(call)
+        else:
+            with self.lock:
+                self.calls.append(call)
+                self.save()
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"version": self.version, "notes": NOTES,
+                       "stages": self.stages, "calls": self.calls}, f,
+                      indent=2)
+        os.replace(tmp, self.path)
+
+
+def cpuTime(usage):
+    return usage.ru_utime + usage.ru_stime
@@ -8,9 +8,9 @@
 # ==============================================================
 
 
-import csv
 import sys
-import re
+
+from gffRecords import readGff
 
 
 class Hint:
@@ -26,11 +26,6 @@ class Hint:
         return self.score > other.score
 
 
-def extractFeature(text, feature):
-    regex = feature + '=([^;]+)'
-    return re.search(regex, text).groups()[0]
-
-
 def getSignature(row):
     return row[0] + "_" + row[2] + "_" + row[3] + "_" + row[4] + "_" + row[6]
 
@@ -38,26 +33,26 @@ def getSignature(row):
 def getBest(input, k):
     pairs = set()
     features = {}
-    with open(input) as csv_file:
-        csv_reader = csv.reader(csv_file, delimiter='\t')
-
-        for row in csv_reader:
-            feature = None
-            if row[2].lower() == "intron":
-                feature = Hint(extractFeature(row[8], "prot"), extractFeature(row[8], "seed_gene_id"),
-                               extractFeature(row[8], "al_score"))
-            elif row[2].lower() == "start_codon" or row[2].lower() == "stop_codon":
-                feature = Hint(extractFeature(row[8], "prot"), extractFeature(row[8], "seed_gene_id"),
-                               extractFeature(row[8], "score"))
-            else:
-                continue
-
-            signature = getSignature(row)
-
-            if not signature in features:
-                features[signature] = [feature]
-            else:
-                features[signature].append(feature)
+    for row in readGff(input):
+        attributes = row.attributes
+        feature = None
+        if row[2].lower() == "intron":
+            feature = Hint(attributes["prot"], attributes["seed_gene_id"],
+                           attributes["al_score"])
+        elif row[2].lower() == "start_codon" or row[2].lower() == "stop_codon":
+            # Starts and stops scored by spaln-boundary-scorer only have the
+            # al_score
+            feature = Hint(attributes["prot"], attributes["seed_gene_id"],
+                           attributes.get("score", attributes.get("al_score")))
+        else:
+            continue
+
+        signature = getSignature(row)
+
+        if not signature in features:
+            features[signature] = [feature]
+        else:
+            features[signature].append(feature)
 
     # Print up to best k supporting proteins for each feature
     for key, featureSet in features.items():
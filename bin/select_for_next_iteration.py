@@ -11,26 +11,11 @@
 
 
 import argparse
-import csv
-import re
 import tempfile
 import subprocess
 import os
 
-
-def extractFeatureGtf(text, feature):
-    regex = feature + ' "([^"]+)"'
-    return re.search(regex, text).groups()[0]
-
-
-def extractFeatureGff(text, feature):
-    regex = feature + '=([^;]+);'
-    return re.search(regex, text).groups()[0]
-
-
-def readGff(gffFile):
-    for row in csv.reader(open(gffFile), delimiter='\t'):
-        pass
+from gffRecords import GffWriter, readGff
 
 
 class Gene:
@@ -48,16 +33,16 @@ class Gene:
 
     def print(self, out):
         for cds in self.CDSs:
-            out.write("\t".join(cds) + "\n")
+            out.write(cds)
 
 
 def loadGenes(gtf):
     sortedGtf = sortGenes(gtf)
     genes = {}
-    for row in csv.reader(open(sortedGtf), delimiter='\t'):
+    for row in readGff(sortedGtf):
         if row[2] != "CDS":
             continue
-        geneId = extractFeatureGtf(row[8], "gene_id")
+        geneId = row.attribute("gene_id")
         if geneId not in genes:
             genes[geneId] = Gene(row, geneId)
         else:
@@ -84,7 +69,7 @@ def findUniqueNewGenes(newGenes, oldGenes, outFile):
     # Mapping of old to new gene ids for seed genes which are identical
     old2new = {}
 
-    out = open(outFile, 'w')
+    out = GffWriter(outFile)
     for gene in newGenes:
         newSignature = newGenes[gene].signature
         if newSignature not in oldGeneSignatures:
@@ -97,14 +82,14 @@ def findUniqueNewGenes(newGenes, oldGenes, outFile):
 
 
 def printHintsWithIdenticalSeeds(prevSpalnGff, old2new, outFile):
-    out = open(outFile, 'w')
-    for row in csv.reader(open(prevSpalnGff), delimiter='\t'):
-        seedGeneId = extractFeatureGff(row[8], "seed_gene_id")
+    out = GffWriter(outFile)
+    for row in readGff(prevSpalnGff):
+        seedGeneId = row.attribute("seed_gene_id")
         if seedGeneId in old2new:
             oldString = "seed_gene_id=" + seedGeneId + ";"
             newString = "seed_gene_id=" + old2new[seedGeneId] + ";"
             row[8] = row[8].replace(oldString, newString)
-            out.write("\t".join(row) + "\n")
+            out.write(row)
     out.close()
 
 
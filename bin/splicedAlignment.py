@@ -0,0 +1,691 @@
+#!/usr/bin/env python3
+# ==============================================================
+# Tomas Bruna
+# Copyright 2021, Georgia Institute of Technology, USA
+#
+# Align seed gene-protein pairs with Spaln and score the alignments with
+# spaln-boundary-scorer. Each worker keeps a single pair of sequence files
+# in a tmpfs folder (Spaln needs seekable inputs, so the sequences cannot be
+# piped to it) and overwrites them for every pair. Spaln output is piped to
+# the scorer and the scored hints are collected through a pipe, translated
+# from the region level to the contig level and written by a single
+# buffered writer. This replaces run_spliced_alignment.pl, spalnBatch.sh and
+# gff_from_region_to_contig.pl in local runs. The writer can also flag hints
+# from the best DIAMOND hit of each seed gene (flag_top_proteins.py), which
+# saves a rewrite of the whole output.
+#
+# Pairs are aligned longest-processing-time-first, the cost of a pair is
+# estimated as the product of the gene and protein lengths. Pairs are
+# dispatched in batches which shrink toward the end of the run (guided
+# self-scheduling), so that the last expensive pairs do not leave most of
+# the workers idle.
+#
+# CPU time and peak memory of each Spaln run can be measured and added to a
+# persistent cost model (alignmentCost.py). A fitted model is used to
+# order the pairs, to choose the Spaln mode of each pair under a memory
+# limit and to estimate the cost of a run without aligning anything. Spaln
+# and the scorer are started by a small command server of each worker
+# (commandServer.py); started directly, Spaln would report at least the
+# peak memory of this process, which holds all sequences. Failed Spaln runs
+# are not measured.
+# ==============================================================
+
+
+import argparse
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from alignmentCost import CostModel, MODES
+from commandServer import CommandServer
+from flag_top_proteins import checkPairIds, topPairs
+
+
+DEFLINE = re.compile(r"^>(\S+)\s+\S+\s+(\d+)\s+(\d+)\s+([-+])\s+(\S+)")
+WRITE_BUFFER = 16 * 1024 * 1024
+MAX_BATCH_SIZE = 100
+
+
+class Aligner:
+
+    def __init__(self, nuc, prot, tmpDir, minExonScore, nonCanonical,
+                 longGene, longProtein, model=None, maxPairMemory=None):
+        """Create an aligner of seed gene-protein pairs
+
+        Args:
+            nuc (dict): Nucleotide sequences of seed genes indexed by IDs
+            prot (dict): Protein sequences indexed by IDs
+            tmpDir (dirpath): Folder for the sequence files of workers
+            minExonScore (float): Discard all hints inside/neighboring exons
+                                  with score lower than minExonScore
+            nonCanonical (bool): Whether to predict non-canonical introns
+            longGene (int): Threshold for what is considered a long gene in
+                            Spaln alignment
+            longProtein (int): Threshold for what is considered a long
+                               protein in Spaln alignment
+            model (CostModel): Alignment cost model
+            maxPairMemory (int): Maximum memory of a single alignment in kB.
+                                 If set and the model is fitted, the -Q7
+                                 mode is used for pairs which are predicted
+                                 to exceed this limit in the -Q3 mode,
+                                 instead of the long gene and protein
+                                 thresholds.
+        """
+        self.nuc = nuc
+        self.prot = prot
+        self.tmpDir = tmpDir
+        self.minExonScore = str(minExonScore)
+        self.nonCanonical = nonCanonical
+        self.longGene = longGene
+        self.longProtein = longProtein
+        self.model = model
+        self.maxPairMemory = maxPairMemory
+        # Measured alignments: seed gene ID, protein ID, mode, gene length,
+        # protein length, CPU seconds and peak memory
+        self.measurements = []
+        self.local = threading.local()
+        # Command servers of all workers
+        self.servers = []
+        self.serversLock = threading.Lock()
+
+        dependencies = os.path.dirname(os.path.abspath(__file__)) + \
+            "/../dependencies/"
+        self.spaln = dependencies + "spaln"
+        self.scorer = dependencies + "spaln_boundary_scorer"
+        self.matrix = dependencies + "blosum62.csv"
+        self.env = dict(os.environ, ALN_TAB=dependencies + "spaln_table")
+
+    def workerFiles(self):
+        """Get the sequence files of the current worker"""
+        if not hasattr(self.local, "files"):
+            name = self.tmpDir + "/" + str(threading.get_ident())
+            self.local.files = (name + ".nuc", name + ".prot")
+        return self.local.files
+
+    def workerServer(self):
+        """Get the command server of the current worker"""
+        if not hasattr(self.local, "server"):
+            self.local.server = CommandServer(self.env)
+            with self.serversLock:
+                self.servers.append(self.local.server)
+        return self.local.server
+
+    def close(self):
+        """Stop the command servers of all workers"""
+        with self.serversLock:
+            for server in self.servers:
+                server.close()
+            self.servers = []
+
+    def align(self, pair):
+        """Align a single pair
+
+        Args:
+            pair (tuple): Seed gene ID and protein ID
+
+        Returns:
+            bytes: Hints scored by spaln-boundary-scorer, with coordinates
+                   on the seed gene region
+        """
+        nucId, protId = pair
+        nucFile, protFile = self.workerFiles()
+        nucRecord = ">" + nucId + "\n" + self.nuc[nucId] + "\n"
+        protRecord = ">" + protId + "\n" + self.prot[protId] + "\n"
+        with open(nucFile, "w") as f:
+            f.write(nucRecord)
+        with open(protFile, "w") as f:
+            f.write(protRecord)
+
+        # Estimate the maximum possible length of the alignment, including
+        # gaps. The lengths are the sizes of the sequence files.
+        alignmentLength = 2 * (len(nucRecord) + len(protRecord))
+
+        # -Q3/-Q7  See the mode function
+        # -pw  Report result even if alignment score is below threshold
+        # -S1  Dna is in the forward orientation
+        # -LS  Smith-Waterman-type local alignment
+        # -O1  Output alignment
+        # -l   Number of characters per line in alignment
+        mode = self.mode(pair)
+        cmd = [self.spaln, mode]
+        if self.nonCanonical:
+            cmd.append("-ya3")
+        cmd += ["-LS", "-pw", "-S1", "-O1", "-l", str(alignmentLength),
+                nucFile, protFile]
+
+        scorer = [self.scorer, "-o", "/dev/stdout", "-w", "10", "-s",
+                  self.matrix, "-e", self.minExonScore, "-x",
+                  self.minExonScore]
+        hints, usage = self.workerServer().run([cmd, scorer], [True, False])
+        spalnStatus, cpuSeconds, peakRssKb = usage[0]
+        if spalnStatus == 0:
+            self.measurements.append((nucId, protId, mode,
+                                      len(self.nuc[nucId]),
+                                      len(self.prot[protId]), cpuSeconds,
+                                      peakRssKb))
+        else:
+            sys.stderr.write("[" + time.ctime() + "] warning: Spaln " +
+                             "alignment of " + nucId + " and " + protId +
+                             " failed with exit status " + str(spalnStatus) +
+                             ", the alignment is not measured\n")
+
+        if usage[1][0] != 0:
+            sys.stderr.write("[" + time.ctime() + "] warning: Scoring of " +
+                             "the alignment of " + nucId + " and " + protId +
+                             " failed\n")
+        return hints
+
+    def alignBatch(self, batch):
+        """Align a batch of pairs
+
+        Args:
+            batch (list): Pairs of seed gene and protein IDs
+
+        Returns:
+            list: Scored hints of the individual pairs
+        """
+        return [self.align(pair) for pair in batch]
+
+    def mode(self, pair):
+        """Choose the Spaln mode of a pair. The fast heuristic mode (-Q3) is
+        used by default. The mapping mode (-Q7) usually consumes less memory
+        and it is used for long alignments: either when the sequences are
+        longer than the long gene or protein thresholds, or, if the memory
+        limit is set and the cost model is fitted, when the -Q3 alignment is
+        predicted to exceed the memory limit.
+
+        Args:
+            pair (tuple): Seed gene ID and protein ID
+
+        Returns:
+            string: Spaln mode
+        """
+        geneLength = len(self.nuc[pair[0]])
+        proteinLength = len(self.prot[pair[1]])
+        if self.maxPairMemory and self.model and self.model.isFitted("-Q3"):
+            memory = self.model.predict("-Q3", geneLength, proteinLength)[1]
+            return "-Q7" if memory > self.maxPairMemory else "-Q3"
+
+        # Thresholds apply to the sizes of the sequence files
+        if geneLength + len(pair[0]) + 3 > self.longGene or \
+           proteinLength + len(pair[1]) + 3 > self.longProtein:
+            return "-Q7"
+        return "-Q3"
+
+    def predict(self, pair):
+        """Predict CPU time and peak memory of a pair
+
+        Returns:
+            tuple: Predicted CPU seconds and peak memory in kB, None if the
+                   mode of the pair is not fitted in the cost model
+        """
+        if not self.model:
+            return None
+        return self.model.predict(self.mode(pair), len(self.nuc[pair[0]]),
+                                  len(self.prot[pair[1]]))
+
+    def cost(self, pair):
+        """Estimate the cost of aligning a pair
+
+        Args:
+            pair (tuple): Seed gene ID and protein ID
+
+        Returns:
+            float: Product of the gene and protein lengths
+        """
+        return len(self.nuc[pair[0]]) * len(self.prot[pair[1]])
+
+    def updateModel(self):
+        """Add all measured alignments to the cost model and save it"""
+        for measurement in self.measurements:
+            self.model.add(*measurement[2:])
+        self.model.fit()
+        self.model.save()
+
+
+def orderByCost(pairs, costs):
+    """Sort pairs from the most to the least expensive. The sort is stable,
+    pairs with equal costs keep their order.
+
+    Args:
+        pairs (list): Pairs of seed gene and protein IDs
+        costs (list): Estimated costs of the pairs
+
+    Returns:
+        tuple: Sorted pairs and their costs
+    """
+    order = sorted(range(len(pairs)), key=lambda i: costs[i], reverse=True)
+    return [pairs[i] for i in order], [costs[i] for i in order]
+
+
+def makeBatches(pairs, costs, cores):
+    """Split pairs into batches for the workers. The cost of each batch is
+    a fraction of the remaining cost, so expensive pairs are dispatched
+    alone, cheap pairs are grouped and batches shrink toward the end of the
+    run so that all workers finish at a similar time.
+
+    Args:
+        pairs (list): Pairs sorted from the most to the least expensive
+        costs (list): Estimated costs of the pairs
+        cores (int): Number of workers
+
+    Returns:
+        list: Batches of pairs
+    """
+    batches = []
+    remaining = sum(costs)
+    start = 0
+    while start < len(pairs):
+        target = remaining / (2 * cores)
+        end = start + 1
+        batchCost = costs[start]
+        while end < len(pairs) and end - start < MAX_BATCH_SIZE and \
+                batchCost + costs[end] <= target:
+            batchCost += costs[end]
+            end += 1
+        batches.append(pairs[start:end])
+        remaining -= batchCost
+        start = end
+    return batches
+
+
+def readList(listFile):
+    """Read the list of seed gene-protein pairs
+
+    Args:
+        listFile (filepath): File with seed gene IDs in the first column and
+                             protein IDs in the second column
+
+    Returns:
+        list: Pairs of seed gene and protein IDs
+    """
+    pairs = []
+    for line in open(listFile):
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        fields = line.split()
+        if len(fields) < 2:
+            sys.exit("error, unexpected file format found in " + listFile +
+                     ": " + line)
+        pairs.append((fields[0], fields[1]))
+    return pairs
+
+
+def readSequences(fasta, ids):
+    """Read selected sequences from a fasta file. Sequences are converted
+    to upper case and all non-alphabetic characters are removed.
+
+    Args:
+        fasta (filepath): Fasta file
+        ids (set): IDs of sequences to read
+
+    Returns:
+        dict: Sequences indexed by IDs
+    """
+    sequences = {}
+    seqId = None
+    nonAlphabet = re.compile(r"[^A-Z]")
+    for line in open(fasta):
+        if line.startswith(">"):
+            fields = line[1:].split()
+            seqId = fields[0] if fields and fields[0] in ids else None
+            if seqId is not None and seqId not in sequences:
+                sequences[seqId] = []
+        elif seqId is not None:
+            sequences[seqId].append(nonAlphabet.sub("", line.upper()))
+
+    return {seqId: "".join(parts) for seqId, parts in sequences.items()}
+
+
+def readRegions(nucFasta):
+    """Read positions of seed gene regions on contigs from fasta deflines
+
+    Args:
+        nucFasta (filepath): Nucleotide sequences of seed gene regions
+
+    Returns:
+        dict: Left and right region borders, strand and contig ID indexed by
+              seed gene IDs
+    """
+    regions = {}
+    for line in open(nucFasta):
+        match = DEFLINE.match(line)
+        if match:
+            regions[match.group(1)] = (int(match.group(2)),
+                                       int(match.group(3)), match.group(4),
+                                       match.group(5))
+    return regions
+
+
+def regionToContig(hints, regions, topProtein=False):
+    """Translate coordinates of hints from the seed gene region level to the
+    contig level
+
+    Args:
+        hints (bytes): Hints scored by spaln-boundary-scorer
+        regions (dict): Seed gene regions returned by readRegions
+        topProtein (bool): Whether to flag the hints with topProt=TRUE
+
+    Returns:
+        list: Lines with translated hints
+    """
+    lines = []
+    flag = " topProt=TRUE;" if topProtein else ""
+    for line in hints.decode().splitlines():
+        row = line.split("\t", 8)
+        if len(row) != 9 or row[6] not in ("+", "-") or \
+           not row[3].isdigit() or not row[4].isdigit():
+            continue
+
+        if row[0] not in regions:
+            sys.exit("error, ID of gene not found in regions file: " + row[0])
+        left, right, strand, contig = regions[row[0]]
+
+        if strand == "+":
+            start = int(row[3]) + left - 1
+            end = int(row[4]) + left - 1
+        else:
+            start = right - int(row[4]) + 1
+            end = right - int(row[3]) + 1
+
+        lines.append("\t".join([contig, row[1], row[2], str(start), str(end),
+                                row[5], strand, row[7], row[8]]) +
+                     " seed_gene_id=" + row[0] + ";" + flag + "\n")
+    return lines
+
+
+def tmpfsDir():
+    """Get a folder for temporary sequence files. A tmpfs folder is
+    preferred, the current folder is used if tmpfs is not available.
+    """
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm"
+    return "."
+
+
+def loadPairs(nucFasta, protFasta, pairs):
+    """Load sequences of pairs
+
+    Args:
+        nucFasta (filepath): Nucleotide sequences of seed gene regions
+        protFasta (filepath): Protein sequences
+        pairs (list): Seed gene-protein pairs returned by readList
+
+    Returns:
+        tuple: Pairs with both sequences available, nucleotide sequences
+               and protein sequences
+    """
+    nuc = readSequences(nucFasta, {pair[0] for pair in pairs})
+    prot = readSequences(protFasta, {pair[1] for pair in pairs})
+
+    # Pairs with missing sequences are skipped
+    pairs = [pair for pair in pairs if pair[0] in nuc and pair[1] in prot]
+    return pairs, nuc, prot
+
+
+def estimate(nucFasta, protFasta, listFile, modelFile, cores=1,
+             longGene=30000, longProtein=15000, maxPairMemory=None):
+    """Estimate CPU time and peak memory of the alignment of all pairs with
+    a fitted cost model, without aligning anything
+
+    Args:
+        nucFasta (filepath): Nucleotide sequences of seed gene regions
+        protFasta (filepath): Protein sequences
+        listFile (filepath): Seed gene-protein pairs
+        modelFile (filepath): Cost model
+        cores (int): Number of parallel alignments
+        longGene (int): Threshold for what is considered a long gene in
+                        Spaln alignment
+        longProtein (int): Threshold for what is considered a long protein
+                           in Spaln alignment
+        maxPairMemory (int): Maximum memory of a single alignment in kB
+
+    Returns:
+        dict: Number of pairs in each mode, number of pairs in each mode
+              which is not fitted in the model and is predicted with the
+              -Q3 fit instead, number of pairs which cannot be predicted,
+              total CPU hours, peak memory of a single alignment and peak
+              memory of the parallel alignments (in kB)
+    """
+    model = CostModel(modelFile)
+    if not any(model.isFitted(mode) for mode in MODES):
+        sys.exit("error: The cost model " + modelFile + " does not have " +
+                 "enough measurements of Spaln alignments yet.")
+
+    pairs, nuc, prot = loadPairs(nucFasta, protFasta, readList(listFile))
+    aligner = Aligner(nuc, prot, None, 25, False, longGene, longProtein,
+                      model, maxPairMemory)
+
+    modes = {}
+    fallback = {}
+    unpredicted = 0
+    cpuSeconds = 0
+    memory = []
+    for pair in pairs:
+        mode = aligner.mode(pair)
+        modes[mode] = modes.get(mode, 0) + 1
+        prediction = aligner.predict(pair)
+        if prediction is None:
+            # Unfitted modes are predicted with the cheaper -Q3 fit, the
+            # estimate is a lower bound for them
+            prediction = model.predict("-Q3", len(nuc[pair[0]]),
+                                       len(prot[pair[1]]))
+            if prediction is None:
+                unpredicted += 1
+                continue
+            fallback[mode] = fallback.get(mode, 0) + 1
+        cpuSeconds += prediction[0]
+        memory.append(prediction[1])
+
+    memory.sort(reverse=True)
+    return {"pairs": modes, "fallbackPairs": fallback,
+            "unpredictedPairs": unpredicted, "cpuHours": cpuSeconds / 3600,
+            "pairPeakRssKb": int(memory[0]) if memory else 0,
+            "peakRssKb": int(sum(memory[:cores]))}
+
+
+def alignPairs(nucFasta, protFasta, listFile, output, cores=1,
+               minExonScore=25, nonCanonical=False, longGene=30000,
+               longProtein=15000, verbose=False, modelFile=None,
+               maxPairMemory=None, costsOut=None, flagTop=False):
+    """Align all seed gene-protein pairs and save the scored hints. IDs of
+    the pairs are checked before the alignment.
+
+    Args:
+        nucFasta (filepath): Nucleotide sequences of seed gene regions
+        protFasta (filepath): Protein sequences
+        listFile (filepath): Seed gene-protein pairs
+        output (filepath): Output file with scored hints
+        cores (int): Number of parallel alignments
+        minExonScore (float): Discard all hints inside/neighboring exons with
+                              score lower than minExonScore
+        nonCanonical (bool): Whether to predict non-canonical introns
+        longGene (int): Threshold for what is considered a long gene in
+                        Spaln alignment
+        longProtein (int): Threshold for what is considered a long protein
+                           in Spaln alignment
+        verbose (bool): Whether to report progress
+        modelFile (filepath): Cost model which is used to order the pairs
+                              and choose their modes and which is updated
+                              with the measured alignments
+        maxPairMemory (int): Maximum memory of a single alignment in kB
+        costsOut (filepath): Output file for the measured CPU time and peak
+                             memory of each alignment
+        flagTop (bool): Whether to flag hints from the first pair of each
+                        seed gene in the list (the best DIAMOND hit) with
+                        topProt=TRUE
+    """
+    listPairs = readList(listFile)
+    checkPairIds(listPairs)
+    top = topPairs(listPairs) if flagTop else set()
+    pairs, nuc, prot = loadPairs(nucFasta, protFasta, listPairs)
+    regions = readRegions(nucFasta)
+    if verbose:
+        sys.stderr.write("[" + time.ctime() + "] Pairs loaded. Number of " +
+                         "pairs to align: " + str(len(pairs)) + "\n")
+
+    tmpDir = tempfile.mkdtemp(prefix="prothint_spaln_", dir=tmpfsDir())
+    model = CostModel(modelFile) if modelFile else None
+    aligner = Aligner(nuc, prot, tmpDir, minExonScore, nonCanonical,
+                      longGene, longProtein, model, maxPairMemory)
+
+    # Longest processing time first. Predicted CPU times are only used if
+    # all pairs can be predicted.
+    costs = [aligner.predict(pair) for pair in pairs]
+    if None in costs:
+        costs = [aligner.cost(pair) for pair in pairs]
+    else:
+        costs = [cost[0] for cost in costs]
+    pairs, costs = orderByCost(pairs, costs)
+    batches = makeBatches(pairs, costs, cores)
+
+    startTime = time.time()
+    aligned = 0
+    nextReport = 1
+    try:
+        with ThreadPool(cores) as pool, \
+                open(output, "w", buffering=WRITE_BUFFER) as out:
+            for batch, batchHints in zip(batches, pool.imap(
+                    aligner.alignBatch, batches)):
+                for pair, hints in zip(batch, batchHints):
+                    out.writelines(regionToContig(hints, regions,
+                                                  pair in top))
+                aligned += len(batchHints)
+                if verbose and aligned * 100 >= nextReport * len(pairs):
+                    reportProgress(aligned, len(pairs), startTime)
+                    nextReport = aligned * 100 // len(pairs) + 1
+    except RuntimeError as error:
+        # Errors of worker threads are re-raised by imap in the main thread
+        sys.exit("error: " + str(error))
+    finally:
+        aligner.close()
+        shutil.rmtree(tmpDir, ignore_errors=True)
+
+    if model:
+        aligner.updateModel()
+    if costsOut:
+        with open(costsOut, "w") as out:
+            out.write("seedGene\tprotein\tmode\tgeneLength\tproteinLength\t"
+                      "cpuSeconds\tpeakRssKb\n")
+            for measurement in aligner.measurements:
+                out.write("\t".join(str(value) for value in measurement) +
+                          "\n")
+
+    if verbose:
+        sys.stderr.write("[" + time.ctime() + "] Alignment of pairs " +
+                         "finished\n")
+
+
+def reportProgress(aligned, total, startTime):
+    """Print the number of aligned pairs and the estimated remaining time"""
+    elapsed = time.time() - startTime
+    left = int(elapsed / aligned * (total - aligned))
+    sys.stderr.write("[%s] %d/%d (%.0f%%) pairs aligned. Est. time left: "
+                     "%02d:%02d:%02d (hh:mm:ss)\n" %
+                     (time.ctime(), aligned, total, aligned * 100 / total,
+                      left // 3600, left // 60 % 60, left % 60))
+
+
+def main():
+    args = parseCmd()
+    maxPairMemory = None
+    if args.maxPairMemory:
+        maxPairMemory = args.maxPairMemory * 1024
+
+    if args.dryRun:
+        if not args.costModel:
+            sys.exit("error: --costModel must be specified with --dryRun")
+        result = estimate(args.nuc, args.prot, args.list, args.costModel,
+                          args.cores, args.longGene, args.longProtein,
+                          maxPairMemory)
+        print("Pairs to align: " + ", ".join(
+            str(count) + " in " + mode + " mode"
+            for mode, count in sorted(result["pairs"].items())))
+        for mode, count in sorted(result["fallbackPairs"].items()):
+            print("Warning: The cost model is not fitted for the " + mode +
+                  " mode yet, " + str(count) + " pairs in this mode are " +
+                  "estimated with the -Q3 fit and their cost is likely " +
+                  "underestimated")
+        if result["unpredictedPairs"]:
+            print("Warning: The cost of " + str(result["unpredictedPairs"]) +
+                  " pairs cannot be estimated yet, they are not included " +
+                  "in the estimate")
+        print("Expected alignment CPU time: %.2f CPU hours" %
+              result["cpuHours"])
+        print("Expected peak memory of a single alignment: %.0f MB" %
+              (result["pairPeakRssKb"] / 1024))
+        print("Expected peak memory of %d parallel alignments: %.0f MB" %
+              (args.cores, result["peakRssKb"] / 1024))
+        return
+
+    alignPairs(args.nuc, args.prot, args.list, args.out, args.cores,
+               args.minExonScore, args.nonCanonical, args.longGene,
+               args.longProtein, args.verbose, args.costModel,
+               maxPairMemory, args.costs, args.topProteins)
+
+
+def parseCmd():
+
+    parser = argparse.ArgumentParser(description='Align seed gene-protein \
+        pairs with Spaln and score the alignments with \
+        spaln-boundary-scorer. The scored hints are translated to contig \
+        coordinates.')
+
+    parser.add_argument('--nuc', type=str, required=True,
+                        help='Nucleotide sequences of seed gene regions, \
+                        created by nucseq_for_selected_genes.pl.')
+    parser.add_argument('--prot', type=str, required=True,
+                        help='Protein sequences.')
+    parser.add_argument('--list', type=str, required=True,
+                        help='Seed gene-protein pairs to align.')
+    parser.add_argument('--out', type=str, default='spaln.gff',
+                        help='Output file. Default = spaln.gff')
+    parser.add_argument('--cores', type=int, default=1,
+                        help='Number of parallel alignments. Default = 1')
+    parser.add_argument('--minExonScore', type=float, default=25,
+                        help='Discard all hints inside/neighboring exons \
+                        with score lower than minExonScore. Default = 25')
+    parser.add_argument('--nonCanonical', action='store_true',
+                        help='Allow non-canonical introns.')
+    parser.add_argument('--longGene', type=int, default=30000,
+                        help='Threshold for what is considered a long gene \
+                        in Spaln alignment. Default = 30000')
+    parser.add_argument('--longProtein', type=int, default=15000,
+                        help='Threshold for what is considered a long \
+                        protein in Spaln alignment. Default = 15000')
+    parser.add_argument('--costModel', type=str,
+                        help='Alignment cost model file. The model is \
+                        updated with the CPU time and peak memory of \
+                        alignments in this run. Once fitted, it is used to \
+                        order the pairs by their predicted CPU time.')
+    parser.add_argument('--maxPairMemory', type=int,
+                        help='Maximum memory of a single alignment in MB. \
+                        If set and the cost model is fitted, the -Q7 mode \
+                        is used for pairs which are predicted to exceed the \
+                        limit in the -Q3 mode, instead of the --longGene \
+                        and --longProtein thresholds.')
+    parser.add_argument('--costs', type=str,
+                        help='Output file for the measured CPU time and peak \
+                        memory of each alignment.')
+    parser.add_argument('--topProteins', action='store_true',
+                        help='Flag hints from the first pair of each seed \
+                        gene in the --list file with topProt=TRUE. The \
+                        list should be DIAMOND output, sorted by seed genes \
+                        and by the protein score (from best to worst).')
+    parser.add_argument('--dryRun', action='store_true',
+                        help='Do not align anything, only print the expected \
+                        CPU time and peak memory of the alignments, \
+                        predicted by the cost model.')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Report progress.')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
@@ -90,10 +90,10 @@ class Seed():
         return self.score < other.score
 
 
-def loadSeeds(clusterFile):
+def loadSeeds(rows):
     seeds = {}
     CDSBorders = []
-    for row in csv.reader(open(clusterFile), delimiter='\t'):
+    for row in rows:
         seedID = row[8]
         if seedID not in seeds:
             seeds[seedID] = Seed(row[0], row[1], int(row[2]), int(row[3]),
@@ -245,18 +245,12 @@ def assignSeedsToSubsclusters(subClusters, seeds):
 
 def printSubClusters(output, subClusters):
 
-    output = open(output, "w")
-
     for subCluster in subClusters:
         subCluster.printToFile(output)
 
-    output.close()
-
 
 def printPairs(output, subClusters, topN):
 
-    output = open(output, "w")
-
     for subCluster in subClusters:
         subCluster.seeds.sort(reverse=True)
         for counter, seed in enumerate(subCluster.seeds):
@@ -267,13 +261,25 @@ def printPairs(output, subClusters, topN):
             if counter == topN - 1:
                 break
 
-    output.close()
 
-
-def split(clusterFile, lowThreshold, highThreshold, maxProteinsPerSeed,
+def split(rows, lowThreshold, highThreshold, maxProteinsPerSeed,
           seedRegions, alignmentPairs):
-
-    seeds, CDSBorders = loadSeeds(clusterFile)
+    """Split a seed cluster into subclusters
+
+    Args:
+        rows: Hits of the cluster. Coordinates and scores may be given as
+              strings or numbers.
+        lowThreshold (float): A subcluster ends where the seed coverage drops
+                              to this fraction of the mean CDS coverage
+        highThreshold (float): A new subcluster starts where the seed coverage
+                               rises to this fraction of the mean CDS
+                               coverage
+        maxProteinsPerSeed (int): Maximum number of best scoring proteins
+                                  paired with each seed region
+        seedRegions: Open output file for seed regions
+        alignmentPairs: Open output file for alignment pairs
+    """
+    seeds, CDSBorders = loadSeeds(rows)
     seedBorders = makeSeedBorders(seeds)
     blocks, maxCoverage, meanCoverage = computeCoverage(seedBorders)
 
@@ -289,8 +295,11 @@ def split(clusterFile, lowThreshold, highThreshold, maxProteinsPerSeed,
 
 def main():
     args = parseCmd()
-    split(args.input, args.lowThreshold, args.highThreshold,
-          args.maxProteinsPerSeed, args.seedRegions, args.alignmentPairs)
+    with open(args.seedRegions, "w") as seedRegions, \
+            open(args.alignmentPairs, "w") as alignmentPairs:
+        split(csv.reader(open(args.input), delimiter='\t'), args.lowThreshold,
+              args.highThreshold, args.maxProteinsPerSeed, seedRegions,
+              alignmentPairs)
 
 
 def parseCmd():
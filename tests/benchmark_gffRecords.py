@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# Author: Tomas Bruna
+#
+# Microbenchmark of GFF reading, attribute lookups and writing. The csv module
+# with a regex search per attribute, used by the post-processing scripts
+# before, is compared with the shared gffRecords module.
+
+import argparse
+import csv
+import os
+import re
+import sys
+import time
+
+testDir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(testDir + "/../bin")
+
+from gffRecords import GffWriter, readGff
+
+ATTRIBUTES = ["prot", "seed_gene_id", "al_score", "topProt"]
+
+
+def extractFeature(text, feature):
+    match = re.search("(^|[ ;])" + feature + '=([^;]+);', text)
+    if match:
+        return match.groups()[1]
+    return None
+
+
+def csvRegex(gff, output):
+    with open(output, "w") as out:
+        for row in csv.reader(open(gff), delimiter='\t'):
+            for attribute in ATTRIBUTES:
+                extractFeature(row[8], attribute)
+            out.write("\t".join(row) + "\n")
+
+
+def records(gff, output):
+    with GffWriter(output) as out:
+        for row in readGff(gff):
+            for attribute in ATTRIBUTES:
+                row.attribute(attribute)
+            out.write(row)
+
+
+def measure(function, gff, repeats):
+    best = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        function(gff, os.devnull)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    args = parseCmd()
+    rows = sum(1 for line in open(args.input))
+    print("Rows: " + str(rows) + ", attribute lookups per row: " +
+          str(len(ATTRIBUTES)) + ", best of " + str(args.repeats))
+    baseline = measure(csvRegex, args.input, args.repeats)
+    print("csv + regex:   {:.3f} s".format(baseline))
+    current = measure(records, args.input, args.repeats)
+    print("gffRecords:    {:.3f} s ({:.2f}x)".format(current,
+                                                     baseline / current))
+
+
+def parseCmd():
+
+    parser = argparse.ArgumentParser(description='Compare the speed of GFF \
+        parsing with the csv module and regex attribute searches with the \
+        gffRecords module.')
+
+    parser.add_argument('input', metavar='spaln.gff', type=str, nargs='?',
+                        default=testDir +
+                        "/test_processSpalnOutput/Spaln/spaln.gff",
+                        help='Input gff file. Default = Spaln output from \
+                        the test_processSpalnOutput test.')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='Number of measurements. Default = 3.')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
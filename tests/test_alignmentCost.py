@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# Author: Tomas Bruna
+#
+# Tests of the Spaln cost model and of the command server which measures
+# Spaln alignments
+
+import unittest
+import sys
+import os
+import json
+import tempfile
+
+testDir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(testDir + "/../bin")
+
+from alignmentCost import CostModel, MIN_MEASUREMENTS
+from commandServer import CommandServer
+
+
+def addMeasurements(model, mode, count, cpuPerCell):
+    for i in range(count):
+        gene = 1000 + 100 * i
+        protein = 200 + 10 * i
+        model.add(mode, gene, protein, cpuPerCell * gene * protein / 1e6,
+                  1000 + i)
+
+
+class TestCostModel(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = self.dir.name + "/model.json"
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def counts(self):
+        with open(self.path) as f:
+            return {mode: stats["n"] for mode, stats in
+                    json.load(f)["modes"].items()}
+
+    def testNotFittedWithFewMeasurements(self):
+        model = CostModel(self.path)
+        addMeasurements(model, "-Q3", MIN_MEASUREMENTS - 1, 1)
+        model.fit()
+        self.assertFalse(model.isFitted("-Q3"))
+        self.assertIsNone(model.predict("-Q3", 1000, 100))
+
+    def testSaveAndLoad(self):
+        model = CostModel(self.path)
+        addMeasurements(model, "-Q7", MIN_MEASUREMENTS, 2)
+        model.save()
+        loaded = CostModel(self.path)
+        self.assertTrue(loaded.isFitted("-Q7"))
+        self.assertAlmostEqual(loaded.predict("-Q7", 2000, 500)[0], 2.0,
+                               places=3)
+
+    def testConcurrentRunsAreMerged(self):
+        # Two runs load the same model and save their measurements
+        first = CostModel(self.path)
+        second = CostModel(self.path)
+        addMeasurements(first, "-Q3", 5, 1)
+        addMeasurements(second, "-Q3", 7, 1)
+        addMeasurements(second, "-Q7", 3, 1)
+        first.save()
+        second.save()
+        self.assertEqual(self.counts(), {"-Q3": 12, "-Q7": 3})
+        self.assertTrue(second.isFitted("-Q3"))
+
+        # Saving again does not add the same measurements twice
+        first.save()
+        self.assertEqual(self.counts(), {"-Q3": 12, "-Q7": 3})
+
+
+class TestCommandServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = CommandServer()
+
+    def tearDown(self):
+        self.server.close()
+
+    def testPipeline(self):
+        output, usage = self.server.run([["printf", "b\\na\\n"], ["sort"]])
+        self.assertEqual(output, b"a\nb\n")
+        self.assertEqual([status for status, cpu, memory in usage], [0, 0])
+        self.assertTrue(all(memory > 0 for status, cpu, memory in usage))
+
+    def testExitStatus(self):
+        output, usage = self.server.run([["sh", "-c", "exit 3"]])
+        self.assertEqual(usage[0][0], 3)
+        # The server keeps running after a failed command
+        output, usage = self.server.run([["echo", "ok"]])
+        self.assertEqual(output, b"ok\n")
+
+    def testMissingCommand(self):
+        with open(os.devnull, "w") as devnull:
+            stderr = os.dup(2)
+            os.dup2(devnull.fileno(), 2)
+            try:
+                output, usage = self.server.run([["nonexistentCommand"]])
+            finally:
+                os.dup2(stderr, 2)
+                os.close(stderr)
+        self.assertEqual(usage[0][0], 127)
+
+    def testServerExited(self):
+        self.server.process.kill()
+        self.server.process.wait()
+        with self.assertRaises(RuntimeError):
+            self.server.run([["echo", "ok"]])
+
+
+if __name__ == '__main__':
+    unittest.main()
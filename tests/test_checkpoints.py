@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# Author: Tomas Bruna
+#
+# Tests of the checkpoint manifest used by prothint.py --resume
+
+import unittest
+import sys
+import os
+import io
+import shutil
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+
+testDir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(testDir + "/../bin")
+
+import checkpoints
+import prothint
+import resourceUsage
+
+
+def write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def touch(path, shift):
+    """Change the modification time of a file without changing its content"""
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + shift))
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.input = self.dir.name + "/input.txt"
+        self.output = self.dir.name + "/output.txt"
+        self.manifestFile = self.dir.name + "/checkpoints.json"
+        write(self.input, "input\n")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def runStage(self, manifest, name="stage", params={"a": 1},
+                 inputs=None, outputs=None, text="output\n"):
+        """Execute a fake stage which writes its output, if it is not valid
+
+        Returns:
+            bool: True if the stage was executed
+        """
+        if inputs is None:
+            inputs = {"input": self.input}
+        if outputs is None:
+            outputs = [self.output]
+        if manifest.isValid(name, inputs, params, outputs):
+            return False
+        fingerprints = manifest.fingerprintInputs(inputs)
+        for output in outputs:
+            write(output, text)
+        manifest.record(name, fingerprints, params, outputs, result=[1, 2])
+        return True
+
+    def resumed(self, hashContents=True):
+        return checkpoints.Manifest(self.manifestFile, True, hashContents)
+
+    def testSkipUnchanged(self):
+        self.assertTrue(self.runStage(checkpoints.Manifest(self.manifestFile,
+                                                           False)))
+        manifest = self.resumed()
+        self.assertFalse(self.runStage(manifest))
+        self.assertEqual(manifest.result("stage"), [1, 2])
+
+    def testSkipUnchangedWithoutHashes(self):
+        self.runStage(checkpoints.Manifest(self.manifestFile, False, False))
+        self.assertFalse(self.runStage(self.resumed()))
+
+    def testInputChanged(self):
+        self.runStage(checkpoints.Manifest(self.manifestFile, False))
+        write(self.input, "changed\n")
+        self.assertTrue(self.runStage(self.resumed()))
+
+    def testInputChangedSameSize(self):
+        self.runStage(checkpoints.Manifest(self.manifestFile, False))
+        write(self.input, "INPUT\n")
+        touch(self.input, 10 ** 9)
+        self.assertTrue(self.runStage(self.resumed()))
+
+    def testParameterChanged(self):
+        self.runStage(checkpoints.Manifest(self.manifestFile, False))
+        self.assertTrue(self.runStage(self.resumed(), params={"a": 2}))
+
+    def testOutputChanged(self):
+        self.runStage(checkpoints.Manifest(self.manifestFile, False))
+        write(self.output, "modified\n")
+        self.assertTrue(self.runStage(self.resumed()))
+
+    def testOutputMissing(self):
+        self.runStage(checkpoints.Manifest(self.manifestFile, False))
+        os.remove(self.output)
+        self.assertTrue(self.runStage(self.resumed()))
+
+    def testTouchedFileIsHashed(self):
+        # Only the modification time changed, the recorded hash matches
+        self.runStage(checkpoints.Manifest(self.manifestFile, False))
+        touch(self.input, 10 ** 9)
+        self.assertFalse(self.runStage(self.resumed()))
+
+    def testTouchedFileWithoutHash(self):
+        # Without a recorded hash, a changed modification time is treated as
+        # a change of the file
+        self.runStage(checkpoints.Manifest(self.manifestFile, False, False))
+        touch(self.input, 10 ** 9)
+        self.assertTrue(self.runStage(self.resumed()))
+
+    def testOutputModifiedInPlace(self):
+        for hashContents in [True, False]:
+            manifest = checkpoints.Manifest(self.manifestFile, False,
+                                            hashContents)
+            self.runStage(manifest)
+            # A subsequent stage reads the output and rewrites it
+            self.runStage(manifest, name="inPlace",
+                          inputs={"input": self.output},
+                          text="updated output\n")
+
+            manifest = self.resumed(hashContents)
+            self.assertFalse(self.runStage(manifest))
+            self.assertFalse(self.runStage(manifest, name="inPlace",
+                                           inputs={"input": self.output}))
+
+            # Modification which is not recorded invalidates both stages
+            write(self.output, "other output\n")
+            manifest = self.resumed(hashContents)
+            self.assertTrue(self.runStage(manifest, name="inPlace",
+                                          inputs={"input": self.output},
+                                          text="updated output\n"))
+            self.assertTrue(self.runStage(manifest))
+
+    def testNoHashesWithoutResume(self):
+        self.runStage(checkpoints.Manifest(self.manifestFile, False, False))
+        manifest = self.resumed()
+        stage = manifest.stages["stage"]
+        self.assertIsNone(stage["inputs"]["input"]["sha1"])
+        self.assertIsNone(stage["outputs"][os.path.abspath(self.output)]
+                          ["sha1"])
+
+
+class TestIterativeResume(unittest.TestCase):
+    """Stages of the iterative mode of ProtHint are skipped when a run is
+    resumed. External tools are replaced by functions which write dummy
+    outputs.
+    """
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.TemporaryDirectory()
+        self.workDir = self.dir.name + "/work"
+        os.mkdir(self.workDir)
+        self.args = SimpleNamespace(nonCanonicalSpliceSites=False,
+                                    lowMemory=False)
+        for name in ["geneSeeds", "prevGeneSeeds", "prevSpalnGff",
+                     "genome"]:
+            path = self.dir.name + "/" + name
+            write(path, name + "\n")
+            setattr(self.args, name, path)
+        self.executed = []
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.dir.cleanup()
+
+    def callScript(self, name, args, cwd=None):
+        self.executed.append(name)
+        if name == "print_longest_isoform.py":
+            source, target = args.split(" > ")
+            shutil.copyfile(source, target)
+        elif name == "select_for_next_iteration.py":
+            write("uniqueSeeds.gtf", "unique seeds\n")
+            write("prevHints.gff", "previous hints\n")
+
+    def stage(self, name, outputs):
+        def execute(*args):
+            self.executed.append(name)
+            for output in outputs:
+                write(self.workDir + "/" + output, name + "\n")
+        return execute
+
+    def searchAndAlign(self, args, diamondDb):
+        os.makedirs(self.workDir + "/Spaln", exist_ok=True)
+        prothint.runStage("runSpaln", {"seedProteins": self.workDir +
+                                       "/seed_proteins.faa"}, {},
+                          [self.workDir + "/Spaln/spaln.gff"],
+                          self.stage("runSpaln", ["Spaln/spaln.gff"]))
+        return self.workDir + "/diamond.out"
+
+    def runIteration(self, resume):
+        manifest = checkpoints.Manifest(self.workDir + "/checkpoints.json",
+                                        resume, hashContents=resume)
+        report = resourceUsage.ResourceReport(self.workDir + "/timing.json",
+                                              prothint.VERSION)
+        with mock.patch.multiple(
+                prothint, workDir=self.workDir, genome=self.args.genome,
+                threads="1", resume=resume, manifest=manifest, report=report,
+                callScript=self.callScript,
+                translateSeeds=self.stage("translateSeeds",
+                                          ["seed_proteins.faa",
+                                           "gene_stat.yaml"]),
+                diamondDatabase=lambda args, threads: "diamond.dmnd",
+                searchAndAlign=self.searchAndAlign,
+                processSpalnOutput=self.stage("processSpalnOutput",
+                                              prothint.FINAL_OUTPUTS)), \
+                mock.patch.object(sys, "stderr", io.StringIO()):
+            prothint.nextIteration(self.args)
+
+    def testResumeSkipsStages(self):
+        self.runIteration(False)
+        self.assertIn("select_for_next_iteration.py", self.executed)
+        self.assertIn("processSpalnOutput", self.executed)
+        with open(self.workDir + "/Spaln/spaln.gff") as f:
+            self.assertEqual(f.read(), "runSpaln\nprevious hints\n")
+
+        self.executed = []
+        self.runIteration(True)
+        self.assertEqual(self.executed, [])
+        with open(self.workDir + "/Spaln/spaln.gff") as f:
+            self.assertEqual(f.read(), "runSpaln\nprevious hints\n")
+
+    def testResumeAfterChangedSeeds(self):
+        self.runIteration(False)
+        write(self.args.geneSeeds, "modified seeds\n")
+        self.executed = []
+        self.runIteration(True)
+        self.assertIn("select_for_next_iteration.py", self.executed)
+        self.assertIn("translateSeeds", self.executed)
+
+
+if __name__ == '__main__':
+    unittest.main()
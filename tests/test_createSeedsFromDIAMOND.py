@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# Author: Tomas Bruna
+#
+# Tests of the clustering of seeds in createSeedsFromDIAMOND.py. Cluster
+# labels must be the same as the labels of the original clustering, which
+# followed parent pointers of clusters without path compression.
+
+import unittest
+import sys
+import os
+import random
+
+testDir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(testDir + "/../bin")
+
+from createSeedsFromDIAMOND import ClusterSets
+
+
+class PointerClusters():
+    """The original clustering with parent pointers"""
+
+    def __init__(self):
+        self.clusters = []
+
+    def add(self):
+        self.clusters.append(len(self.clusters))
+        return len(self.clusters) - 1
+
+    def root(self, i):
+        while self.clusters[i] != i:
+            i = self.clusters[i]
+        return i
+
+    def join(self, clusterId, otherId):
+        self.clusters[self.root(clusterId)] = self.root(otherId)
+
+    def setLabels(self):
+        return [str(self.root(i)) for i in range(len(self.clusters))]
+
+
+class TestClusterSets(unittest.TestCase):
+
+    def compare(self, operations):
+        sets = ClusterSets()
+        pointers = PointerClusters()
+        for operation in operations:
+            if operation is None:
+                self.assertEqual(sets.add(), pointers.add())
+            else:
+                sets.join(*operation)
+                pointers.join(*operation)
+        self.assertEqual(len(sets), len(pointers.clusters))
+        self.assertEqual(sets.setLabels(), pointers.setLabels())
+
+    def testRandomJoins(self):
+        for seed in range(300):
+            generator = random.Random(seed)
+            operations = []
+            clusters = 0
+            for i in range(generator.randint(1, 200)):
+                if clusters == 0 or generator.random() < 0.4:
+                    operations.append(None)
+                    clusters += 1
+                elif generator.random() < 0.7:
+                    # Joins of the current cluster, as in clusterSeeds
+                    operations.append((clusters - 1,
+                                       generator.randrange(clusters)))
+                else:
+                    operations.append((generator.randrange(clusters),
+                                       generator.randrange(clusters)))
+            self.compare(operations)
+
+    def testChains(self):
+        count = 50
+        forward = [None] * count + [(i, i + 1) for i in range(count - 1)]
+        self.compare(forward)
+        backward = [None] * count + [(i + 1, i) for i in range(count - 1)]
+        self.compare(backward)
+        # Each new cluster is joined into the previous one
+        interleaved = [None]
+        for i in range(1, count):
+            interleaved += [None, (i, i - 1)]
+        self.compare(interleaved)
+
+    def testLongChain(self):
+        # A chain of joined singleton clusters, which was quadratic with the
+        # original pointer chasing
+        sets = ClusterSets()
+        count = 100000
+        for i in range(count):
+            sets.add()
+        for i in range(count - 1):
+            sets.join(i, i + 1)
+        self.assertEqual(set(sets.setLabels()), {str(count - 1)})
+
+
+if __name__ == '__main__':
+    unittest.main()
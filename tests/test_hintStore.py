@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# Author: Tomas Bruna
+#
+# Tests of the cached columnar store of raw hints
+
+import unittest
+import sys
+import os
+import json
+import shutil
+import tempfile
+from unittest import mock
+
+testDir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(testDir + "/../bin")
+
+import hintStore
+from hintStore import HintStore
+
+SPALN_GFF = testDir + "/test_processSpalnOutput/Spaln/spaln.gff"
+
+
+def parseFails(rows):
+    raise AssertionError("The GFF file was parsed instead of the cache")
+
+
+class TestHintStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.gff = self.dir.name + "/spaln.gff"
+        with open(SPALN_GFF) as source, open(self.gff, "w") as target:
+            for i, line in enumerate(source):
+                if i == 500:
+                    break
+                target.write(line)
+        self.cacheFile = self.gff + hintStore.CACHE_SUFFIX
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def assertSameStore(self, store, other):
+        self.assertEqual(len(store), len(other))
+        for name in hintStore.TEXT_COLUMNS:
+            self.assertEqual(store.decoded(name), other.decoded(name))
+        for name, typeCode in hintStore.NUMERIC_COLUMNS:
+            if name != "alScore":
+                self.assertEqual(store.columns[name], other.columns[name])
+        self.assertEqual(store.alScores(), other.alScores())
+
+    def loadCached(self):
+        with mock.patch.object(hintStore, "parseColumns", parseFails):
+            return HintStore(self.gff)
+
+    def rewriteHeader(self, key, value):
+        with open(self.cacheFile, "rb") as f:
+            header = json.loads(f.readline())
+            data = f.read()
+        header[key] = value
+        with open(self.cacheFile, "wb") as f:
+            f.write(json.dumps(header).encode() + b"\n")
+            f.write(data)
+
+    def testCacheCreatedAndReused(self):
+        parsed = HintStore(self.gff)
+        self.assertEqual(len(parsed), 500)
+        self.assertTrue(os.path.isfile(self.cacheFile))
+        self.assertSameStore(self.loadCached(), parsed)
+
+    def testParallelCache(self):
+        HintStore(self.gff)
+        with open(self.cacheFile, "rb") as f:
+            cache = f.read()
+        os.remove(self.cacheFile)
+        store = HintStore(self.gff, threads=3)
+        with open(self.cacheFile, "rb") as f:
+            self.assertEqual(f.read(), cache)
+        self.assertSameStore(self.loadCached(), store)
+
+    def testWithoutCache(self):
+        HintStore(self.gff, cache=False)
+        self.assertFalse(os.path.isfile(self.cacheFile))
+
+    def testModifiedGffIsParsed(self):
+        HintStore(self.gff)
+        with open(self.gff, "a") as f:
+            f.write("X\tSpaln_Parser\tCDS\t100\t200\t.\t-\t.\tprot=p; "
+                    "exon_id=1; eScore=10; seed_gene_id=1_g;\n")
+        store = HintStore(self.gff)
+        self.assertEqual(len(store), 501)
+        self.assertEqual(store.decoded("protein")[-1], "p")
+        # The cache is rebuilt for the modified file
+        self.assertEqual(len(self.loadCached()), 501)
+
+    def testNonIntegerScore(self):
+        with open(self.gff, "a") as f:
+            for score in ["2.5", "7"]:
+                f.write("X\tSpaln_Parser\tIntron\t100\t200\t" + score +
+                        "\t-\t.\tprot=p; al_score=0.5; seed_gene_id=1_g;\n")
+        store = HintStore(self.gff)
+        self.assertEqual(store.scores()[-2:], ["2.5", "7"])
+        self.assertEqual(store.scores()[0], ".")
+        self.assertEqual(self.loadCached().scores()[-2:], ["2.5", "7"])
+
+    def testReplacedGffIsParsed(self):
+        # A file with the same size but a different modification time
+        HintStore(self.gff)
+        shutil.copy(self.gff, self.gff + ".copy")
+        stat = os.stat(self.gff)
+        os.utime(self.gff + ".copy", ns=(stat.st_atime_ns,
+                                         stat.st_mtime_ns + 10 ** 9))
+        os.replace(self.gff + ".copy", self.gff)
+        with self.assertRaises(AssertionError):
+            self.loadCached()
+
+    def testVersionMismatch(self):
+        parsed = HintStore(self.gff)
+        self.rewriteHeader("version", hintStore.CACHE_VERSION + 1)
+        with self.assertRaises(AssertionError):
+            self.loadCached()
+        self.assertSameStore(HintStore(self.gff), parsed)
+        self.assertSameStore(self.loadCached(), parsed)
+
+    def testByteorderMismatch(self):
+        HintStore(self.gff)
+        other = "big" if sys.byteorder == "little" else "little"
+        self.rewriteHeader("byteorder", other)
+        with self.assertRaises(AssertionError):
+            self.loadCached()
+
+
+if __name__ == '__main__':
+    unittest.main()
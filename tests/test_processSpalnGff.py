@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# Author: Tomas Bruna
+#
+# Tests of the parallel and low memory modes of raw hint processing. Outputs
+# of these modes must be identical to the outputs of a single process.
+
+import unittest
+import sys
+import os
+import subprocess
+import tempfile
+
+testDir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(testDir + "/../bin")
+
+import combineRawHints
+import processSpalnGff
+from gffRecords import readGff, readGffRange, splitFile
+
+SPALN_GFF = testDir + "/test_processSpalnOutput/Spaln/spaln.gff"
+DIAMOND = testDir + "/test_processSpalnOutput/diamond/diamond.out"
+OUTPUTS = ["prothint.gff", "evidence.gff", "top_chains.gff"]
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+class TestSplitFile(unittest.TestCase):
+
+    def testRangesCoverFile(self):
+        rows = list(readGff(SPALN_GFF))
+        for parts in [1, 2, 7, 100]:
+            ranges = splitFile(SPALN_GFF, parts)
+            self.assertEqual(len(ranges), parts)
+            self.assertEqual([row for start, end in ranges
+                              for row in readGffRange(SPALN_GFF, start, end)],
+                             rows)
+
+
+class TestParallel(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.spalnGff = self.dir.name + "/spaln.gff"
+        # Raw hints flagged by top proteins
+        with open(self.spalnGff, "w") as f:
+            subprocess.check_call([testDir + "/../bin/flag_top_proteins.py",
+                                   SPALN_GFF, DIAMOND], stdout=f)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def process(self, name, **kwargs):
+        folder = self.dir.name + "/" + name
+        os.mkdir(folder)
+        processSpalnGff.process(self.spalnGff,
+                                *[folder + "/" + out for out in OUTPUTS],
+                                False, cache=False, **kwargs)
+        return [read(folder + "/" + out) for out in OUTPUTS]
+
+    def testCombineHints(self):
+        expected = [hint.format() for hint in
+                    combineRawHints.combineHints(self.spalnGff).values()]
+        hints = combineRawHints.combineHintsParallel(self.spalnGff, 3)
+        self.assertEqual([hint.format() for hint in hints.values()],
+                         expected)
+
+    def testProcessThreads(self):
+        expected = self.process("serial")
+        self.assertTrue(all(expected))
+        self.assertEqual(self.process("threads", threads=3), expected)
+
+    def testProcessLowMemory(self):
+        self.assertEqual(self.process("lowMemory", lowMemory=True),
+                         self.process("serial"))
+
+
+if __name__ == '__main__':
+    unittest.main()
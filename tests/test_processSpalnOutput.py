@@ -26,6 +26,8 @@ class TestProcessSpalnOutput(unittest.TestCase):
         os.remove("prothint.gff")
         os.remove("evidence.gff")
         os.remove("prothint_augustus.gff")
+        os.remove("top_chains.gff")
+        os.remove("Spaln/spaln.gff.columns")
 
 if __name__ == '__main__':
     testDir = os.path.abspath(os.path.dirname(__file__))
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# Author: Tomas Bruna
+#
+# Tests of the ordering and batching of seed gene-protein pairs in
+# splicedAlignment.py
+
+import unittest
+import sys
+import os
+import random
+
+testDir = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(testDir + "/../bin")
+
+import splicedAlignment
+
+
+class TestBatches(unittest.TestCase):
+
+    def randomPairs(self, count, seed):
+        generator = random.Random(seed)
+        pairs = [("gene" + str(i), "prot" + str(i)) for i in range(count)]
+        costs = [generator.choice([1, 10, 100, 10000]) *
+                 generator.randint(1, 50) for i in range(count)]
+        return pairs, costs
+
+    def testOrderByCost(self):
+        pairs = [("a", "1"), ("b", "2"), ("c", "3"), ("d", "4")]
+        costs = [5, 20, 5, 7]
+        sortedPairs, sortedCosts = splicedAlignment.orderByCost(pairs, costs)
+        self.assertEqual(sortedCosts, [20, 7, 5, 5])
+        # Pairs with equal costs keep their order
+        self.assertEqual(sortedPairs,
+                         [("b", "2"), ("d", "4"), ("a", "1"), ("c", "3")])
+
+    def testBatchesCoverAllPairsInOrder(self):
+        for seed in range(20):
+            for cores in [1, 2, 8, 64]:
+                pairs, costs = splicedAlignment.orderByCost(
+                    *self.randomPairs(500, seed))
+                batches = splicedAlignment.makeBatches(pairs, costs, cores)
+                self.assertEqual([pair for batch in batches
+                                  for pair in batch], pairs)
+                self.assertTrue(all(batches))
+                self.assertTrue(all(len(batch) <=
+                                    splicedAlignment.MAX_BATCH_SIZE
+                                    for batch in batches))
+
+    def testExpensivePairsAlone(self):
+        pairs = [("gene" + str(i), "prot") for i in range(10)]
+        costs = [1000, 900] + [1] * 8
+        batches = splicedAlignment.makeBatches(pairs, costs, 4)
+        self.assertEqual(batches[0], [pairs[0]])
+        self.assertEqual(batches[1], [pairs[1]])
+
+    def testBatchesShrink(self):
+        pairs = [("gene" + str(i), "prot") for i in range(1000)]
+        costs = [1] * 1000
+        batches = splicedAlignment.makeBatches(pairs, costs, 4)
+        sizes = [len(batch) for batch in batches]
+        self.assertEqual(sizes, sorted(sizes, reverse=True))
+        self.assertGreater(sizes[0], sizes[-1])
+        self.assertEqual(sizes[-1], 1)
+
+    def testEmpty(self):
+        self.assertEqual(splicedAlignment.makeBatches([], [], 4), [])
+
+
+if __name__ == '__main__':
+    unittest.main()